@@ -1,3 +1,7 @@
 #!/bin/bash
 
-docker run -v ./datasets/imports/:/app/imports/ -v ./csv/:/app/csv -v ./cqpp/mimic:/app/cqpp  --rm ghcr.io/ingef/conquery-backend:develop preprocess --desc /app/imports --in /app/csv --out /app/cqpp
\ No newline at end of file
+# request.py --watch uploads the cqpps until the marker of a completed run appears
+rm -f ./cqpp/mimic/preprocess.done
+
+docker run -v ./datasets/imports/:/app/imports/ -v ./csv/:/app/csv -v ./cqpp/mimic:/app/cqpp  --rm ghcr.io/ingef/conquery-backend:develop preprocess --desc /app/imports --in /app/csv --out /app/cqpp \
+  && touch ./cqpp/mimic/preprocess.done
@@ -1,6 +1,6 @@
 """defined actions and a list of actions arranged in the order of execution"""
-from attr import define
-from typing import Callable, Optional, Set
+from attr import define, field
+from typing import Callable, FrozenSet, Iterable, List, Optional, Set
 
 
 # action names starting with this tag are excluded
@@ -12,6 +12,8 @@ exclude_tag = "^"
 class Action:
     name: str
     callable: Callable
+    # names of actions that must have finished before this one may start
+    depends_on: FrozenSet[str] = field(factory=frozenset, converter=frozenset)
 
     def __hash__(self):
         return hash(repr(self))
@@ -32,3 +34,42 @@ def get_action(name: Optional[str], all_actions: Set[Action]) -> Action:
 def get_actions(subset: Set[str], all_actions: Set[Action]) -> Set[Action]:
     """Returns the actions with these names."""
     return {action for action in all_actions if action.name in subset}
+
+
+def get_dependents(name: str, all_actions: Iterable[Action]) -> Set[str]:
+    """Returns the names of the actions that depend on this one, directly or through others."""
+    dependents: Set[str] = set()
+    changed = True
+
+    while changed:
+        found = {action.name for action in all_actions if action.depends_on & (dependents | {name})}
+        changed = not found <= dependents
+        dependents |= found
+
+    return dependents
+
+
+def validate_dependencies(all_actions: Iterable[Action]) -> List[Action]:
+    """
+    Checks that every dependency names a known action and that the dependencies are acyclic.
+    Returns the actions in an order in which every action comes after its dependencies.
+    """
+    by_name = {action.name: action for action in all_actions}
+
+    for action in by_name.values():
+        unknown = action.depends_on - by_name.keys()
+        if unknown:
+            raise ValueError(f"Action {action.name} depends on unknown actions {unknown}")
+
+    ordered: List[Action] = []
+    done: Set[str] = set()
+
+    while len(done) < len(by_name):
+        ready = [action for name, action in by_name.items() if name not in done and action.depends_on <= done]
+        if not ready:
+            raise ValueError(f"Cyclic dependencies between actions {set(by_name.keys()) - done}")
+
+        ordered.extend(ready)
+        done.update(action.name for action in ready)
+
+    return ordered
@@ -0,0 +1,79 @@
+"""wraps action callables to attribute requests to them and optionally profile them"""
+import cProfile
+import io
+import logging
+import pstats
+import time
+import tracemalloc
+
+from functools import wraps
+from pathlib import Path
+from typing import Optional
+
+from actions.actions_def import Action
+from metrics import current_action
+
+PROFILE_TOP = 30
+
+
+def write_profile_report(
+        action: str,
+        profile_dir: Path,
+        profiler: cProfile.Profile,
+        allocations: tracemalloc.Snapshot,
+        before: tracemalloc.Snapshot,
+        peak: int,
+        elapsed: float,
+) -> Path:
+    profiler.dump_stats(str(profile_dir / f"{action}.prof"))
+
+    report = io.StringIO()
+    report.write(f"Action {action}: {elapsed:.2f}s wall time, {peak / 1024 / 1024:.1f} MB peak traced memory\n\n")
+
+    report.write(f"Top {PROFILE_TOP} functions by cumulative CPU time (this action's thread)\n")
+    pstats.Stats(profiler, stream=report).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(PROFILE_TOP)
+
+    report.write(f"\nTop {PROFILE_TOP} allocation sites still alive after the action\n")
+    for stat in allocations.compare_to(before, "lineno")[:PROFILE_TOP]:
+        report.write(f"{stat}\n")
+
+    path = profile_dir / f"{action}.txt"
+    path.write_text(report.getvalue())
+    return path
+
+
+def instrument(action: Action, profile_dir: Optional[Path] = None) -> Action:
+    """
+    Returns the action with a callable that marks all its requests with its name for the metrics.
+    With a profile_dir, it also records CPU (cProfile) and allocations (tracemalloc) and writes a report per action.
+    Allocations are traced for the whole process, so actions should not run concurrently while profiling.
+    """
+    @wraps(action.callable)
+    def run(**kwargs):
+        current_action.set(action.name)
+
+        if profile_dir is None:
+            return action.callable(**kwargs)
+
+        profile_dir.mkdir(parents=True, exist_ok=True)
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+
+        profiler = cProfile.Profile()
+        start = time.monotonic()
+        profiler.enable()
+
+        try:
+            return action.callable(**kwargs)
+        finally:
+            profiler.disable()
+            elapsed = time.monotonic() - start
+            allocations = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            report = write_profile_report(action.name, profile_dir, profiler, allocations, before, peak, elapsed)
+            logging.info(f"Wrote profile of {action.name} to {report}")
+
+    return Action(action.name, run, action.depends_on)
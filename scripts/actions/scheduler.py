@@ -0,0 +1,57 @@
+"""runs requested actions concurrently as soon as their dependencies have finished"""
+import logging
+import time
+
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional, Set
+
+from actions.actions_def import Action, validate_dependencies
+
+
+def run_actions(all_actions: List[Action], request: Set[str], max_workers: Optional[int] = None, **kwargs) -> List[Any]:
+    """
+    Runs every requested action once all of its requested dependencies have finished.
+    Independent actions run at the same time, each on its own worker thread.
+    Dependencies on actions that were not requested are considered satisfied (e.g. when using --from),
+    so the selection made by get_request is kept as is.
+    Returns the collected failures of all actions.
+    """
+    selected = [action for action in validate_dependencies(all_actions) if action.name in request]
+
+    # Remaining requested dependencies per action that has not been started yet
+    pending: Dict[str, Set[str]] = {action.name: set(action.depends_on & request) for action in selected}
+
+    failures: List[Any] = []
+
+    if not selected:
+        return failures
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(selected), thread_name_prefix="action") as executor:
+        running: Dict[Future, Action] = {}
+        started: Dict[str, float] = {}
+
+        def submit_ready():
+            for action in selected:
+                if action.name in pending and not pending[action.name]:
+                    del pending[action.name]
+                    logging.debug(f"Starting action {action.name}")
+                    started[action.name] = time.monotonic()
+                    running[executor.submit(action.callable, **kwargs)] = action
+
+        submit_ready()
+
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                action = running.pop(future)
+                failures.extend(future.result())
+
+                logging.info(f"Finished action {action.name} after {time.monotonic() - started[action.name]:.1f}s")
+
+                for dependencies in pending.values():
+                    dependencies.discard(action.name)
+
+            submit_ready()
+
+    return failures
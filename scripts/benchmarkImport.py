@@ -0,0 +1,182 @@
+#!python3
+"""
+Runs the import actions against a local mock of the admin API, for several --parallelism values and dataset counts,
+and reports wall time, requests/s and MB/s per action.
+"""
+
+import json
+import logging
+import shutil
+import tempfile
+import time
+
+# Argument Parser
+from pathlib import Path
+from typing import Any, Dict, List
+
+from common import configure_logger, get_configured_arg_parser
+from mockapi import BackgroundServer, MockConquery, MockSettings
+from request import get_action_arguments, get_actions, get_request_arg_parser
+
+root = Path(__file__).parent.parent
+
+BENCHMARK_ACTIONS = ["table", "concept", "cqpp", "mapping", "search", "structure", "preview", "update"]
+
+# json fixtures per action: (folder, suffix) of the files uploaded by it
+JSON_FIXTURES = {
+    "table": ("tables", ".table.json"),
+    "concept": ("concepts", ".concept.json"),
+    "mapping": ("mappings", ".mapping.json"),
+    "search": ("searchIndex", ".filter.json"),
+}
+
+
+def write_fixtures(work: Path, datasets: int, files: int, cqpps: int, cqpp_size: int) -> Path:
+    """Writes datasets.json, json files and (sparse) cqpps for the given number of datasets, returns the kassen file."""
+    table = (root / "datasets" / "mimic" / "tables" / "admissions.table.json").read_bytes()
+    concept = (root / "datasets" / "mimic" / "concepts" / "patient.concept.json").read_bytes()
+
+    kassen = {}
+
+    for index in range(datasets):
+        dataset = f"bench{index}"
+        kassen[dataset] = {"name": dataset, "label": dataset, "sources": ["bench"], "weight": index}
+
+        json_dir = work / "json" / dataset
+        for action, (folder, suffix) in JSON_FIXTURES.items():
+            (json_dir / folder).mkdir(parents=True, exist_ok=True)
+            content = concept if action == "concept" else table
+            for file in range(files):
+                (json_dir / folder / f"{action}{file}{suffix}").write_bytes(content)
+
+        (json_dir / "preview.json").write_bytes(concept)
+        (json_dir / f"structure_{dataset}.json").write_bytes(concept)
+
+        cqpp_dir = work / "cqpp" / dataset / "cqpp"
+        cqpp_dir.mkdir(parents=True, exist_ok=True)
+        for file in range(cqpps):
+            with (cqpp_dir / f"table{file}.bench.cqpp").open("wb") as cqpp:
+                cqpp.truncate(cqpp_size)
+
+    kassen_file = work / "datasets.json"
+    kassen_file.write_text(json.dumps(kassen))
+    return kassen_file
+
+
+def run_benchmark(
+        mock: MockConquery,
+        url: str,
+        work: Path,
+        kassen: Path,
+        actions: List[str],
+        parallelism: int,
+        extra_args: List[str],
+) -> List[Dict[str, Any]]:
+    all_actions = {action.name: action for action in get_actions()}
+    parser = get_request_arg_parser(get_actions())
+
+    arg_dict = vars(parser.parse_args([
+        "--server", url,
+        "--kassen", str(kassen),
+        "--json", str(work / "json"),
+        "--cqpp", str(work / "cqpp"),
+        "--parallelism", str(parallelism),
+        "--progress-interval", "0",
+        *extra_args,
+    ]))
+
+    arguments = get_action_arguments(arg_dict)
+    results = []
+
+    for name in actions:
+        # Upload all cqpps every time
+        for manifest in (work / "cqpp").glob("*/cqpp.*"):
+            manifest.unlink()
+
+        mock.reset()
+
+        start = time.monotonic()
+        failures = all_actions[name].callable(**arguments)
+        elapsed = time.monotonic() - start
+
+        totals = mock.totals()
+        results.append({
+            "action": name,
+            "datasets": len(arguments["datasets"]),
+            "parallelism": parallelism,
+            "seconds": elapsed,
+            "requests": totals.requests,
+            "errors": totals.errors,
+            "failures": len(failures),
+            "requests_per_second": totals.requests / elapsed if elapsed else 0.0,
+            "mb_per_second": totals.bytes / 1024 / 1024 / elapsed if elapsed else 0.0,
+        })
+
+    return results
+
+
+parser = get_configured_arg_parser(with_api=False, description=__doc__)
+
+parser.add_argument('--parallelism', nargs='+', type=int, default=[1, 4, 16], help='--parallelism values to compare.')
+parser.add_argument('--dataset-counts', nargs='+', type=int, default=[1, 4], help='Numbers of datasets to compare.')
+parser.add_argument('--actions', nargs='+', choices=BENCHMARK_ACTIONS, default=BENCHMARK_ACTIONS)
+parser.add_argument('--files', type=int, default=50, help='Json files per action and dataset.')
+parser.add_argument('--cqpps', type=int, default=8, help='Cqpps per dataset.')
+parser.add_argument('--cqpp-size', type=float, default=16, help='Size of a cqpp in MB.')
+parser.add_argument('--latency', type=float, default=0.01, help='Seconds the mock adds to every response.')
+parser.add_argument('--bandwidth', type=float, help='MB/s the mock reads a single request body with.')
+parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests the mock fails with 500.')
+parser.add_argument('--request-args', nargs='*', default=["--retry-backoff", "0.05"],
+                    help='Further arguments for request.py, e.g. `--retries 5`.')
+parser.add_argument('--work', type=Path, help='Folder for the fixtures, a temporary folder by default.')
+parser.add_argument('--out', type=Path, help='Write the results as json to this file.')
+
+if __name__ == "__main__":
+    arg_dict = vars(parser.parse_args())
+
+    configure_logger(arg_dict)
+
+    mock = MockConquery(MockSettings(
+        latency=arg_dict['latency'],
+        bandwidth=arg_dict['bandwidth'] * 1024 * 1024 if arg_dict['bandwidth'] else None,
+        error_rate=arg_dict['error_rate'],
+        seed=0,
+    ))
+    server = BackgroundServer(mock.app())
+    url = server.start()
+
+    work_root = arg_dict['work'] or Path(tempfile.mkdtemp(prefix="import-benchmark-"))
+    results: List[Dict[str, Any]] = []
+
+    try:
+        for datasets in arg_dict['dataset_counts']:
+            work = work_root / str(datasets)
+            kassen = write_fixtures(
+                work, datasets, arg_dict['files'], arg_dict['cqpps'], int(arg_dict['cqpp_size'] * 1024 * 1024)
+            )
+
+            for parallelism in arg_dict['parallelism']:
+                level = logging.getLogger().level
+                # The actions log every request
+                logging.getLogger().setLevel(logging.ERROR)
+                try:
+                    results.extend(run_benchmark(
+                        mock, url, work, kassen, arg_dict['actions'], parallelism, arg_dict['request_args']
+                    ))
+                finally:
+                    logging.getLogger().setLevel(level)
+    finally:
+        server.stop()
+        if not arg_dict['work']:
+            shutil.rmtree(work_root, ignore_errors=True)
+
+    logging.info(f"{'action':<10} {'datasets':>8} {'parallel':>8} {'seconds':>8} {'requests':>8} {'req/s':>8} {'MB/s':>8} {'failed':>6}")
+    for result in results:
+        logging.info(
+            f"{result['action']:<10} {result['datasets']:>8} {result['parallelism']:>8} {result['seconds']:>8.2f}"
+            f" {result['requests']:>8} {result['requests_per_second']:>8.1f} {result['mb_per_second']:>8.1f}"
+            f" {result['failures']:>6}"
+        )
+
+    if arg_dict['out']:
+        arg_dict['out'].write_text(json.dumps(results, indent=2))
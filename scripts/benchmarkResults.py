@@ -0,0 +1,81 @@
+#!python3
+"""
+Downloads the same query result from a local mock's ARROW and CSV result providers, for several result sizes,
+and reports seconds, transferred MB, MB/s and rows/s per format.
+"""
+
+import json
+import logging
+
+# Argument Parser
+from pathlib import Path
+from typing import Any, Dict, List
+
+from requests import Session
+
+from common import configure_logger, get_configured_arg_parser
+from mockapi import BackgroundServer, MockConquery, MockSettings
+from results import DEFAULT_BLOCK_SIZE, DEFAULT_BUFFER_BATCHES, RESULT_FORMATS, CallbackSink, download_result
+
+parser = get_configured_arg_parser(with_api=False, description=__doc__)
+
+parser.add_argument('--rows', nargs='+', type=int, default=[100_000, 1_000_000], help='Result sizes to compare.')
+parser.add_argument('--formats', nargs='+', choices=RESULT_FORMATS, default=RESULT_FORMATS)
+parser.add_argument('--repeat', type=int, default=3, help='Downloads per size and format, the fastest counts.')
+parser.add_argument('--buffer-batches', type=int, default=DEFAULT_BUFFER_BATCHES)
+parser.add_argument('--block-size', type=int, default=DEFAULT_BLOCK_SIZE)
+parser.add_argument('--out', type=Path, help='Write the results as json to this file.')
+
+if __name__ == "__main__":
+    arg_dict = vars(parser.parse_args())
+
+    configure_logger(arg_dict)
+
+    mock = MockConquery(MockSettings(seed=0))
+    server = BackgroundServer(mock.app())
+    api = server.start() + "/api"
+
+    session = Session()
+    results: List[Dict[str, Any]] = []
+
+    try:
+        for rows in arg_dict['rows']:
+            mock.settings.result_rows = rows
+            # Builds the result before timing
+            mock.result_table()
+
+            for result_format in arg_dict['formats']:
+                runs = []
+                for _ in range(arg_dict['repeat']):
+                    level = logging.getLogger().level
+                    logging.getLogger().setLevel(logging.WARNING)
+                    try:
+                        runs.append(download_result(
+                            session, api, "benchmark", CallbackSink(lambda batch: None), [result_format],
+                            buffer_batches=arg_dict['buffer_batches'], block_size=arg_dict['block_size'],
+                        ))
+                    finally:
+                        logging.getLogger().setLevel(level)
+
+                fastest = min(runs, key=lambda stats: stats.seconds)
+                results.append({
+                    "format": result_format,
+                    "rows": fastest.rows,
+                    "batches": fastest.batches,
+                    "seconds": fastest.seconds,
+                    "mb": fastest.bytes / 1024 / 1024,
+                    "mb_per_second": fastest.bytes_per_second / 1024 / 1024,
+                    "rows_per_second": fastest.rows_per_second,
+                })
+    finally:
+        server.stop()
+
+    logging.info(f"{'format':<8} {'rows':>10} {'seconds':>8} {'MB':>8} {'MB/s':>8} {'rows/s':>12}")
+    for result in results:
+        logging.info(
+            f"{result['format']:<8} {result['rows']:>10} {result['seconds']:>8.2f} {result['mb']:>8.1f}"
+            f" {result['mb_per_second']:>8.1f} {result['rows_per_second']:>12.0f}"
+        )
+
+    if arg_dict['out']:
+        arg_dict['out'].write_text(json.dumps(results, indent=2))
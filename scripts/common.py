@@ -61,6 +61,8 @@ def configure_logger(arg_dict):
 
 DEFAULT_TOKEN = os.environ.get('API_TOKEN')
 
+DEFAULT_API_URL = os.environ.get('API_URL', 'http://localhost:8088/api')
+
 
 class Dataset:
     name: str
@@ -99,6 +101,9 @@ def get_configured_arg_parser(with_api: bool = True, **kwargs) -> argparse.Argum
 
     parser.add_argument('--log', help='File or directory to write the logs to.', type=Path)
 
+    parser.add_argument('--config', help='Conquery config, used for csv settings and preprocessor thresholds (config.json)',
+                        default=Path(__file__).parent.parent / 'config.json', type=Path)
+
     if with_api:
         parser.add_argument('--token', help='Authentication Token', default=DEFAULT_TOKEN)
 
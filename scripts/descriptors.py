@@ -0,0 +1,112 @@
+"""Read-only model of the import descriptors (*.import.json) and the parts of config.json the scripts need."""
+import json
+
+from attr import define, field
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+DEFAULT_CONFIG = Path(__file__).parent.parent / "config.json"
+
+# Conquery's default dateParsingFormats
+DEFAULT_DATE_FORMATS = ["%Y-%m-%d", "%Y%m%d", "%d.%m.%Y"]
+
+
+@define
+class ImportColumn:
+    name: str
+    operation: str
+    input_type: Optional[str] = None
+    input_column: Optional[str] = None
+    # Only set for DATE_RANGE
+    start_column: Optional[str] = None
+    end_column: Optional[str] = None
+    allow_open: bool = False
+
+    @classmethod
+    def from_json(cls, raw: Dict[str, Any]) -> "ImportColumn":
+        return cls(
+            name=raw["name"],
+            operation=raw["operation"],
+            input_type=raw.get("inputType"),
+            input_column=raw.get("inputColumn"),
+            start_column=raw.get("startColumn"),
+            end_column=raw.get("endColumn"),
+            allow_open=raw.get("allowOpen", False),
+        )
+
+    @property
+    def source_columns(self) -> List[str]:
+        """Columns of the source csv this output is computed from."""
+        return [column for column in (self.input_column, self.start_column, self.end_column) if column]
+
+
+@define
+class ImportInput:
+    source_file: str
+    primary: ImportColumn
+    output: List[ImportColumn] = field(factory=list)
+
+    @classmethod
+    def from_json(cls, raw: Dict[str, Any]) -> "ImportInput":
+        return cls(
+            source_file=raw["sourceFile"],
+            primary=ImportColumn.from_json(raw["primary"]),
+            output=[ImportColumn.from_json(column) for column in raw.get("output", [])],
+        )
+
+    @property
+    def source_columns(self) -> List[str]:
+        """All columns of the source csv that are read, in order of first use."""
+        columns: Dict[str, None] = {}
+        for column in [self.primary, *self.output]:
+            columns.update(dict.fromkeys(column.source_columns))
+        return list(columns)
+
+
+@define
+class ImportDescriptor:
+    name: str
+    table: str
+    inputs: List[ImportInput]
+    path: Optional[Path] = None
+
+    @classmethod
+    def from_json(cls, raw: Dict[str, Any], path: Optional[Path] = None) -> "ImportDescriptor":
+        return cls(
+            name=raw["name"],
+            table=raw["table"],
+            inputs=[ImportInput.from_json(source) for source in raw["inputs"]],
+            path=path,
+        )
+
+    @classmethod
+    def load(cls, path: Path) -> "ImportDescriptor":
+        return cls.from_json(json.loads(path.read_text()), path)
+
+
+def load_import_descriptors(paths: Iterable[Path]) -> List[ImportDescriptor]:
+    """Loads the given descriptors, directories are searched for *.import.json."""
+    descriptors: List[ImportDescriptor] = []
+
+    for path in paths:
+        if path.is_dir():
+            descriptors.extend(ImportDescriptor.load(file) for file in sorted(path.glob("*.import.json")))
+        else:
+            descriptors.append(ImportDescriptor.load(path))
+
+    return descriptors
+
+
+def load_config(path: Path = DEFAULT_CONFIG) -> Dict[str, Any]:
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text())
+
+
+def csv_delimiter(config: Dict[str, Any]) -> str:
+    # Conquery spells it that way
+    return config.get("csv", {}).get("delimeter", ",")
+
+
+def faulty_line_threshold(config: Dict[str, Any]) -> float:
+    return config.get("preprocessor", {}).get("faultyLineThreshold", 0.0)
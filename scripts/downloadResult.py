@@ -0,0 +1,72 @@
+#!python3
+
+# Argument Parser
+import logging
+import sys
+
+from pathlib import Path
+
+import pyarrow as pa
+
+from requests import Session
+
+from common import DEFAULT_API_URL, DEFAULT_TOKEN, configure_logger, get_auth_headers, get_configured_arg_parser
+from descriptors import csv_delimiter, load_config
+from results import (
+    DEFAULT_BLOCK_SIZE, DEFAULT_BUFFER_BATCHES, RESULT_FORMATS, CallbackSink, download_result, file_sink,
+)
+
+parser = get_configured_arg_parser(
+    with_api=False,
+    description='Stream query results from the ARROW result provider, or the CSV one if ARROW is not available.',
+)
+
+parser.add_argument('--api', help='Query API URL, default is to read from env ${API_URL}.', default=DEFAULT_API_URL)
+parser.add_argument('--token', help='Authentication Token', default=DEFAULT_TOKEN)
+parser.add_argument('--queries', nargs='+', required=True, help='Ids of the executed queries.')
+parser.add_argument('--out', type=Path,
+                    help='Folder to write the results to as `$query.arrow`, or `.parquet`/`.csv` by --suffix. '
+                         'Without it the results are only counted.')
+parser.add_argument('--suffix', choices=['.arrow', '.parquet', '.csv'], default='.arrow')
+parser.add_argument('--formats', nargs='+', choices=RESULT_FORMATS, default=RESULT_FORMATS,
+                    help='Result providers to try, in order.')
+parser.add_argument('--buffer-batches', type=int, default=DEFAULT_BUFFER_BATCHES,
+                    help='Record batches read ahead of the sink at most.')
+parser.add_argument('--block-size', type=int, default=DEFAULT_BLOCK_SIZE, help='Bytes read and parsed at once.')
+
+arg_dict = vars(parser.parse_args())
+
+configure_logger(arg_dict)
+
+delimiter = csv_delimiter(load_config(arg_dict['config']))
+
+session = Session()
+session.headers.update(get_auth_headers(arg_dict))
+
+if arg_dict['out']:
+    arg_dict['out'].mkdir(parents=True, exist_ok=True)
+
+missing = []
+
+for query in arg_dict['queries']:
+    if arg_dict['out']:
+        sink = file_sink(arg_dict['out'] / f"{query}{arg_dict['suffix']}", delimiter)
+    else:
+        sink = CallbackSink(lambda batch: None)
+
+    try:
+        stats = download_result(
+            session, arg_dict['api'], query, sink, arg_dict['formats'], delimiter,
+            arg_dict['buffer_batches'], arg_dict['block_size'],
+        )
+    finally:
+        sink.close()
+
+    if stats is None:
+        logging.error(f"No result provider returned {query}")
+        missing.append(query)
+
+logging.info(f"Peak Arrow memory {pa.default_memory_pool().max_memory() / 1024 / 1024:.1f} MB")
+
+if missing:
+    sys.exit(1)
@@ -0,0 +1,41 @@
+#!python3
+
+import logging
+
+# Argument Parser
+from pathlib import Path
+
+from common import get_configured_arg_parser, configure_logger
+from descriptors import csv_delimiter, load_config
+from pipeline.icd import write_icd_concept
+
+root = Path(__file__).parent.parent
+
+parser = get_configured_arg_parser(with_api=False, description='Generate a TREE concept of the ICD codes in icd.csv.')
+
+parser.add_argument('--in', help='The icd sourceFile.', type=Path, default=root / 'csv' / 'icd.csv')
+parser.add_argument('--out', help='Concept file to write.', type=Path,
+                    default=root / 'datasets' / 'mimic' / 'concepts' / 'icd.concept.json')
+parser.add_argument('--table', help='Table of the connector.', default='icd')
+parser.add_argument('--column', help='Column of the codes.', default='icd')
+parser.add_argument('--version-column', default='icd_version',
+                    help='Column of the ICD version (9/10), the version is guessed per code if icd.csv has none.')
+parser.add_argument('--validity-date', help='Date column of the connector, empty for none.', default='stay_duration')
+parser.add_argument('--labels', help='Code titles, e.g. MIMIC-IV hosp/d_icd_diagnoses.csv.gz.', type=Path)
+
+arg_dict = vars(parser.parse_args())
+
+configure_logger(arg_dict)
+
+concept = write_icd_concept(
+    csv_file=arg_dict['in'],
+    out=arg_dict['out'],
+    delimiter=csv_delimiter(load_config(arg_dict['config'])),
+    table=arg_dict['table'],
+    column=arg_dict['column'],
+    version_column=arg_dict['version_column'],
+    validity_date=arg_dict['validity_date'] or None,
+    labels_file=arg_dict['labels'],
+)
+
+logging.info(f"{arg_dict['out'].name} has {len(concept['children'])} top level nodes")
@@ -0,0 +1,35 @@
+#!python3
+
+# Argument Parser
+from pathlib import Path
+
+from common import get_configured_arg_parser, configure_logger
+from descriptors import csv_delimiter, load_config
+from pipeline.mapping import write_mappings
+
+parser = get_configured_arg_parser(with_api=False,
+                                   description='Write internToExtern mappings from csvs of internal and external ids.')
+
+parser.add_argument('--in', nargs='+', help='Csvs of ids, each becomes a mapping named after the file.', type=Path,
+                    required=True)
+parser.add_argument('--out', help='mappings folder of the dataset, uploaded by request.py\'s mapping action.',
+                    type=Path, default=Path('gen') / 'mimic' / 'mappings')
+parser.add_argument('--intern-column', help='Column of the internal ids, default is the first.')
+parser.add_argument('--extern-column', help='Column of the external ids, default is the second.')
+parser.add_argument('--base-url', help='Prefix of the id csvs in the mappers, as reachable by the server.',
+                    default='')
+parser.add_argument('--workers', help='Mappings written in parallel, default is the number of cpus.', type=int)
+
+arg_dict = vars(parser.parse_args())
+
+configure_logger(arg_dict)
+
+write_mappings(
+    csv_files=arg_dict['in'],
+    out_dir=arg_dict['out'],
+    delimiter=csv_delimiter(load_config(arg_dict['config'])),
+    intern_column=arg_dict['intern_column'],
+    extern_column=arg_dict['extern_column'],
+    base_url=arg_dict['base_url'],
+    workers=arg_dict['workers'],
+)
@@ -0,0 +1,49 @@
+#!python3
+
+# Argument Parser
+from pathlib import Path
+
+from common import get_configured_arg_parser, configure_logger
+from descriptors import csv_delimiter, load_config, load_import_descriptors
+from pipeline.searchindex import DEFAULT_CAPACITY, generate_search_indexes
+
+root = Path(__file__).parent.parent
+
+parser = get_configured_arg_parser(with_api=False,
+                                   description='Write the search indexes of the SELECT filters of the concepts.')
+
+parser.add_argument('--concepts', nargs='+', help='Concept files.', type=Path,
+                    default=sorted((root / 'datasets' / 'mimic' / 'concepts').glob('*.concept.json')))
+parser.add_argument('--imports', nargs='+', help='Import descriptors or folders of them.', type=Path,
+                    default=[root / 'datasets' / 'mimic' / 'imports'])
+parser.add_argument('--in', help='Folder of the sourceFiles.', type=Path, default=root / 'csv')
+parser.add_argument('--out', help='searchIndex folder of the dataset, uploaded by request.py\'s search action.',
+                    type=Path, default=Path('gen') / 'mimic' / 'searchIndex')
+parser.add_argument('--columns', nargs='*', default=[],
+                    help='Additional `$table.$column`s to index, e.g. admission.race.')
+parser.add_argument('--max-values', help='Values kept per column, the most frequent win.', type=int,
+                    default=DEFAULT_CAPACITY)
+parser.add_argument('--base-url', help='Prefix of the values csv in the templates, as reachable by the server.',
+                    default='')
+parser.add_argument('--concepts-out', type=Path,
+                    help='Folder to write the concepts to, with their filters referencing the search indexes. '
+                         'Default is the `concepts` folder next to --out, from where the concept action uploads them.')
+parser.add_argument('--no-link', action='store_true', help='Only write the search indexes, not the concepts.')
+parser.add_argument('--workers', help='Files counted in parallel, default is the number of cpus.', type=int)
+
+arg_dict = vars(parser.parse_args())
+
+configure_logger(arg_dict)
+
+generate_search_indexes(
+    concepts=arg_dict['concepts'],
+    descriptors=load_import_descriptors(arg_dict['imports']),
+    csv_dir=arg_dict['in'],
+    out_dir=arg_dict['out'],
+    delimiter=csv_delimiter(load_config(arg_dict['config'])),
+    capacity=arg_dict['max_values'],
+    base_url=arg_dict['base_url'],
+    extra_columns=arg_dict['columns'],
+    workers=arg_dict['workers'],
+    concepts_out=None if arg_dict['no_link'] else arg_dict['concepts_out'] or arg_dict['out'].parent / 'concepts',
+)
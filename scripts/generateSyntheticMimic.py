@@ -0,0 +1,37 @@
+#!python3
+
+# Argument Parser
+from pathlib import Path
+
+from common import get_configured_arg_parser, configure_logger
+from descriptors import csv_delimiter, load_config, load_import_descriptors
+from pipeline.synthetic import DEFAULT_CHUNK_PATIENTS, generate_mimic
+
+parser = get_configured_arg_parser(
+    with_api=False,
+    description='Generate synthetic MIMIC-shaped sourceFiles, about 26 rows per patient. MIMIC-IV has 180k patients.',
+)
+
+parser.add_argument('--patients', help='Number of patients.', type=int, required=True)
+parser.add_argument('--seed', help='Seed, the same seed and chunk size give the same files.', type=int, default=0)
+parser.add_argument('--imports', nargs='+', help='Import descriptors or folders of them.', type=Path,
+                    default=[Path(__file__).parent.parent / 'datasets' / 'mimic' / 'imports'])
+parser.add_argument('--out', help='Folder to write the sourceFiles to.', type=Path,
+                    default=Path(__file__).parent.parent / 'csv')
+parser.add_argument('--chunk-patients', help='Patients generated at once by a worker.', type=int,
+                    default=DEFAULT_CHUNK_PATIENTS)
+parser.add_argument('--workers', help='Worker processes, default is the number of cpus.', type=int)
+
+arg_dict = vars(parser.parse_args())
+
+configure_logger(arg_dict)
+
+generate_mimic(
+    descriptors=load_import_descriptors(arg_dict['imports']),
+    out_dir=arg_dict['out'],
+    patients=arg_dict['patients'],
+    seed=arg_dict['seed'],
+    delimiter=csv_delimiter(load_config(arg_dict['config'])),
+    chunk_patients=arg_dict['chunk_patients'],
+    workers=arg_dict['workers'],
+)
@@ -0,0 +1,66 @@
+#!python3
+
+import logging
+import sys
+
+# Argument Parser
+from pathlib import Path
+
+from common import get_configured_arg_parser, configure_logger
+from descriptors import csv_delimiter, load_config, load_import_descriptors
+from pipeline.delta import DEFAULT_DATE_COLUMN, preprocess_delta, record_imported
+from pipeline.partition import DEFAULT_PREPROCESS_COMMAND
+
+root = Path(__file__).parent.parent
+
+parser = get_configured_arg_parser(
+    with_api=False,
+    description='Preprocess only the rows appended to the sourceFiles since the last import, '
+                'into `$table.$tag.cqpp` with a new tag.',
+)
+
+parser.add_argument('--imports', nargs='+', help='Import descriptors or folders of them.', type=Path,
+                    default=[root / 'datasets' / 'mimic' / 'imports'])
+parser.add_argument('--in', help='Folder of the sourceFiles.', type=Path, default=root / 'csv')
+parser.add_argument('--work', help='Folder of the high-water marks, delta csvs and descriptors.', type=Path,
+                    default=root / 'csv' / 'delta')
+parser.add_argument('--out', help='Folder to write the cqpps to.', type=Path, default=root / 'cqpp' / 'mimic')
+parser.add_argument('--init', action='store_true',
+                    help='Only record the sourceFiles as imported, after a full import.')
+parser.add_argument('--date-column', default=DEFAULT_DATE_COLUMN,
+                    help='Date column whose latest imported date finds new rows in rewritten sourceFiles.')
+parser.add_argument('--tag', help='Tag of the delta import, default is `d$timestamp`.')
+parser.add_argument('--command', help='Preprocess command, with placeholders {desc}, {csv}, {out} and {tag}.',
+                    default=DEFAULT_PREPROCESS_COMMAND)
+
+arg_dict = vars(parser.parse_args())
+
+configure_logger(arg_dict)
+
+if arg_dict['tag'] and '.' in arg_dict['tag']:
+    logging.error("Tags can't contain dots, cqpps are named `$table.$tag.cqpp`.")
+    sys.exit(1)
+
+descriptors = load_import_descriptors(arg_dict['imports'])
+delimiter = csv_delimiter(load_config(arg_dict['config']))
+
+if arg_dict['init']:
+    record_imported(descriptors, arg_dict['in'], arg_dict['work'], delimiter, arg_dict['date_column'])
+    sys.exit(0)
+
+cqpps, error = preprocess_delta(
+    descriptors=descriptors,
+    in_dir=arg_dict['in'],
+    work_dir=arg_dict['work'],
+    out_dir=arg_dict['out'],
+    delimiter=delimiter,
+    tag=arg_dict['tag'],
+    command=arg_dict['command'],
+)
+
+if error:
+    logging.error(error)
+    sys.exit(1)
+
+for cqpp in cqpps:
+    logging.info(f"Preprocessed {cqpp}, upload it with `request.py --actions cqpp update`")
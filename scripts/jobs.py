@@ -0,0 +1,116 @@
+"""Barriers that wait for the server side jobs of datasets (imports, matching stats) instead of sleeping blindly."""
+import logging
+import re
+import time
+
+from requests import Session
+from typing import Any, Dict, Iterable, List
+
+from common import Dataset, remove_suffix
+from metrics import record_request
+from uploader import ResponseSnapshot
+
+DEFAULT_JOB_TIMEOUT = 3600.0
+DEFAULT_POLL_INTERVAL = 5.0
+# Shards report their jobs to the manager periodically, so a single empty poll may be stale
+EMPTY_POLLS = 2
+
+
+def job_statuses(raw: Any) -> List[Dict[str, Any]]:
+    """/admin/jobs returns the status of every node's job manager, either as a list or keyed by node."""
+    if isinstance(raw, dict):
+        return list(raw.values())
+    return list(raw or [])
+
+
+def mentions(label: str, name: str) -> bool:
+    """Whether the label names the dataset as a whole token, so `mimic` does not match `mimic_demo`."""
+    return re.search(rf"(?<![\w-]){re.escape(name)}(?![\w-])", label) is not None
+
+
+def pending_jobs(raw: Any, dataset: Dataset) -> List[str]:
+    """
+    Labels of the unfinished jobs of a dataset.
+    Job managers of a dataset are matched by their dataset, jobs of others (e.g. the manager's own) by their label.
+    """
+    labels = []
+
+    for status in job_statuses(raw):
+        owner = status.get("dataset")
+
+        for job in status.get("jobs", []):
+            label = str(job.get("label", job))
+
+            if job.get("cancelled"):
+                continue
+
+            if owner == dataset.name or (owner is None and mentions(label, dataset.name)):
+                labels.append(label)
+
+    return labels
+
+
+def wait_for_jobs(
+        session: Session,
+        api_datasets: str,
+        datasets: Iterable[Dataset],
+        timeout: float = DEFAULT_JOB_TIMEOUT,
+        interval: float = DEFAULT_POLL_INTERVAL,
+        what: str = "jobs",
+) -> List[ResponseSnapshot]:
+    """
+    Polls the admin API until no dataset has pending jobs in EMPTY_POLLS consecutive polls,
+    or in the first poll if there were none at all.
+    Returns a failure if the jobs did not finish within timeout seconds or the job status could not be read.
+    A timeout of 0 does not wait at all.
+    """
+    if timeout <= 0:
+        logging.info(f"Not waiting for {what} of {set(datasets)}, the job timeout is 0")
+        return []
+
+    api_jobs = remove_suffix(api_datasets, "/datasets") + "/jobs"
+    datasets = set(datasets)
+
+    deadline = time.monotonic() + timeout
+    empty_polls = 0
+    seen = False
+
+    logging.info(f"Waiting for {what} of {datasets}")
+
+    while True:
+        resp = session.get(api_jobs)
+        record_request("GET", api_jobs, resp.status_code, resp.elapsed.total_seconds())
+
+        if not resp.ok:
+            logging.error(f"Could not read job status with response {resp.status_code}")
+            return [ResponseSnapshot(api_jobs, resp.status_code, resp.text)]
+
+        try:
+            raw = resp.json()
+        except ValueError:
+            msg = f"Could not read job status, the response is no json: {resp.text[:200]}"
+            logging.error(msg)
+            # Status 0, the response itself was ok
+            return [ResponseSnapshot(api_jobs, 0, msg)]
+
+        pending = {dataset: jobs for dataset in datasets if (jobs := pending_jobs(raw, dataset))}
+
+        if pending:
+            empty_polls = 0
+            seen = True
+        else:
+            empty_polls += 1
+
+        if empty_polls >= EMPTY_POLLS or (empty_polls and not seen):
+            logging.info(f"All {what} of {datasets} finished")
+            return []
+
+        if time.monotonic() > deadline:
+            msg = f"Timed out after {timeout:.0f}s waiting for {what}: {pending}"
+            logging.error(msg)
+            return [ResponseSnapshot(api_jobs, 0, msg)]
+
+        for dataset, jobs in pending.items():
+            logging.info(f"{len(jobs)} {what} pending for {dataset}, e.g. {jobs[0]}")
+
+        time.sleep(interval)
@@ -0,0 +1,38 @@
+#!python3
+
+import logging
+import time
+
+# Argument Parser
+from pathlib import Path
+
+from common import get_configured_arg_parser, configure_logger
+from descriptors import csv_delimiter, load_config, load_import_descriptors
+from pipeline.join import DEFAULT_BATCH_SIZE, join_mimic
+
+parser = get_configured_arg_parser(with_api=False, description='Join the raw MIMIC-IV tables into the import sourceFiles.')
+
+parser.add_argument('--mimic', help='Folder of the raw MIMIC-IV download (containing hosp/).', type=Path, required=True)
+parser.add_argument('--imports', nargs='+', help='Import descriptors or folders of them.', type=Path,
+                    default=[Path(__file__).parent.parent / 'datasets' / 'mimic' / 'imports'])
+parser.add_argument('--out', help='Folder to write the sourceFiles to.', type=Path,
+                    default=Path(__file__).parent.parent / 'csv')
+parser.add_argument('--batch-size', help='Rows per streamed batch.', type=int, default=DEFAULT_BATCH_SIZE)
+parser.add_argument('--workers', help='Worker processes, one per sourceFile by default.', type=int)
+
+arg_dict = vars(parser.parse_args())
+
+configure_logger(arg_dict)
+
+start = time.monotonic()
+
+written = join_mimic(
+    mimic_dir=arg_dict['mimic'],
+    descriptors=load_import_descriptors(arg_dict['imports']),
+    out_dir=arg_dict['out'],
+    delimiter=csv_delimiter(load_config(arg_dict['config'])),
+    batch_size=arg_dict['batch_size'],
+    workers=arg_dict['workers'],
+)
+
+logging.info(f"Joined {len(written)} files in {time.monotonic() - start:.1f}s")
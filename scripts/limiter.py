@@ -0,0 +1,143 @@
+"""
+Concurrency limits for uploads: one budget shared by all datasets, either fixed or adapted to the server (AIMD).
+Waiting uploads are admitted round-robin between datasets, in order within a dataset.
+"""
+import asyncio
+import logging
+
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, Hashable, Iterable, Optional, Union
+
+from common import Dataset
+from uploader import RETRY_STATUS, dataset_semaphores
+
+DEFAULT_MAX_PARALLELISM = 32
+
+# Added to the size of a request before normalizing its latency, so small requests don't look slow
+LATENCY_OVERHEAD_BYTES = 1024 * 1024
+
+
+class Lease:
+    """A granted slot, reports the outcome of every attempt made with it."""
+
+    def __init__(self, limiter: Union["AdaptiveLimiter", "FixedLimiter"], epoch: int = 0):
+        self.limiter = limiter
+        self.epoch = epoch
+
+    def feedback(self, status: int, elapsed: float, size: int = 0) -> None:
+        self.limiter.feedback(self, status, elapsed, size)
+
+
+class AdaptiveLimiter:
+    """
+    Additive increase, multiplicative decrease: every healthy response widens the limit by 1 / limit
+    (about one slot per round of responses), a 5xx, timeout, connection error or latency spike multiplies it by decrease.
+    Only responses to requests started after the last decrease can decrease again, so one overload halves once.
+    Latency is normalized by request size and compared to a moving average of the healthy responses.
+    """
+
+    def __init__(
+            self,
+            initial: int = 2,
+            minimum: int = 1,
+            maximum: int = DEFAULT_MAX_PARALLELISM,
+            decrease: float = 0.5,
+            spike_factor: float = 3.0,
+            name: str = "uploads",
+    ):
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease = decrease
+        self.spike_factor = spike_factor
+        self.name = name
+
+        self.in_flight = 0
+        self.epoch = 0
+        # Moving average of the seconds per byte of healthy responses
+        self.baseline: Optional[float] = None
+
+        self.waiters: Dict[Hashable, Deque[asyncio.Future]] = {}
+        self.rotation: Deque[Hashable] = deque()
+
+    @asynccontextmanager
+    async def slot(self, key: Hashable) -> AsyncIterator[Lease]:
+        await self.acquire(key)
+        try:
+            yield Lease(self, self.epoch)
+        finally:
+            self.release()
+
+    async def acquire(self, key: Hashable) -> None:
+        if self.in_flight < int(self.limit) and not self.rotation:
+            self.in_flight += 1
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        queue = self.waiters.setdefault(key, deque())
+        if not queue:
+            self.rotation.append(key)
+        queue.append(waiter)
+
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Granted right before the cancellation, pass the slot on
+                self.release()
+            raise
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self.wake()
+
+    def wake(self) -> None:
+        while self.rotation and self.in_flight < int(self.limit):
+            key = self.rotation.popleft()
+            queue = self.waiters[key]
+            waiter = queue.popleft()
+
+            if queue:
+                self.rotation.append(key)
+
+            if waiter.cancelled():
+                continue
+
+            self.in_flight += 1
+            waiter.set_result(None)
+
+    def feedback(self, lease: Lease, status: int, elapsed: float, size: int = 0) -> None:
+        per_byte = elapsed / (size + LATENCY_OVERHEAD_BYTES)
+
+        if status == 0 or status in RETRY_STATUS:
+            self.back_off(lease, f"response {status or 'timeout/connection error'}")
+        elif self.baseline is not None and per_byte > self.spike_factor * self.baseline:
+            self.back_off(lease, f"latency spike ({elapsed:.1f}s)")
+        elif status < 400:
+            self.baseline = per_byte if self.baseline is None else 0.9 * self.baseline + 0.1 * per_byte
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.wake()
+
+    def back_off(self, lease: Lease, reason: str) -> None:
+        if lease.epoch < self.epoch:
+            return
+
+        self.epoch += 1
+        self.limit = max(self.minimum, self.limit * self.decrease)
+        logging.info(f"Backing off to {int(self.limit)} concurrent {self.name} after {reason}")
+
+
+class FixedLimiter:
+    """--parallelism slots per dataset, or a single slot shared by all datasets."""
+
+    def __init__(self, datasets: Iterable[Dataset], parallel: Optional[int]):
+        self.semaphores = dataset_semaphores(datasets, parallel)
+
+    @asynccontextmanager
+    async def slot(self, key: Dataset) -> AsyncIterator[Lease]:
+        async with self.semaphores[key]:
+            yield Lease(self)
+
+    def feedback(self, lease: Lease, status: int, elapsed: float, size: int = 0) -> None:
+        pass
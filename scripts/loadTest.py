@@ -0,0 +1,315 @@
+#!python3
+"""
+Replays randomized queries, generated from the concepts, against the query API at a target rate (Poisson arrivals)
+for rising concurrency, and reports submit and completion latency percentiles and throughput per level.
+Submit latency is the POST of a query, completion latency runs from its arrival until it is DONE,
+including the wait for a free slot, so it grows once the rate exceeds what the server sustains.
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import random
+import sys
+
+# Argument Parser
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import aiohttp
+
+from attr import define
+
+from common import (
+    DEFAULT_API_URL, DEFAULT_TOKEN, Dataset, configure_logger, get_auth_headers, get_configured_arg_parser, get_datasets,
+)
+from descriptors import csv_delimiter, load_config
+from metrics import percentile
+from mockapi import BackgroundServer, MockConquery, MockSettings
+from workload import (
+    DEFAULT_MIX, DEFAULT_NUMBER_BOUNDS, DEFAULT_YEARS, QueryGenerator, column_types, load_concepts, load_filter_values,
+    parse_mix,
+)
+
+root = Path(__file__).parent.parent
+
+FINAL_STATUSES = {"DONE", "FAILED", "CANCELED"}
+
+PERCENTILES = [50, 90, 99]
+
+
+@define
+class QueryResult:
+    dataset: str
+    shape: str
+    # Execution status of the query, the HTTP status of a failed request, TIMEOUT or ERROR
+    status: str
+    submit: Optional[float] = None
+    completion: Optional[float] = None
+
+
+async def run_query(
+        session: aiohttp.ClientSession,
+        api: str,
+        dataset: Dataset,
+        shape: str,
+        query: Dict[str, Any],
+        arrival: float,
+        slots: asyncio.Semaphore,
+        poll_interval: float,
+        timeout: float,
+) -> QueryResult:
+    loop = asyncio.get_running_loop()
+
+    async with slots:
+        start = loop.time()
+        submit = None
+
+        try:
+            async with session.post(f"{api}/datasets/{dataset.name}/queries", json=query) as resp:
+                body = await resp.text()
+                submit = loop.time() - start
+
+                if resp.status >= 400:
+                    logging.debug(f"Submitting a {shape} query to {dataset} failed with {resp.status}: {body}")
+                    return QueryResult(dataset.name, shape, str(resp.status), submit)
+
+                query_id = json.loads(body)["id"]
+
+            while True:
+                async with session.get(f"{api}/queries/{query_id}") as resp:
+                    if resp.status >= 400:
+                        return QueryResult(dataset.name, shape, str(resp.status), submit)
+                    status = (await resp.json())["status"]
+
+                if status in FINAL_STATUSES:
+                    return QueryResult(dataset.name, shape, status, submit, loop.time() - arrival)
+
+                if loop.time() - start > timeout:
+                    return QueryResult(dataset.name, shape, "TIMEOUT", submit)
+
+                await asyncio.sleep(poll_interval)
+
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError) as error:
+            logging.debug(f"A {shape} query to {dataset} failed: {error!r}")
+            return QueryResult(dataset.name, shape, "ERROR", submit)
+
+
+async def run_level(
+        api: str,
+        headers: Dict[str, str],
+        queries: Dict[Dataset, Iterator[Tuple[str, Dict[str, Any]]]],
+        rate: float,
+        concurrency: int,
+        duration: float,
+        poll_interval: float,
+        timeout: float,
+        arrivals: random.Random,
+) -> Tuple[List[QueryResult], float]:
+    """Issues queries for duration seconds, alternating between the datasets, and waits for all of them."""
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(concurrency)
+    datasets = itertools.cycle(queries)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(headers=headers, connector=connector) as session:
+        start = arrival = loop.time()
+        tasks = []
+
+        while True:
+            arrival += arrivals.expovariate(rate)
+            if arrival - start > duration:
+                break
+
+            await asyncio.sleep(max(0.0, arrival - loop.time()))
+
+            dataset = next(datasets)
+            shape, query = next(queries[dataset])
+            tasks.append(asyncio.create_task(
+                run_query(session, api, dataset, shape, query, arrival, slots, poll_interval, timeout)
+            ))
+
+        results = await asyncio.gather(*tasks)
+
+    return results, loop.time() - start
+
+
+def summarize(results: List[QueryResult], elapsed: float, concurrency: int, rate: float) -> Dict[str, Any]:
+    done = [result for result in results if result.status == "DONE"]
+    submits = sorted(result.submit for result in results if result.submit is not None)
+    completions = sorted(result.completion for result in done)
+
+    summary: Dict[str, Any] = {
+        "concurrency": concurrency,
+        "rate": rate,
+        "seconds": elapsed,
+        "queries": len(results),
+        "done": len(done),
+        "failed": len(results) - len(done),
+        "throughput": len(done) / elapsed if elapsed else 0.0,
+    }
+
+    for q in PERCENTILES:
+        # None rather than 0 when nothing completed, reported as "-"
+        summary[f"submit_p{q}"] = percentile(submits, q / 100) if submits else None
+        summary[f"completion_p{q}"] = percentile(completions, q / 100) if completions else None
+
+    shapes: Dict[str, List[QueryResult]] = {}
+    for result in results:
+        shapes.setdefault(result.shape, []).append(result)
+
+    summary["shapes"] = {}
+    for shape, shape_results in sorted(shapes.items()):
+        shape_completions = sorted(result.completion for result in shape_results if result.status == "DONE")
+        summary["shapes"][shape] = {
+            "queries": len(shape_results),
+            "completion_p50": percentile(shape_completions, 0.5) if shape_completions else None,
+        }
+
+    summary["statuses"] = {}
+    for result in results:
+        if result.status != "DONE":
+            summary["statuses"][result.status] = summary["statuses"].get(result.status, 0) + 1
+
+    return summary
+
+
+def format_seconds(value: Optional[float]) -> str:
+    return f"{value:.3f}" if value is not None else "-"
+
+
+def parse_values(values: List[str]) -> Dict[str, Tuple[List[str], List[int]]]:
+    """`$table.$column=a,b,c` to equally frequent values."""
+    parsed = {}
+    for value in values:
+        column, _, listed = value.partition("=")
+        options = listed.split(",")
+        parsed[column] = (options, [1] * len(options))
+    return parsed
+
+
+parser = get_configured_arg_parser(with_api=False, description=__doc__)
+
+parser.add_argument('--api', help='Query API URL, default is to read from env ${API_URL}.',
+                    default=DEFAULT_API_URL)
+parser.add_argument('--token', help='Authentication Token', default=DEFAULT_TOKEN)
+parser.add_argument('--concepts', nargs='+', help='Concept files.', type=Path,
+                    default=sorted((root / 'datasets' / 'mimic' / 'concepts').glob('*.concept.json')))
+parser.add_argument('--tables', nargs='+', help='Table files, for the types of the NUMBER filter columns.', type=Path,
+                    default=sorted((root / 'datasets' / 'mimic' / 'tables').glob('*.table.json')))
+parser.add_argument('--search-index', help='searchIndex folder with the values of the SELECT filters.', type=Path,
+                    default=Path('gen') / 'mimic' / 'searchIndex')
+parser.add_argument('--values', nargs='*', default=[],
+                    help='Values of SELECT filter columns without a search index, e.g. admission.gender=F,M.')
+parser.add_argument('--mix', nargs='*', default=[],
+                    help=f'Weights of the query shapes, e.g. filtered=4 combined=1. Defaults: {DEFAULT_MIX}.')
+parser.add_argument('--number-bounds', nargs=2, type=float, default=DEFAULT_NUMBER_BOUNDS,
+                    help='Bounds of the ranges of NUMBER filters.')
+parser.add_argument('--years', nargs=2, type=int, default=DEFAULT_YEARS, help='Years of the date restrictions.')
+parser.add_argument('--seed', type=int, help='Seed of the queries and arrivals.')
+parser.add_argument('--rate', type=float, default=2.0, help='Queries per second issued.')
+parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 2, 4, 8, 16],
+                    help='Queries in flight at most, one level after the other.')
+parser.add_argument('--duration', type=float, default=30.0, help='Seconds queries are issued per level.')
+parser.add_argument('--poll-interval', type=float, default=0.5, help='Seconds between status requests of a query.')
+parser.add_argument('--query-timeout', type=float, default=600.0, help='Seconds after which a query counts as failed.')
+parser.add_argument('--dump', type=Path, help='Only write --count queries as JSON lines to this file.')
+parser.add_argument('--count', type=int, default=100, help='Queries written by --dump.')
+parser.add_argument('--mock', action='store_true', help='Run against a local mock instead of --api.')
+parser.add_argument('--mock-query-duration', type=float, default=0.5, help='Mean seconds a query runs on the mock.')
+parser.add_argument('--mock-query-workers', type=int, default=4, help='Queries the mock executes at once.')
+parser.add_argument('--mock-latency', type=float, default=0.01, help='Seconds the mock adds to every submit.')
+parser.add_argument('--out', type=Path, help='Write the results as json to this file.')
+
+if __name__ == "__main__":
+    arg_dict = vars(parser.parse_args())
+
+    configure_logger(arg_dict)
+
+    seeds = random.Random(arg_dict['seed'])
+    mix = parse_mix(arg_dict['mix'])
+    types = column_types(arg_dict['tables'])
+
+    filter_values = load_filter_values(
+        arg_dict['search_index'],
+        types,
+        csv_delimiter(load_config(arg_dict['config'])),
+    )
+    filter_values.update(parse_values(arg_dict['values']))
+
+    datasets = sorted(get_datasets(arg_dict), key=lambda dataset: dataset.name)
+    queries = {
+        dataset: QueryGenerator(
+            load_concepts(arg_dict['concepts'], dataset.name, types),
+            filter_values,
+            mix,
+            tuple(arg_dict['number_bounds']),
+            tuple(arg_dict['years']),
+            random.Random(seeds.random()),
+        ).queries()
+        for dataset in datasets
+    }
+
+    if arg_dict['dump']:
+        with arg_dict['dump'].open("w") as dump:
+            for dataset in itertools.islice(itertools.cycle(datasets), arg_dict['count']):
+                shape, query = next(queries[dataset])
+                dump.write(json.dumps({"dataset": dataset.name, "shape": shape, "query": query}) + "\n")
+        logging.info(f"Wrote {arg_dict['count']} queries to {arg_dict['dump']}")
+        sys.exit(0)
+
+    api = arg_dict['api']
+    server = None
+
+    if arg_dict['mock']:
+        mock = MockConquery(MockSettings(
+            latency=arg_dict['mock_latency'],
+            query_duration=arg_dict['mock_query_duration'],
+            query_workers=arg_dict['mock_query_workers'],
+            seed=arg_dict['seed'],
+        ))
+        server = BackgroundServer(mock.app())
+        api = server.start() + "/api"
+
+    results: List[Dict[str, Any]] = []
+
+    try:
+        for concurrency in arg_dict['concurrency']:
+            logging.info(
+                f"Issuing {arg_dict['rate']} queries/s for {arg_dict['duration']}s with {concurrency} in flight"
+            )
+
+            level, elapsed = asyncio.run(run_level(
+                api,
+                get_auth_headers(arg_dict),
+                queries,
+                arg_dict['rate'],
+                concurrency,
+                arg_dict['duration'],
+                arg_dict['poll_interval'],
+                arg_dict['query_timeout'],
+                random.Random(seeds.random()),
+            ))
+            results.append(summarize(level, elapsed, concurrency, arg_dict['rate']))
+
+            if results[-1]['statuses']:
+                logging.warning(f"Not done with {concurrency} in flight: {results[-1]['statuses']}")
+    finally:
+        if server:
+            server.stop()
+
+    logging.info(
+        f"{'parallel':>8} {'queries':>8} {'done':>8} {'q/s':>8} "
+        + " ".join(f"{f'submit p{q}':>10}" for q in PERCENTILES) + " "
+        + " ".join(f"{f'total p{q}':>10}" for q in PERCENTILES)
+    )
+    for result in results:
+        logging.info(
+            f"{result['concurrency']:>8} {result['queries']:>8} {result['done']:>8} {result['throughput']:>8.2f} "
+            + " ".join(f"{format_seconds(result[f'submit_p{q}']):>10}" for q in PERCENTILES) + " "
+            + " ".join(f"{format_seconds(result[f'completion_p{q}']):>10}" for q in PERCENTILES)
+        )
+
+    if arg_dict['out']:
+        arg_dict['out'].write_text(json.dumps(results, indent=2))
@@ -0,0 +1,212 @@
+"""Per dataset manifest of uploaded cqpps, so repeated runs only upload new or changed files."""
+import hashlib
+import json
+import logging
+import os
+
+from attr import asdict, define
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+MANIFEST_NAME = "cqpp.manifest.json"
+# Append-only log of upload results, so an interrupted run can be resumed before the manifest is saved
+JOURNAL_NAME = "cqpp.journal.jsonl"
+MANIFEST_VERSION = 1
+
+HASH_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def hash_file(path: Path) -> str:
+    """Streams the file through sha256, without holding more than one chunk in memory."""
+    digest = hashlib.sha256()
+    with path.open("rb") as data:
+        # hashlib releases the GIL for large updates, so this parallelizes on threads.
+        for chunk in iter(lambda: data.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_files(
+        files: List[Tuple[Path, os.stat_result]],
+        pool: ThreadPoolExecutor,
+) -> List[Tuple[Path, os.stat_result, str]]:
+    """Hashes the files in the pool, may run outside the thread that owns the manifest."""
+    return [(file, stat, sha256) for (file, stat), sha256 in zip(files, pool.map(hash_file, [file for file, _ in files]))]
+
+
+@define
+class ManifestEntry:
+    size: int
+    mtime_ns: int
+    sha256: str
+    # Content hash of the version the server accepted last, None if never uploaded successfully
+    uploaded_sha256: Optional[str] = None
+    # Status code of the last upload attempt, None if it did not produce a response
+    status: Optional[int] = None
+
+
+class CqppManifest:
+    """
+    Records content hash, size and upload result of every cqpp of a dataset.
+    Stored next to the cqpp folder as `cqpp.manifest.json`.
+    Entries are only valid for the server they were uploaded to.
+    Every upload result is appended to `cqpp.journal.jsonl` as soon as it is known,
+    the journal is folded into the manifest on save.
+    Not thread-safe, only the hashing (hash_files) may run elsewhere.
+    """
+
+    def __init__(self, path: Path, server: str, entries: Dict[str, ManifestEntry]):
+        self.path = path
+        self.journal_path = path.with_name(JOURNAL_NAME)
+        self.server = server
+        self.entries = entries
+        # Last journaled result per file of a previous, interrupted run
+        self.journaled: Dict[str, Dict[str, Any]] = {}
+
+    @classmethod
+    def load(cls, cqpp_dir: Path, server: str) -> "CqppManifest":
+        path = cqpp_dir.parent / MANIFEST_NAME
+        entries: Dict[str, ManifestEntry] = {}
+
+        if path.exists():
+            raw = json.loads(path.read_text())
+
+            if raw.get("version") == MANIFEST_VERSION:
+                entries = {name: ManifestEntry(**entry) for name, entry in raw["files"].items()}
+            else:
+                logging.warning(f"Ignoring manifest {path} with unknown version {raw.get('version')}")
+
+            if raw.get("server") != server:
+                logging.info(f"Manifest {path} was written for {raw.get('server')}, uploading everything to {server}")
+                for entry in entries.values():
+                    entry.uploaded_sha256 = None
+
+        manifest = cls(path, server, entries)
+        manifest._read_journal()
+        return manifest
+
+    def _read_journal(self) -> None:
+        """Reads the results of a previous, interrupted run, once before this run appends to the journal."""
+        if not self.journal_path.exists():
+            return
+
+        for line in self.journal_path.read_text().splitlines():
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # The last line may be torn if the run was killed while writing it
+                continue
+
+            if record["server"] == self.server:
+                self.journaled[record["name"]] = record
+
+        logging.info(f"Resuming from {len(self.journaled)} results in {self.journal_path}")
+
+        for name in self.entries:
+            self._resume(name)
+
+    def _resume(self, name: str) -> None:
+        """Applies the journaled result of the file, if it still matches the file's content."""
+        entry = self.entries[name]
+        record = self.journaled.get(name)
+
+        if record is None or entry.sha256 != record["sha256"]:
+            return
+
+        entry.status = record["status"]
+        if record["ok"]:
+            entry.uploaded_sha256 = entry.sha256
+
+    def stale(self, files: Iterable[Path]) -> List[Tuple[Path, os.stat_result]]:
+        """The files that are new or whose size or modification time changed since they were hashed."""
+        stale = []
+
+        for file in files:
+            stat = file.stat()
+            entry = self.entries.get(file.name)
+
+            if entry is None or entry.size != stat.st_size or entry.mtime_ns != stat.st_mtime_ns:
+                stale.append((file, stat))
+
+        return stale
+
+    def update(self, hashed: Iterable[Tuple[Path, os.stat_result, str]]) -> None:
+        """Takes the new hashes of stale files, keeping their upload state."""
+        for file, stat, sha256 in hashed:
+            previous = self.entries.get(file.name)
+            self.entries[file.name] = ManifestEntry(
+                size=stat.st_size,
+                mtime_ns=stat.st_mtime_ns,
+                sha256=sha256,
+                uploaded_sha256=previous.uploaded_sha256 if previous else None,
+                status=previous.status if previous else None,
+            )
+            self._resume(file.name)
+
+    def prune(self, files: Iterable[Path]) -> None:
+        """Drops the entries of files that do not exist anymore."""
+        names = {file.name for file in files}
+        self.entries = {name: entry for name, entry in self.entries.items() if name in names}
+
+    def refresh(self, files: Iterable[Path], pool: ThreadPoolExecutor) -> None:
+        """Hashes the files that are new or changed and drops the entries of all other files."""
+        files = list(files)
+        stale = self.stale(files)
+
+        if stale:
+            logging.info(f"Hashing {len(stale)} of {len(files)} cqpps for {self.path}")
+
+        self.update(hash_files(stale, pool))
+        self.prune(files)
+
+    def plan(self, files: Iterable[Path], reupload: bool = False) -> List[Tuple[Path, str]]:
+        """
+        Returns the files that need an upload together with the method:
+        POST for files the server has never accepted, PUT for files whose content changed since.
+        """
+        planned: List[Tuple[Path, str]] = []
+
+        for file in files:
+            entry = self.entries[file.name]
+
+            if entry.uploaded_sha256 is None:
+                planned.append((file, "POST"))
+            elif entry.uploaded_sha256 != entry.sha256:
+                planned.append((file, "PUT"))
+            elif reupload:
+                planned.append((file, "PUT"))
+            else:
+                logging.debug(f"Skipping unchanged {file}")
+
+        return planned
+
+    def record(self, file: Path, status: Optional[int], ok: bool) -> None:
+        entry = self.entries[file.name]
+        entry.status = status
+
+        if ok:
+            entry.uploaded_sha256 = entry.sha256
+
+        record = {"name": file.name, "server": self.server, "sha256": entry.sha256, "status": status, "ok": ok}
+
+        with self.journal_path.open("a") as journal:
+            journal.write(json.dumps(record) + "\n")
+
+    def save(self) -> None:
+        if not self.entries and not self.path.exists():
+            return
+
+        raw = {
+            "version": MANIFEST_VERSION,
+            "server": self.server,
+            "files": {name: asdict(entry) for name, entry in sorted(self.entries.items())},
+        }
+
+        # Write atomically, so an interrupted run never leaves a broken manifest behind
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(raw, indent=2))
+        os.replace(tmp, self.path)
+
+        # Everything in the journal is part of the manifest now
+        self.journal_path.unlink(missing_ok=True)
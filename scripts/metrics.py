@@ -0,0 +1,110 @@
+"""Structured events for every admin API request, written as JSONL and summarized per action."""
+import json
+import logging
+import threading
+import time
+
+from attr import asdict, define
+from collections import defaultdict
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, TextIO
+
+# Name of the action a request is made for, set by the action wrapper and inherited by threads and tasks it starts
+current_action: ContextVar[str] = ContextVar("current_action", default="-")
+
+
+@define
+class RequestEvent:
+    timestamp: float
+    action: str
+    dataset: Optional[str]
+    file: Optional[str]
+    method: str
+    url: str
+    bytes_sent: int
+    latency: float
+    # 0 if the request did not produce a response
+    status: int
+    retries: int
+
+
+def percentile(values: Sequence[float], share: float) -> float:
+    """Nearest-rank percentile of sorted values."""
+    if not values:
+        return 0.0
+    rank = max(int(round(share * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+class MetricsRecorder:
+    """Collects request events from all action threads, appending them to a JSONL file if one is configured."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.events: Dict[str, List[RequestEvent]] = defaultdict(list)
+        self.out: Optional[TextIO] = None
+
+    def configure(self, path: Optional[Path]) -> None:
+        if path:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self.out = path.open("a")
+
+    def record(self, event: RequestEvent) -> None:
+        with self.lock:
+            self.events[event.action].append(event)
+            if self.out:
+                self.out.write(json.dumps(asdict(event)) + "\n")
+                self.out.flush()
+
+    def close(self) -> None:
+        if self.out:
+            self.out.close()
+            self.out = None
+
+    def log_summary(self) -> None:
+        with self.lock:
+            if not self.events:
+                return
+
+            logging.info(f"{'action':<12} {'requests':>8} {'failed':>6} {'retries':>7} {'MB sent':>9}"
+                         f" {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+
+            for action, events in self.events.items():
+                latencies = sorted(event.latency * 1000 for event in events)
+                failed = sum(1 for event in events if not 0 < event.status < 400)
+                retries = sum(event.retries for event in events)
+                sent = sum(event.bytes_sent for event in events) / 1024 / 1024
+
+                logging.info(
+                    f"{action:<12} {len(events):>8} {failed:>6} {retries:>7} {sent:>9.1f}"
+                    f" {percentile(latencies, 0.5):>8.1f} {percentile(latencies, 0.95):>8.1f}"
+                    f" {percentile(latencies, 0.99):>8.1f}"
+                )
+
+
+recorder = MetricsRecorder()
+
+
+def record_request(
+        method: str,
+        url: str,
+        status: int,
+        latency: float,
+        bytes_sent: int = 0,
+        dataset: Optional[str] = None,
+        file: Optional[Path] = None,
+        retries: int = 0,
+) -> None:
+    recorder.record(RequestEvent(
+        timestamp=time.time(),
+        action=current_action.get(),
+        dataset=dataset,
+        file=str(file) if file else None,
+        method=method,
+        url=url,
+        bytes_sent=bytes_sent,
+        latency=latency,
+        status=status,
+        retries=retries,
+    ))
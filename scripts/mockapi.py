@@ -0,0 +1,345 @@
+#!python3
+"""
+Local stand-in for the parts of the Conquery admin API used by request.py and of the query API used by loadTest.py,
+with configurable latency, bandwidth and error rate. Accepts everything and counts requests and bytes per endpoint.
+"""
+import asyncio
+import heapq
+import json
+import logging
+import random
+import threading
+import uuid
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+
+from aiohttp import web
+from attr import asdict, define, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+ENDPOINTS = [
+    "tables",
+    "concepts",
+    "cqpp",
+    "mapping",
+    "internToExtern",
+    "searchIndex",
+    "secondaryId",
+    "structure",
+    "preview",
+    "update-matching-stats",
+]
+
+# Endpoints whose requests leave a job running on the server
+JOB_ENDPOINTS = {"cqpp", "update-matching-stats"}
+
+READ_CHUNK_SIZE = 64 * 1024
+
+RESULT_BATCH_ROWS = 64 * 1024
+
+# Ends an Arrow IPC stream
+ARROW_END_OF_STREAM = b"\xff\xff\xff\xff\x00\x00\x00\x00"
+
+
+@define
+class MockSettings:
+    # Seconds added to every response
+    latency: float = 0.0
+    # Bytes per second a single request body is read with, None for unlimited
+    bandwidth: Optional[float] = None
+    # Share of requests answered with 500
+    error_rate: float = 0.0
+    # Concurrent requests beyond it are answered with 503, None for unlimited
+    capacity: Optional[int] = None
+    # Seconds a job started by an import or matching stats update stays pending
+    job_duration: float = 0.0
+    # Mean seconds a query runs, exponentially distributed
+    query_duration: float = 0.0
+    # Queries executed at once, further ones wait like on busy shards. None for unlimited
+    query_workers: Optional[int] = None
+    # Rows of every query result
+    result_rows: int = 100_000
+    seed: Optional[int] = None
+
+
+@define
+class EndpointStats:
+    requests: int = 0
+    errors: int = 0
+    bytes: int = 0
+
+
+@define
+class MockJob:
+    dataset: str
+    label: str
+    end: float
+    id: str = field(factory=lambda: str(uuid.uuid4()))
+
+
+@define
+class MockQuery:
+    dataset: str
+    end: float
+    id: str = field(factory=lambda: str(uuid.uuid4()))
+
+
+class MockConquery:
+    def __init__(self, settings: MockSettings = MockSettings()):
+        self.settings = settings
+        self.random = random.Random(settings.seed)
+        self.stats: Dict[str, EndpointStats] = {}
+        self.jobs: List[MockJob] = []
+        self.queries: Dict[str, MockQuery] = {}
+        # Times the query workers become free
+        self.query_workers: List[float] = []
+        self.result: Optional[pa.Table] = None
+        self.in_flight = 0
+
+    def reset(self) -> None:
+        self.stats = {}
+        self.jobs = []
+        self.queries = {}
+        self.query_workers = []
+
+    def totals(self) -> EndpointStats:
+        total = EndpointStats()
+        for stats in self.stats.values():
+            total.requests += stats.requests
+            total.errors += stats.errors
+            total.bytes += stats.bytes
+        return total
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/admin/datasets", self.handle)
+        for endpoint in ENDPOINTS:
+            app.router.add_route("*", f"/admin/datasets/{{dataset}}/{endpoint}", self.handle)
+        app.router.add_get("/admin/jobs", self.handle_jobs)
+        app.router.add_post("/api/datasets/{dataset}/queries", self.handle)
+        app.router.add_get("/api/queries/{query}", self.handle_query_status)
+        app.router.add_get("/api/result/arrow/{query}.arrs", self.handle_arrow_result)
+        app.router.add_get("/api/result/csv/{query}.csv", self.handle_csv_result)
+        app.router.add_get("/mock/stats", self.handle_stats)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        endpoint = request.path.rsplit("/", 1)[-1]
+        stats = self.stats.setdefault(endpoint, EndpointStats())
+        stats.requests += 1
+
+        if self.settings.capacity is not None and self.in_flight >= self.settings.capacity:
+            stats.errors += 1
+            await request.read()
+            return web.Response(status=503, text=f"Mock overloaded with {self.in_flight} requests")
+
+        self.in_flight += 1
+        try:
+            return await self.respond(request, endpoint, stats)
+        finally:
+            self.in_flight -= 1
+
+    async def respond(self, request: web.Request, endpoint: str, stats: EndpointStats) -> web.Response:
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        received = 0
+
+        body = bytearray()
+
+        async for chunk in request.content.iter_chunked(READ_CHUNK_SIZE):
+            if endpoint == "queries":
+                body.extend(chunk)
+            received += len(chunk)
+            stats.bytes += len(chunk)
+
+            if self.settings.bandwidth:
+                ahead = received / self.settings.bandwidth - (loop.time() - start)
+                if ahead > 0:
+                    await asyncio.sleep(ahead)
+
+        if self.settings.latency:
+            await asyncio.sleep(self.settings.latency)
+
+        if self.random.random() < self.settings.error_rate:
+            stats.errors += 1
+            return web.Response(status=500, text=f"Mock failure for {request.method} {request.path}")
+
+        if endpoint in JOB_ENDPOINTS and self.settings.job_duration:
+            dataset = request.match_info["dataset"]
+            self.jobs.append(MockJob(dataset, f"{endpoint} of {dataset}", loop.time() + self.settings.job_duration))
+
+        if endpoint == "queries":
+            return self.start_query(request.match_info["dataset"], bytes(body), loop.time())
+
+        return web.Response(text="")
+
+    def start_query(self, dataset: str, body: bytes, now: float) -> web.Response:
+        try:
+            query = json.loads(body)
+        except ValueError:
+            query = None
+
+        if not isinstance(query, dict) or "type" not in query:
+            return web.Response(status=400, text="Expected a query with a type")
+
+        duration = self.random.expovariate(1 / self.settings.query_duration) if self.settings.query_duration else 0.0
+
+        if self.settings.query_workers is None:
+            end = now + duration
+        else:
+            if len(self.query_workers) < self.settings.query_workers:
+                free = now
+            else:
+                free = heapq.heappop(self.query_workers)
+            end = max(now, free) + duration
+            heapq.heappush(self.query_workers, end)
+
+        mock_query = MockQuery(dataset, end)
+        self.queries[mock_query.id] = mock_query
+        return web.json_response({"id": mock_query.id, "status": "RUNNING"})
+
+    async def handle_query_status(self, request: web.Request) -> web.Response:
+        stats = self.stats.setdefault("query status", EndpointStats())
+        stats.requests += 1
+
+        mock_query = self.queries.get(request.match_info["query"])
+        if mock_query is None:
+            stats.errors += 1
+            return web.Response(status=404, text=f"Unknown query {request.match_info['query']}")
+
+        done = mock_query.end <= asyncio.get_running_loop().time()
+        return web.json_response({"id": mock_query.id, "status": "DONE" if done else "RUNNING"})
+
+    async def handle_jobs(self, _: web.Request) -> web.Response:
+        """Answers like the manager's job status: one status per dataset with its running jobs."""
+        now = asyncio.get_running_loop().time()
+        self.jobs = [job for job in self.jobs if job.end > now]
+
+        statuses: Dict[str, dict] = {}
+        for job in self.jobs:
+            status = statuses.setdefault(job.dataset, {"origin": "mock", "dataset": job.dataset, "jobs": []})
+            status["jobs"].append({"jobId": job.id, "label": job.label, "progress": 0.0, "cancelled": False})
+
+        return web.json_response(list(statuses.values()))
+
+    def result_table(self) -> pa.Table:
+        """A result like Conquery's with an id, date ranges and two selects, the same for every query."""
+        if self.result is None or len(self.result) != self.settings.result_rows:
+            ids = pa.array(range(self.settings.result_rows), pa.int64())
+            self.result = pa.table({
+                "result": pc.cast(ids, pa.string()),
+                "dates": pc.binary_join_element_wise(
+                    "{2150-01-01/", pc.cast(pc.add(pc.divide(ids, 1000), 2151), pa.string()), "-12-31}", ""
+                ),
+                "age_select": pc.cast(pc.add(pc.bit_wise_and(ids, 63), 18), pa.int32()),
+                "gender_select": pc.if_else(pc.equal(pc.bit_wise_and(ids, 1), 0), "F", "M"),
+            })
+        return self.result
+
+    async def stream_result(
+            self,
+            request: web.Request,
+            content_type: str,
+            encode: Callable[[int, pa.RecordBatch], bytes],
+            trailer: bytes = b"",
+    ) -> web.StreamResponse:
+        stats = self.stats.setdefault("result", EndpointStats())
+        stats.requests += 1
+
+        response = web.StreamResponse(headers={"Content-Type": content_type})
+        await response.prepare(request)
+
+        for index, batch in enumerate(self.result_table().to_batches(max_chunksize=RESULT_BATCH_ROWS)):
+            chunk = encode(index, batch)
+            stats.bytes += len(chunk)
+            await response.write(chunk)
+
+        stats.bytes += len(trailer)
+        await response.write_eof(trailer)
+        return response
+
+    async def handle_arrow_result(self, request: web.Request) -> web.StreamResponse:
+        schema = self.result_table().schema.serialize().to_pybytes()
+
+        def encode(index: int, batch: pa.RecordBatch) -> bytes:
+            return (schema if index == 0 else b"") + batch.serialize().to_pybytes()
+
+        return await self.stream_result(request, "application/vnd.apache.arrow.stream", encode, ARROW_END_OF_STREAM)
+
+    async def handle_csv_result(self, request: web.Request) -> web.StreamResponse:
+        def encode(index: int, batch: pa.RecordBatch) -> bytes:
+            out = pa.BufferOutputStream()
+            # The delimiter of config.json
+            pv.write_csv(batch, out, write_options=pv.WriteOptions(include_header=index == 0, delimiter=";"))
+            return out.getvalue().to_pybytes()
+
+        return await self.stream_result(request, "text/csv", encode)
+
+    async def handle_stats(self, _: web.Request) -> web.Response:
+        return web.json_response({endpoint: asdict(stats) for endpoint, stats in self.stats.items()})
+
+
+class BackgroundServer:
+    """Runs an app on its own event loop in a daemon thread, e.g. next to the synchronous import actions."""
+
+    def __init__(self, app: web.Application, host: str = "127.0.0.1", port: int = 0):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.loop = asyncio.new_event_loop()
+        self.runner: Optional[web.AppRunner] = None
+        self.thread = threading.Thread(target=self.loop.run_forever, name="mock-server", daemon=True)
+
+    def start(self) -> str:
+        """Starts the server and returns its base url."""
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self.loop).result()
+        return f"http://{self.host}:{self.port}"
+
+    async def _start(self) -> None:
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        # Resolve port 0 to the port that was picked
+        address: Tuple[str, int] = self.runner.addresses[0]
+        self.port = address[1]
+
+    def stop(self) -> None:
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the Conquery admin API.")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", help="Seconds added to every response.", type=float, default=0.0)
+    parser.add_argument("--bandwidth", help="MB/s a single request body is read with.", type=float)
+    parser.add_argument("--error-rate", help="Share of requests answered with 500.", type=float, default=0.0)
+    parser.add_argument("--capacity", help="Concurrent requests answered before 503.", type=int)
+    parser.add_argument(
+        "--job-duration", help="Seconds imports and matching stats updates stay pending.", type=float, default=0.0
+    )
+    parser.add_argument("--query-duration", help="Mean seconds a query runs.", type=float, default=0.0)
+    parser.add_argument("--query-workers", help="Queries executed at once, further ones wait.", type=int)
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    settings = MockSettings(
+        latency=args.latency,
+        bandwidth=args.bandwidth * 1024 * 1024 if args.bandwidth else None,
+        error_rate=args.error_rate,
+        capacity=args.capacity,
+        job_duration=args.job_duration,
+        query_duration=args.query_duration,
+        query_workers=args.query_workers,
+    )
+
+    web.run_app(MockConquery(settings).app(), port=args.port)
@@ -0,0 +1,32 @@
+"""
+Reading csvs the same way in every pipeline step: plain or gzipped files, their header,
+and dates in the formats the server parses (dateParsingFormats).
+"""
+import csv
+import gzip
+import io
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from pathlib import Path
+from typing import List, Sequence, TextIO
+
+
+def open_csv(path: Path) -> TextIO:
+    if path.suffix == ".gz":
+        return io.TextIOWrapper(gzip.open(path, "rb"), newline="")
+    return path.open(newline="")
+
+
+def read_header(path: Path, delimiter: str = ",") -> List[str]:
+    """The column names of the csv, empty for an empty file."""
+    with open_csv(path) as data:
+        return next(csv.reader(data, delimiter=delimiter), [])
+
+
+def parse_dates(values: pa.Array, formats: Sequence[str]) -> pa.Array:
+    """Dates of the strings in the first format that matches, null where none does."""
+    values = pc.utf8_trim_whitespace(values)
+    parsed = [pc.strptime(values, format=date_format, unit="s", error_is_null=True) for date_format in formats]
+    return pc.cast(pc.coalesce(*parsed) if len(parsed) > 1 else parsed[0], pa.date32())
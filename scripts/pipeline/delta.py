@@ -0,0 +1,382 @@
+"""
+Delta imports of appended sourceFiles: a high-water mark per sourceFile records how much of it is imported,
+the rows after it are extracted into a delta csv and preprocessed into `$table.$tag.cqpp` with a new tag,
+which is imported next to the existing imports of the table.
+Appended rows are found by byte offset, as long as the file up to it did not change (checked by a hash of its
+first and last MiB, a rewrite that leaves both alone goes unnoticed).
+Otherwise, e.g. after joinMimic.py wrote the file again, rows after the latest date of the mark are new,
+as long as the other rows are exactly the imported ones (checked by their count).
+"""
+import json
+import logging
+import time
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+
+from attr import asdict, define, field
+from datetime import date, datetime, timezone
+from hashlib import blake2b
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from descriptors import DEFAULT_DATE_FORMATS, ImportDescriptor
+from pipeline.csvfiles import parse_dates, read_header
+from pipeline.partition import DEFAULT_PREPROCESS_COMMAND, Partition, partition_file, run_preprocess
+
+STATE_FILE = "delta.json"
+DEFAULT_DATE_COLUMN = "admittime"
+
+DEFAULT_BLOCK_SIZE = 16 * 1024 * 1024
+COPY_CHUNK_SIZE = 1024 * 1024
+# Bytes at the start of a sourceFile and before its mark that are hashed, the cost doesn't grow with the file
+HASH_WINDOW = 1024 * 1024
+
+
+@define
+class Watermark:
+    source_file: str
+    # Bytes of the file that are imported, the end of a line or of the file
+    offset: int
+    # Hash of the first and last HASH_WINDOW of these bytes
+    window_hash: str
+    rows: int
+    date_column: Optional[str] = None
+    # Latest date of date_column in the imported rows, ISO formatted
+    max_date: Optional[str] = None
+    # Tags of the delta imports, in order
+    tags: List[str] = field(factory=list)
+
+
+@define
+class Delta:
+    source_file: str
+    path: Path
+    rows: int
+    watermark: Watermark
+
+
+def load_watermarks(work_dir: Path) -> Dict[str, Watermark]:
+    path = work_dir / STATE_FILE
+    if not path.exists():
+        return {}
+    return {source_file: Watermark(**raw) for source_file, raw in json.loads(path.read_text()).items()}
+
+
+def save_watermarks(work_dir: Path, watermarks: Dict[str, Watermark]) -> None:
+    path = work_dir / STATE_FILE
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps({source_file: asdict(mark) for source_file, mark in watermarks.items()}, indent=2))
+    tmp.replace(path)
+
+
+def delta_tag(now: Optional[datetime] = None) -> str:
+    # No dots, cqpps are named `$table.$tag.cqpp`
+    return f"d{(now or datetime.now(timezone.utc)):%Y%m%d%H%M%S}"
+
+
+def window_hash(path: Path, offset: int, window: int = HASH_WINDOW) -> str:
+    """Hash of the first and the last window bytes before offset, of all of them if they overlap."""
+    digest = blake2b(offset.to_bytes(8, "little"), digest_size=16)
+    spans = [(0, offset)] if offset <= 2 * window else [(0, window), (offset - window, offset)]
+
+    with path.open("rb") as data:
+        for start, end in spans:
+            data.seek(start)
+            digest.update(data.read(end - start))
+
+    return digest.hexdigest()
+
+
+def complete_lines_end(path: Path) -> int:
+    """Offset after the last line break, a line without one may still be written."""
+    size = path.stat().st_size
+    with path.open("rb") as data:
+        position = size
+        while position > 0:
+            start = max(0, position - COPY_CHUNK_SIZE)
+            data.seek(start)
+            chunk = data.read(position - start)
+            newline = chunk.rfind(b"\n")
+            if newline >= 0:
+                return start + newline + 1
+            position = start
+    return 0
+
+
+def date_stats(
+        path: Path,
+        delimiter: str,
+        date_column: Optional[str],
+        formats: Sequence[str] = DEFAULT_DATE_FORMATS,
+        end: Optional[int] = None,
+) -> Tuple[int, Optional[str]]:
+    """Rows of a csv, or of its first end bytes, and the latest date of date_column, if the csv has it."""
+    header = read_header(path, delimiter)
+    column = date_column if date_column in header else header[0]
+    source = path if end is None else pa.BufferReader(pa.memory_map(str(path)).read_buffer(end))
+
+    reader = pv.open_csv(
+        source,
+        read_options=pv.ReadOptions(block_size=DEFAULT_BLOCK_SIZE),
+        parse_options=pv.ParseOptions(delimiter=delimiter, invalid_row_handler=lambda _: "skip"),
+        convert_options=pv.ConvertOptions(include_columns=[column], column_types={column: pa.string()}),
+    )
+
+    rows = 0
+    latest = None
+
+    for batch in reader:
+        rows += batch.num_rows
+        if column == date_column:
+            batch_max = pc.max(parse_dates(batch.column(0), formats)).as_py()
+            if batch_max is not None and (latest is None or batch_max > latest):
+                latest = batch_max
+
+    return rows, latest.isoformat() if latest else None
+
+
+def initial_watermark(
+        csv_file: Path,
+        delimiter: str,
+        date_column: Optional[str] = DEFAULT_DATE_COLUMN,
+        formats: Sequence[str] = DEFAULT_DATE_FORMATS,
+) -> Watermark:
+    """The mark of a sourceFile that is imported completely, up to its last line break like extract_delta."""
+    offset = complete_lines_end(csv_file)
+    rows, max_date = date_stats(csv_file, delimiter, date_column, formats, offset)
+    column = date_column if date_column in read_header(csv_file, delimiter) else None
+    return Watermark(csv_file.name, offset, window_hash(csv_file, offset), rows, column, max_date)
+
+
+def extract_appended(csv_file: Path, target: Path, mark: Watermark, end: int) -> None:
+    """Copies the header and the bytes between the mark and end, the rows stay exactly as they are."""
+    with csv_file.open("rb") as data, target.open("wb") as out:
+        out.write(data.readline())
+
+        data.seek(mark.offset)
+        remaining = end - mark.offset
+        first = True
+
+        while remaining > 0:
+            chunk = data.read(min(COPY_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+
+            if first:
+                # The imported file may have ended without a line break, the appended data then starts with it
+                chunk = chunk.lstrip(b"\r\n")
+                first = False
+            out.write(chunk)
+
+
+def extract_after_date(
+        csv_file: Path,
+        target: Path,
+        mark: Watermark,
+        delimiter: str,
+        formats: Sequence[str] = DEFAULT_DATE_FORMATS,
+) -> None:
+    """
+    Writes the rows with a date after the latest date of the mark. The other rows, on or before that date
+    or without a date, must be as many as the mark imported, otherwise new ones among them can't be told apart
+    and a ValueError is raised.
+    """
+    header = read_header(csv_file, delimiter)
+    latest = pa.scalar(date.fromisoformat(mark.max_date), pa.date32())
+    schema = pa.schema([pa.field(column, pa.string()) for column in header])
+
+    reader = pv.open_csv(
+        csv_file,
+        read_options=pv.ReadOptions(block_size=DEFAULT_BLOCK_SIZE),
+        parse_options=pv.ParseOptions(delimiter=delimiter, invalid_row_handler=lambda _: "skip"),
+        convert_options=pv.ConvertOptions(column_types={column: pa.string() for column in header},
+                                          strings_can_be_null=False),
+    )
+    options = pv.WriteOptions(include_header=False, delimiter=delimiter)
+    undated = on_date = before = 0
+
+    with target.open("wb") as out:
+        with csv_file.open("rb") as data:
+            out.write(data.readline())
+
+        with pv.CSVWriter(out, schema, write_options=options) as writer:
+            for batch in reader:
+                dates = parse_dates(batch.column(mark.date_column), formats)
+                writer.write_batch(batch.filter(pc.fill_null(pc.greater(dates, latest), False)))
+
+                undated += dates.null_count
+                on_date += pc.sum(pc.equal(dates, latest)).as_py() or 0
+                before += pc.sum(pc.less(dates, latest)).as_py() or 0
+
+    kept = undated + on_date + before
+    if kept != mark.rows:
+        target.unlink()
+        raise ValueError(f"{csv_file} has {kept} rows not after {mark.max_date} ({undated} without a date, "
+                         f"{on_date} on it, {before} before it) but {mark.rows} were imported, "
+                         f"new rows among them can't be told apart, it needs a full import")
+
+    logging.info(f"{kept} rows of {csv_file} not after {mark.max_date} were imported before "
+                 f"({undated} without a date, {on_date} on it, {before} before it)")
+
+
+def extract_delta(
+        csv_file: Path,
+        target: Path,
+        mark: Watermark,
+        tag: str,
+        delimiter: str,
+        formats: Sequence[str] = DEFAULT_DATE_FORMATS,
+) -> Delta:
+    """Writes the rows of the csv after the mark to target, returns them with the mark after them."""
+    start = time.monotonic()
+    size = csv_file.stat().st_size
+
+    if size >= mark.offset and window_hash(csv_file, mark.offset) == mark.window_hash:
+        offset = max(complete_lines_end(csv_file), mark.offset)
+        extract_appended(csv_file, target, mark, offset)
+        # Nothing appended, the checked bytes are the marked ones
+        hashed = mark.window_hash if offset == mark.offset else window_hash(csv_file, offset)
+    elif mark.date_column and mark.max_date:
+        logging.warning(f"{csv_file} changed before its high-water mark, taking rows after {mark.max_date} as new")
+        extract_after_date(csv_file, target, mark, delimiter, formats)
+        offset = complete_lines_end(csv_file)
+        hashed = window_hash(csv_file, offset)
+    else:
+        raise ValueError(f"{csv_file} changed before its high-water mark and has no dates to find new rows by, "
+                         f"it needs a full import")
+
+    rows, max_date = date_stats(target, delimiter, mark.date_column, formats)
+
+    if max_date is None or (mark.max_date is not None and max_date < mark.max_date):
+        max_date = mark.max_date
+
+    watermark = Watermark(
+        source_file=mark.source_file,
+        offset=offset,
+        window_hash=hashed,
+        rows=mark.rows + rows,
+        date_column=mark.date_column,
+        max_date=max_date,
+        tags=mark.tags + [tag] if rows else mark.tags,
+    )
+
+    logging.info(f"Extracted {rows} new rows of {csv_file} in {time.monotonic() - start:.1f}s")
+    return Delta(mark.source_file, target, rows, watermark)
+
+
+def write_delta_descriptors(
+        descriptors: Sequence[ImportDescriptor],
+        deltas: Dict[str, Delta],
+        work_dir: Path,
+        out_dir: Path,
+        tag: str,
+) -> Partition:
+    """Writes a copy of every descriptor that has new rows, reading the delta csvs instead."""
+    desc_dir = work_dir / "imports" / tag
+    desc_dir.mkdir(parents=True, exist_ok=True)
+
+    sources: List[Path] = []
+    outputs: List[Path] = []
+
+    for descriptor in descriptors:
+        raw = json.loads(descriptor.path.read_text())
+
+        for raw_input in raw["inputs"]:
+            delta = deltas[raw_input["sourceFile"]]
+            raw_input["sourceFile"] = delta.path.name
+            sources.append(delta.path)
+
+        (desc_dir / descriptor.path.name).write_text(json.dumps(raw, indent=4))
+        outputs.append(out_dir / f"{descriptor.name}.{tag}.cqpp")
+
+    return Partition(tag, desc_dir, sources, outputs)
+
+
+def record_imported(
+        descriptors: Sequence[ImportDescriptor],
+        in_dir: Path,
+        work_dir: Path,
+        delimiter: str,
+        date_column: Optional[str] = DEFAULT_DATE_COLUMN,
+        formats: Sequence[str] = DEFAULT_DATE_FORMATS,
+) -> Dict[str, Watermark]:
+    """Marks the sourceFiles as imported completely, e.g. after a full import."""
+    work_dir.mkdir(parents=True, exist_ok=True)
+    watermarks = load_watermarks(work_dir)
+
+    for source_file in {source.source_file for descriptor in descriptors for source in descriptor.inputs}:
+        mark = initial_watermark(in_dir / source_file, delimiter, date_column, formats)
+        watermarks[source_file] = mark
+        logging.info(f"High-water mark of {source_file}: {mark.rows} rows, {mark.offset} bytes, "
+                     f"latest {mark.date_column} {mark.max_date}")
+
+    save_watermarks(work_dir, watermarks)
+    return watermarks
+
+
+def preprocess_delta(
+        descriptors: Sequence[ImportDescriptor],
+        in_dir: Path,
+        work_dir: Path,
+        out_dir: Path,
+        delimiter: str,
+        tag: Optional[str] = None,
+        command: str = DEFAULT_PREPROCESS_COMMAND,
+        formats: Sequence[str] = DEFAULT_DATE_FORMATS,
+) -> Tuple[List[Path], Optional[str]]:
+    """
+    Extracts the rows after the high-water marks and preprocesses the descriptors with new rows into
+    `$table.$tag.cqpp` in out_dir. The marks move only once the preprocessing succeeded.
+    Returns the cqpps and the error, if extracting or preprocessing failed.
+    """
+    tag = tag or delta_tag()
+    csv_dir = work_dir / "csv"
+    csv_dir.mkdir(parents=True, exist_ok=True)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    watermarks = load_watermarks(work_dir)
+    source_files = {source.source_file for descriptor in descriptors for source in descriptor.inputs}
+
+    unmarked = sorted(source_file for source_file in source_files if source_file not in watermarks)
+    if unmarked:
+        return [], f"No high-water mark of {unmarked}, record the imported state first"
+
+    deltas: Dict[str, Delta] = {}
+    try:
+        for source_file in sorted(source_files):
+            deltas[source_file] = extract_delta(
+                in_dir / source_file, partition_file(csv_dir, source_file, tag), watermarks[source_file], tag,
+                delimiter, formats,
+            )
+    except ValueError as error:
+        return [], str(error)
+
+    # A descriptor with several sourceFiles gets the (maybe empty) deltas of all of them
+    changed = [
+        descriptor for descriptor in descriptors
+        if any(deltas[source.source_file].rows for source in descriptor.inputs)
+    ]
+
+    used = {source.source_file for descriptor in changed for source in descriptor.inputs}
+    for source_file, delta in deltas.items():
+        if source_file not in used:
+            delta.path.unlink()
+
+    if not changed:
+        logging.info("No new rows")
+        return [], None
+
+    partition = write_delta_descriptors(changed, deltas, work_dir, out_dir, tag)
+    error = run_preprocess(partition, command, csv_dir, out_dir)
+
+    if error:
+        return [], error
+
+    for source_file in used:
+        watermarks[source_file] = deltas[source_file].watermark
+    save_watermarks(work_dir, watermarks)
+
+    return partition.outputs, None
@@ -0,0 +1,197 @@
+"""
+Joins the raw MIMIC-IV tables into the sourceFiles of the import descriptors.
+The probe table is streamed in batches, only the (much smaller) build tables of the hash joins are held in memory.
+"""
+import csv
+import logging
+import os
+import time
+
+from attr import define, field
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from descriptors import ImportDescriptor, ImportInput
+from pipeline.csvfiles import open_csv, read_header
+
+DEFAULT_BATCH_SIZE = 100_000
+
+
+@define
+class Join:
+    table: str
+    key: str
+
+
+@define
+class JoinSpec:
+    """How to produce one sourceFile: stream probe, left join the others on their key."""
+    source_file: str
+    probe: str
+    joins: List[Join] = field(factory=list)
+    # output column -> raw column, if they are named differently
+    aliases: Dict[str, str] = field(factory=dict)
+
+
+MIMIC_JOINS = [
+    JoinSpec("admissions.csv", probe="admissions", joins=[Join("patients", "subject_id")]),
+    JoinSpec("icd.csv", probe="diagnoses_icd", joins=[Join("admissions", "hadm_id")], aliases={"icd": "icd_code"}),
+]
+
+
+def find_raw(mimic_dir: Path, table: str) -> Path:
+    """Finds a raw table as shipped (`hosp/<table>.csv.gz`) or unpacked."""
+    for candidate in [f"hosp/{table}.csv.gz", f"hosp/{table}.csv", f"{table}.csv.gz", f"{table}.csv"]:
+        if (mimic_dir / candidate).exists():
+            return mimic_dir / candidate
+    raise FileNotFoundError(f"Could not find {table} in {mimic_dir}")
+
+
+def read_batches(path: Path, columns: Sequence[str], batch_size: int) -> Iterator[List[Tuple[str, ...]]]:
+    """Streams only the given columns of a raw table in batches of rows."""
+    with open_csv(path) as data:
+        reader = csv.reader(data)
+        header = next(reader)
+        indices = [header.index(column) for column in columns]
+
+        while True:
+            batch = [tuple(row[index] for index in indices) for row in islice(reader, batch_size)]
+            if not batch:
+                return
+            yield batch
+
+
+def date_columns(source: ImportInput) -> List[str]:
+    """Source columns that are read as dates by the preprocessor."""
+    columns = []
+    for column in [source.primary, *source.output]:
+        if column.input_type == "DATE":
+            columns.append(column.input_column)
+        columns.extend(name for name in (column.start_column, column.end_column) if name)
+    return columns
+
+
+def join_source(
+        spec: JoinSpec,
+        source: ImportInput,
+        mimic_dir: Path,
+        out_dir: Path,
+        delimiter: str,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+) -> Path:
+    """Writes spec.source_file with exactly the source columns of the import descriptor."""
+    start = time.monotonic()
+    columns = source.source_columns
+
+    # Resolve every output column to the first table that has it, probe table first
+    tables = [spec.probe, *[join.table for join in spec.joins]]
+    headers = {table: read_header(find_raw(mimic_dir, table)) for table in tables}
+    resolved: Dict[str, str] = {}
+
+    for column in columns:
+        raw = spec.aliases.get(column, column)
+        owner = next((table for table in tables if raw in headers[table]), None)
+        if owner is None:
+            raise ValueError(f"None of {tables} has column {raw} for {spec.source_file}")
+        resolved[column] = owner
+
+    # Build sides: key -> values of the columns taken from that table
+    builds: List[Tuple[Join, List[str], Dict[str, Tuple[str, ...]]]] = []
+
+    for join in spec.joins:
+        taken = [column for column in columns if resolved[column] == join.table]
+        raw_columns = [join.key, *(spec.aliases.get(column, column) for column in taken)]
+
+        build: Dict[str, Tuple[str, ...]] = {}
+        for batch in read_batches(find_raw(mimic_dir, join.table), raw_columns, batch_size):
+            build.update((row[0], row[1:]) for row in batch)
+
+        logging.info(f"Built hash table of {len(build)} {join.table} rows on {join.key}")
+        builds.append((join, taken, build))
+
+    probe_columns = [column for column in columns if resolved[column] == spec.probe]
+    raw_probe_columns = [spec.aliases.get(column, column) for column in probe_columns]
+    # Join keys that are not part of the output are read additionally
+    raw_probe_columns += [join.key for join in spec.joins if join.key not in raw_probe_columns]
+    key_indices = [raw_probe_columns.index(join.key) for join, _, _ in builds]
+
+    dates = set(date_columns(source))
+    # Position of every output column in the assembled row: probe values, then each build's values
+    assembled = probe_columns + [column for _, taken, _ in builds for column in taken]
+    order = [assembled.index(column) for column in columns]
+    truncate = [index for index, column in enumerate(columns) if column in dates]
+
+    target = out_dir / spec.source_file
+    tmp = target.with_suffix(target.suffix + ".tmp")
+
+    rows = 0
+    misses = {join.table: 0 for join, _, _ in builds}
+
+    with tmp.open("w", newline="") as out:
+        writer = csv.writer(out, delimiter=delimiter, lineterminator="\n")
+        writer.writerow(columns)
+
+        for batch in read_batches(find_raw(mimic_dir, spec.probe), raw_probe_columns, batch_size):
+            joined = []
+
+            for row in batch:
+                values = list(row[:len(probe_columns)])
+
+                for (join, taken, build), key_index in zip(builds, key_indices):
+                    match = build.get(row[key_index])
+                    if match is None:
+                        # Left join: keep the row, the joined columns stay empty
+                        misses[join.table] += 1
+                        match = ("",) * len(taken)
+                    values.extend(match)
+
+                out_row = [values[index] for index in order]
+
+                for index in truncate:
+                    # MIMIC has timestamps, Conquery reads dates
+                    out_row[index] = out_row[index][:10]
+
+                joined.append(out_row)
+
+            writer.writerows(joined)
+            rows += len(joined)
+
+    os.replace(tmp, target)
+
+    for table, missed in misses.items():
+        if missed:
+            logging.warning(f"{missed} rows of {spec.source_file} have no matching {table}")
+
+    logging.info(f"Wrote {rows} rows to {target} in {time.monotonic() - start:.1f}s")
+    return target
+
+
+def join_mimic(
+        mimic_dir: Path,
+        descriptors: Sequence[ImportDescriptor],
+        out_dir: Path,
+        delimiter: str,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        specs: Optional[Sequence[JoinSpec]] = None,
+        workers: Optional[int] = None,
+) -> List[Path]:
+    """Produces every sourceFile of the descriptors that has a join spec, each in its own worker process."""
+    specs = {spec.source_file: spec for spec in (specs or MIMIC_JOINS)}
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = []
+
+        for descriptor in descriptors:
+            for source in descriptor.inputs:
+                if source.source_file not in specs:
+                    logging.warning(f"Don't know how to join {source.source_file} of {descriptor.name}, skipping")
+                    continue
+
+                futures.append(pool.submit(
+                    join_source, specs[source.source_file], source, mimic_dir, out_dir, delimiter, batch_size
+                ))
+
+        return [future.result() for future in futures]
@@ -0,0 +1,124 @@
+"""
+Writes internToExtern mappings from csvs of internal and external ids: the ids as a csv (`mappings/$name.csv`)
+and the CSV_MAP mapper referencing it (`mappings/$name.mapping.json`), which the server loads the csv of.
+The csv is read in Arrow record batches and every batch is written out before the next one is read,
+so memory does not grow with the number of ids.
+"""
+import csv
+import io
+import json
+import logging
+import time
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+from pipeline.csvfiles import read_header
+
+# Arrow reads a few dozen blocks ahead, which bounds the memory
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+
+MAPPING_SUFFIX = ".mapping.json"
+
+
+def mapping_path(out_dir: Path, name: str) -> Path:
+    return out_dir / f"{name}{MAPPING_SUFFIX}"
+
+
+def write_mapping(
+        csv_file: Path,
+        out_dir: Path,
+        name: str,
+        delimiter: str,
+        intern_column: Optional[str] = None,
+        extern_column: Optional[str] = None,
+        base_url: str = "",
+        block_size: int = DEFAULT_BLOCK_SIZE,
+) -> Tuple[Path, int]:
+    """
+    Streams the intern and extern ids to `$name.csv` and writes the CSV_MAP mapper
+    {"type": "CSV_MAP", "name": ..., "csv": base_url + csv, "internalColumn": ..., "externalTemplate": "{{extern}}"},
+    returns it with the number of ids. Columns default to the first two of the csv, rows without an id are skipped.
+    Ids are not deduplicated, which would need memory in their number.
+    """
+    start = time.monotonic()
+
+    columns = read_header(csv_file, delimiter)
+    intern_column = intern_column or columns[0]
+    extern_column = extern_column or columns[1]
+
+    reader = pv.open_csv(
+        csv_file,
+        read_options=pv.ReadOptions(block_size=block_size, use_threads=False),
+        parse_options=pv.ParseOptions(delimiter=delimiter),
+        convert_options=pv.ConvertOptions(
+            include_columns=[intern_column, extern_column],
+            column_types={intern_column: pa.string(), extern_column: pa.string()},
+            strings_can_be_null=False,
+        ),
+    )
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    ids_file = out_dir / f"{name}.csv"
+    tmp = ids_file.with_name(ids_file.name + ".tmp")
+
+    schema = pa.schema([pa.field(intern_column, pa.string()), pa.field(extern_column, pa.string())])
+    ids = 0
+
+    with tmp.open("wb") as out:
+        # Arrow quotes the names in the header, write it like csv.writer does
+        names = io.StringIO()
+        csv.writer(names, delimiter=delimiter, lineterminator="\n").writerow([intern_column, extern_column])
+        out.write(names.getvalue().encode())
+
+        with pv.CSVWriter(out, schema, write_options=pv.WriteOptions(include_header=False, delimiter=delimiter)) \
+                as writer:
+            for batch in reader:
+                interns, externs = batch.column(intern_column), batch.column(extern_column)
+
+                present = pc.not_equal(interns, "")
+                writer.write_batch(pa.RecordBatch.from_arrays(
+                    [pc.filter(interns, present), pc.filter(externs, present)], schema=schema,
+                ))
+                ids += pc.sum(present).as_py() or 0
+
+    tmp.replace(ids_file)
+
+    mapper = mapping_path(out_dir, name)
+    mapper.write_text(json.dumps({
+        "type": "CSV_MAP",
+        "name": name,
+        "csv": f"{base_url}{ids_file.name}",
+        "internalColumn": intern_column,
+        "externalTemplate": f"{{{{{extern_column}}}}}",
+    }, indent=4))
+
+    logging.info(f"Wrote {ids} ids of {csv_file} to {ids_file} in {time.monotonic() - start:.1f}s")
+    return mapper, ids
+
+
+def write_mappings(
+        csv_files: Iterable[Path],
+        out_dir: Path,
+        delimiter: str,
+        intern_column: Optional[str] = None,
+        extern_column: Optional[str] = None,
+        base_url: str = "",
+        workers: Optional[int] = None,
+) -> List[Tuple[Path, int]]:
+    """One mapping per csv, named after it and written in its own process."""
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(
+                write_mapping, csv_file, out_dir, csv_file.name.split(".")[0], delimiter,
+                intern_column, extern_column, base_url,
+            )
+            for csv_file in csv_files
+        ]
+
+        return [future.result() for future in futures]
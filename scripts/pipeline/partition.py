@@ -0,0 +1,339 @@
+"""
+Splits the sourceFiles of import descriptors into partitions by hashing the primary column
+and preprocesses every partition separately, producing `$table.$tag.cqpp` per partition.
+"""
+import csv
+import io
+import json
+import logging
+import os
+import shlex
+import subprocess
+import time
+import zlib
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+
+from attr import define
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+from descriptors import ImportDescriptor, ImportInput
+from pipeline.staging import StagedSource, file_hash, read_staged
+
+DEFAULT_BATCH_SIZE = 100_000
+
+# Same invocation as preprocess.sh, for a single partition
+DEFAULT_PREPROCESS_COMMAND = (
+    "docker run -v {desc}:/app/imports/ -v {csv}:/app/csv -v {out}:/app/cqpp --rm"
+    " ghcr.io/ingef/conquery-backend:develop"
+    " preprocess --desc /app/imports --in /app/csv --out /app/cqpp --tag {tag}"
+)
+
+
+@define
+class Partition:
+    tag: str
+    # Folder of the rewritten import descriptors of this partition
+    desc_dir: Path
+    # Partitioned csvs referenced by the descriptors
+    sources: List[Path]
+    # The cqpps the preprocessor is expected to produce
+    outputs: List[Path]
+
+
+def partition_tag(index: int, partitions: int) -> str:
+    # No dots, cqpps are named `$table.$tag.cqpp`
+    return f"p{index:0{len(str(partitions - 1))}d}"
+
+
+def partition_file(csv_dir: Path, source_file: str, tag: str) -> Path:
+    name = Path(source_file)
+    return csv_dir / f"{name.stem}.{tag}{name.suffix}"
+
+
+def partition_of(value: str, partitions: int) -> int:
+    # crc32 instead of hash(), which is salted per process
+    return zlib.crc32(value.encode()) % partitions
+
+
+def split_source(
+        source: ImportInput,
+        in_dir: Path,
+        csv_dir: Path,
+        partitions: int,
+        delimiter: str,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+) -> List[Path]:
+    """Splits a sourceFile by its primary column, skipped if the partitions are newer than the source."""
+    source_path = in_dir / source.source_file
+    targets = [partition_file(csv_dir, source.source_file, partition_tag(index, partitions)) for index in range(partitions)]
+
+    if all(target.exists() and target.stat().st_mtime >= source_path.stat().st_mtime for target in targets):
+        logging.info(f"Partitions of {source_path} are up to date")
+        return targets
+
+    start = time.monotonic()
+    # The partitions are not the ones split_staged recorded anymore
+    split_state_file(csv_dir, source.source_file).unlink(missing_ok=True)
+
+    tmp_targets = [target.with_suffix(target.suffix + ".tmp") for target in targets]
+    outs = [tmp.open("w", newline="") for tmp in tmp_targets]
+
+    try:
+        writers = [csv.writer(out, delimiter=delimiter, lineterminator="\n") for out in outs]
+
+        with source_path.open(newline="") as data:
+            reader = csv.reader(data, delimiter=delimiter)
+            header = next(reader)
+            key = header.index(source.primary.input_column)
+
+            for writer in writers:
+                writer.writerow(header)
+
+            while True:
+                batch = list(islice(reader, batch_size))
+                if not batch:
+                    break
+
+                split: List[List[List[str]]] = [[] for _ in range(partitions)]
+                for row in batch:
+                    split[partition_of(row[key], partitions)].append(row)
+
+                for writer, rows in zip(writers, split):
+                    writer.writerows(rows)
+    finally:
+        for out in outs:
+            out.close()
+
+    for tmp, target in zip(tmp_targets, targets):
+        os.replace(tmp, target)
+
+    logging.info(f"Split {source_path} into {partitions} partitions in {time.monotonic() - start:.1f}s")
+    return targets
+
+
+def split_state_file(csv_dir: Path, source_file: str) -> Path:
+    return csv_dir / f".{Path(source_file).stem}.split.json"
+
+
+def partition_state(target: Path, content_hash: str) -> Dict[str, Any]:
+    stat = target.stat()
+    return {"hash": content_hash, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def is_unchanged(target: Path, state: Dict[str, Any]) -> bool:
+    """Whether the partition is still the one recorded, hashed only if its size or mtime differ."""
+    if not target.exists():
+        return False
+    stat = target.stat()
+    if stat.st_size == state["size"] and stat.st_mtime_ns == state["mtime_ns"]:
+        return True
+    return file_hash(target) == state["hash"]
+
+
+def split_staged(
+        source: ImportInput,
+        staged: StagedSource,
+        csv_dir: Path,
+        partitions: int,
+        delimiter: str,
+) -> List[Path]:
+    """
+    Splits a staged sourceFile by its primary column, skipped if it was split from the same staged file before
+    and the partitions are unchanged. Partitions whose content did not change are not replaced,
+    so their cqpps stay up to date.
+    Unlike split_source, rows the csv parser could not split are missing, staging only counted them.
+    The preprocessor would skip them as faulty lines, validation counts them as such.
+    """
+    targets = [partition_file(csv_dir, source.source_file, partition_tag(index, partitions)) for index in range(partitions)]
+    state_file = split_state_file(csv_dir, source.source_file)
+    state = json.loads(state_file.read_text()) if state_file.exists() else {}
+    recorded = state.get("files", []) if state.get("partitions") == partitions else []
+
+    if state.get("staged") == staged.path.name and len(recorded) == partitions \
+            and all(is_unchanged(target, file_state) for target, file_state in zip(targets, recorded)):
+        logging.info(f"Partitions of {staged.path} are up to date")
+        return targets
+
+    if staged.malformed_lines:
+        logging.warning(f"{staged.malformed_lines} malformed lines of {staged.source_file} are not partitioned")
+
+    start = time.monotonic()
+    tmp_targets = [target.with_suffix(target.suffix + ".tmp") for target in targets]
+    outs = [tmp.open("wb") for tmp in tmp_targets]
+    key = source.primary.input_column
+
+    try:
+        # Arrow quotes the names in the header, write it like csv.writer does
+        header = io.StringIO()
+        csv.writer(header, delimiter=delimiter, lineterminator="\n").writerow(staged.columns)
+        for out in outs:
+            out.write(header.getvalue().encode())
+
+        schema = pa.schema([pa.field(column, pa.string()) for column in staged.columns])
+        options = pv.WriteOptions(include_header=False, delimiter=delimiter)
+        writers = [pv.CSVWriter(out, schema, write_options=options) for out in outs]
+
+        for batch in read_staged(staged, staged.columns, decode=False):
+            # Hashing the distinct values only, rows refer to them by dictionary index
+            primary = batch.column(key)
+            of_value = pa.array([partition_of(value, partitions) for value in primary.dictionary.to_pylist()],
+                                pa.int32())
+            partition_ids = pc.take(of_value, primary.indices)
+
+            for index, writer in enumerate(writers):
+                rows = batch.filter(pc.equal(partition_ids, index))
+                writer.write_batch(pa.RecordBatch.from_arrays(
+                    [pc.dictionary_decode(column) for column in rows], schema=schema,
+                ))
+
+        for writer in writers:
+            writer.close()
+    finally:
+        for out in outs:
+            out.close()
+
+    files = []
+
+    for index, (tmp, target) in enumerate(zip(tmp_targets, targets)):
+        content_hash = file_hash(tmp)
+
+        if index < len(recorded) and recorded[index]["hash"] == content_hash and is_unchanged(target, recorded[index]):
+            tmp.unlink()
+            logging.info(f"{target} did not change")
+        else:
+            os.replace(tmp, target)
+
+        files.append(partition_state(target, content_hash))
+
+    state_file.write_text(json.dumps({"staged": staged.path.name, "partitions": partitions, "files": files}))
+
+    logging.info(f"Split {staged.path} into {partitions} partitions in {time.monotonic() - start:.1f}s")
+    return targets
+
+
+def write_partition_descriptors(
+        descriptors: Sequence[ImportDescriptor],
+        work_dir: Path,
+        csv_dir: Path,
+        out_dir: Path,
+        partitions: int,
+) -> List[Partition]:
+    """Writes a copy of every descriptor per partition, reading the partitioned sourceFiles instead."""
+    result = []
+
+    for index in range(partitions):
+        tag = partition_tag(index, partitions)
+        desc_dir = work_dir / "imports" / tag
+        desc_dir.mkdir(parents=True, exist_ok=True)
+
+        sources: List[Path] = []
+
+        for descriptor in descriptors:
+            raw = json.loads(descriptor.path.read_text())
+
+            for raw_input in raw["inputs"]:
+                partitioned = partition_file(csv_dir, raw_input["sourceFile"], tag)
+                raw_input["sourceFile"] = partitioned.name
+                sources.append(partitioned)
+
+            (desc_dir / descriptor.path.name).write_text(json.dumps(raw, indent=4))
+
+        outputs = [out_dir / f"{descriptor.name}.{tag}.cqpp" for descriptor in descriptors]
+        result.append(Partition(tag, desc_dir, sources, outputs))
+
+    return result
+
+
+def is_up_to_date(partition: Partition) -> bool:
+    if not all(output.exists() for output in partition.outputs):
+        return False
+    oldest_output = min(output.stat().st_mtime for output in partition.outputs)
+    return all(source.stat().st_mtime <= oldest_output for source in partition.sources)
+
+
+def run_preprocess(partition: Partition, command: str, csv_dir: Path, out_dir: Path) -> Optional[str]:
+    """Runs the preprocess command for one partition, returns an error message if it failed."""
+    args = shlex.split(command.format(
+        desc=partition.desc_dir.absolute(), csv=csv_dir.absolute(), out=out_dir.absolute(), tag=partition.tag
+    ))
+
+    start = time.monotonic()
+    logging.info(f"Preprocessing partition {partition.tag}: {shlex.join(args)}")
+    process = subprocess.run(args, capture_output=True, text=True)
+
+    if process.returncode != 0:
+        # Don't let partial outputs pass as up to date on the next run
+        for output in partition.outputs:
+            output.unlink(missing_ok=True)
+        return f"Preprocessing partition {partition.tag} failed with {process.returncode}: {process.stderr[-2000:]}"
+
+    missing = [output.name for output in partition.outputs if not output.exists()]
+    if missing:
+        return f"Preprocessing partition {partition.tag} did not produce {missing}"
+
+    logging.info(f"Preprocessed partition {partition.tag} in {time.monotonic() - start:.1f}s")
+    return None
+
+
+def preprocess_partitioned(
+        descriptors: Sequence[ImportDescriptor],
+        in_dir: Path,
+        work_dir: Path,
+        out_dir: Path,
+        partitions: int,
+        delimiter: str,
+        command: str = DEFAULT_PREPROCESS_COMMAND,
+        jobs: Optional[int] = None,
+        force: bool = False,
+        staged: Optional[Dict[str, StagedSource]] = None,
+) -> Dict[str, Optional[str]]:
+    """
+    Splits all sourceFiles (one process per file), the staged ones from their Parquet file,
+    then preprocesses the partitions concurrently.
+    Partitions whose cqpps are newer than their inputs are skipped, so after a failure only that partition reruns.
+    Returns the error per partition tag, None for partitions that succeeded or were up to date.
+    """
+    csv_dir = work_dir / "csv"
+    csv_dir.mkdir(parents=True, exist_ok=True)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    sources = {source.source_file: source for descriptor in descriptors for source in descriptor.inputs}
+    staged = staged or {}
+
+    with ProcessPoolExecutor() as pool:
+        splits = [
+            pool.submit(split_staged, source, staged[source.source_file], csv_dir, partitions, delimiter)
+            if source.source_file in staged else
+            pool.submit(split_source, source, in_dir, csv_dir, partitions, delimiter)
+            for source in sources.values()
+        ]
+        for split in splits:
+            split.result()
+
+    planned = write_partition_descriptors(descriptors, work_dir, csv_dir, out_dir, partitions)
+    results: Dict[str, Optional[str]] = {}
+
+    # The preprocessor is an external process, threads are enough to supervise them
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+        running = {}
+
+        for partition in planned:
+            if not force and is_up_to_date(partition):
+                logging.info(f"Partition {partition.tag} is up to date")
+                results[partition.tag] = None
+                continue
+
+            running[partition.tag] = pool.submit(run_preprocess, partition, command, csv_dir, out_dir)
+
+        for tag, future in running.items():
+            results[tag] = future.result()
+            if results[tag]:
+                logging.error(results[tag])
+
+    return results
@@ -0,0 +1,246 @@
+"""
+Builds the search indexes of the SELECT filters in the concepts: the distinct values of every filter column with their
+frequency, as a csv and a CSV_TEMPLATE (`searchIndex/$table_$column.filter.json`) referencing it,
+and copies of the concepts whose filters reference their template.
+Every sourceFile is read once for all its filter columns, memory is bounded by keeping the most frequent values only.
+"""
+import csv
+import heapq
+import json
+import logging
+import time
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+
+from attr import define, field
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from descriptors import ImportDescriptor
+
+SEARCH_FILTER_TYPES = {"SELECT", "SINGLE_SELECT", "MULTI_SELECT", "BIG_MULTI_SELECT"}
+
+# Values kept per column, beyond that only the most frequent survive
+DEFAULT_CAPACITY = 100_000
+
+DEFAULT_BLOCK_SIZE = 64 * 1024 * 1024
+
+VALUE_COLUMN = "value"
+COUNT_COLUMN = "count"
+
+
+@define
+class ValueCounter:
+    """
+    Frequencies of the values of a column in at most capacity entries.
+    Exact as long as the column has fewer distinct values, else batched Misra-Gries:
+    counts are lower bounds and every value more frequent than rows / capacity is kept.
+    """
+    capacity: int = DEFAULT_CAPACITY
+    counts: Dict[str, int] = field(factory=dict)
+    rows: int = 0
+    exact: bool = True
+
+    def update(self, values: pa.Array) -> None:
+        self.rows += len(values)
+
+        frequencies = pc.value_counts(values)
+        for value, count in zip(frequencies.field("values").to_pylist(), frequencies.field("counts").to_pylist()):
+            if value:
+                self.counts[value] = self.counts.get(value, 0) + count
+
+        if len(self.counts) > self.capacity:
+            self.prune()
+
+    def prune(self) -> None:
+        # Subtracting the (capacity + 1)th largest count drops all values at or below it
+        threshold = heapq.nlargest(self.capacity + 1, self.counts.values())[-1]
+        self.counts = {value: count - threshold for value, count in self.counts.items() if count > threshold}
+        self.exact = False
+
+    def most_common(self) -> List[Tuple[str, int]]:
+        return sorted(self.counts.items(), key=lambda item: (-item[1], item[0]))
+
+
+def search_filters(concept: Dict[str, Any]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """The search filters of a concept and its children, with their path."""
+    def walk(element: Dict[str, Any], path: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        for connector in element.get("connectors", []):
+            for search_filter in connector.get("filters", []):
+                if search_filter.get("type") in SEARCH_FILTER_TYPES and "column" in search_filter:
+                    yield f"{path}.{connector['name']}.{search_filter['name']}", search_filter
+        for child in element.get("children", []):
+            yield from walk(child, f"{path}.{child['name']}")
+
+    return walk(concept, concept["name"])
+
+
+def find_filter_columns(concepts: Iterable[Path]) -> Dict[str, List[str]]:
+    """`$table.$column` of every search filter in the concept files, with the filters using them."""
+    columns: Dict[str, List[str]] = {}
+
+    for concept_file in concepts:
+        for name, search_filter in search_filters(json.loads(concept_file.read_text())):
+            columns.setdefault(search_filter["column"], []).append(name)
+
+    return columns
+
+
+def source_columns(descriptors: Iterable[ImportDescriptor], columns: Iterable[str]) -> Dict[str, Dict[str, str]]:
+    """Per sourceFile, the csv column every `$table.$column` is copied from."""
+    wanted = set(columns)
+    sources: Dict[str, Dict[str, str]] = {}
+
+    for descriptor in descriptors:
+        for source in descriptor.inputs:
+            for output in source.output:
+                column = f"{descriptor.table}.{output.name}"
+
+                if column in wanted and output.input_column:
+                    sources.setdefault(source.source_file, {})[output.input_column] = column
+
+    for column in wanted.difference(column for found in sources.values() for column in found.values()):
+        logging.warning(f"No import copies a csv column into {column}, it gets no search index")
+
+    return sources
+
+
+def count_values(
+        csv_file: Path,
+        columns: Dict[str, str],
+        delimiter: str,
+        capacity: int = DEFAULT_CAPACITY,
+        block_size: int = DEFAULT_BLOCK_SIZE,
+) -> Dict[str, ValueCounter]:
+    """Counts the values of all columns ({csv column: `$table.$column`}) in one pass over the file."""
+    start = time.monotonic()
+
+    reader = pv.open_csv(
+        csv_file,
+        read_options=pv.ReadOptions(block_size=block_size),
+        parse_options=pv.ParseOptions(delimiter=delimiter),
+        convert_options=pv.ConvertOptions(
+            include_columns=list(columns),
+            column_types={name: pa.string() for name in columns},
+            strings_can_be_null=False,
+        ),
+    )
+
+    counters = {column: ValueCounter(capacity) for column in columns.values()}
+
+    for batch in reader:
+        for input_column, column in columns.items():
+            counters[column].update(batch.column(input_column))
+
+    logging.info(f"Counted {len(columns)} columns of {csv_file} in {time.monotonic() - start:.1f}s")
+    return counters
+
+
+def index_name(column: str) -> str:
+    return column.replace(".", "_")
+
+
+def write_index(out_dir: Path, column: str, counter: ValueCounter, delimiter: str, base_url: str) -> Path:
+    """Writes the values csv and the CSV_TEMPLATE referencing it, returns the template."""
+    name = index_name(column)
+    values = out_dir / f"{name}.csv"
+    template = out_dir / f"{name}.filter.json"
+
+    tmp = values.with_name(values.name + ".tmp")
+    with tmp.open("w", newline="") as out:
+        writer = csv.writer(out, delimiter=delimiter)
+        writer.writerow([VALUE_COLUMN, COUNT_COLUMN])
+        writer.writerows(counter.most_common())
+    tmp.replace(values)
+
+    template.write_text(json.dumps({
+        "type": "CSV_TEMPLATE",
+        "name": name,
+        "filePath": f"{base_url}{values.name}",
+        "columnValue": VALUE_COLUMN,
+        "value": f"{{{{{VALUE_COLUMN}}}}}",
+        "optionValue": f"{{{{{COUNT_COLUMN}}}}}",
+    }, indent=4))
+
+    if not counter.exact:
+        logging.warning(f"{column} has more than {counter.capacity} values, only the most frequent are indexed")
+
+    return template
+
+
+def link_templates(concepts: Iterable[Path], indexed: Iterable[str], out_dir: Path) -> List[Path]:
+    """
+    Writes copies of the concepts to out_dir in which every search filter on an indexed column references its
+    template, the filters only offer the values of a search index they reference.
+    """
+    indexed = set(indexed)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    written = []
+
+    for concept_file in concepts:
+        concept = json.loads(concept_file.read_text())
+
+        for name, search_filter in search_filters(concept):
+            if search_filter["column"] in indexed:
+                # Ids in concepts are relative to the dataset, like the columns
+                search_filter["template"] = index_name(search_filter["column"])
+                logging.debug(f"{name} references {search_filter['template']}")
+
+        target = out_dir / concept_file.name
+        target.write_text(json.dumps(concept, indent=4))
+        written.append(target)
+
+    return written
+
+
+def generate_search_indexes(
+        concepts: Iterable[Path],
+        descriptors: Iterable[ImportDescriptor],
+        csv_dir: Path,
+        out_dir: Path,
+        delimiter: str,
+        capacity: int = DEFAULT_CAPACITY,
+        base_url: str = "",
+        extra_columns: Iterable[str] = (),
+        workers: Optional[int] = None,
+        concepts_out: Optional[Path] = None,
+) -> List[Path]:
+    """
+    Counts every sourceFile in its own process and writes one search index per filter column.
+    With concepts_out, also the concepts referencing them.
+    """
+    concepts = list(concepts)
+    filter_columns = find_filter_columns(concepts)
+    for column in extra_columns:
+        filter_columns.setdefault(column, [])
+
+    for column, filters in filter_columns.items():
+        logging.info(f"Indexing {column} for {filters or 'request'}")
+
+    sources = source_columns(descriptors, filter_columns)
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    templates = []
+
+    indexed = []
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(count_values, csv_dir / source_file, columns, delimiter, capacity)
+            for source_file, columns in sources.items()
+        ]
+
+        for future in futures:
+            for column, counter in future.result().items():
+                templates.append(write_index(out_dir, column, counter, delimiter, base_url))
+                indexed.append(column)
+                logging.info(f"Wrote {templates[-1].name} with {len(counter.counts)} values")
+
+    if concepts_out is not None:
+        for concept in link_templates(concepts, indexed, concepts_out):
+            logging.info(f"Wrote {concept} referencing the search indexes")
+
+    return templates
@@ -0,0 +1,249 @@
+"""
+Staging cache between the sourceFiles and their consumers (validation, partitioning):
+every csv is parsed once into a Parquet file keyed by a hash of its content, with all columns dictionary-encoded
+strings, exactly as in the csv, and the date columns additionally parsed (`$column:date`), which validation checks.
+Later runs only hash the csv, or not even that while its size and mtime are unchanged, and read the Parquet file.
+Rows the csv parser can't split into the header's columns are only counted, they are not staged.
+"""
+import json
+import logging
+import time
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
+
+from attr import define, field
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import blake2b
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence
+
+from descriptors import DEFAULT_DATE_FORMATS, ImportDescriptor
+from pipeline.csvfiles import parse_dates, read_header
+from pipeline.join import date_columns
+
+# Part of every key, bump when the layout of the staged files changes
+STAGING_VERSION = 2
+
+DATE_SUFFIX = ":date"
+
+DEFAULT_BLOCK_SIZE = 16 * 1024 * 1024
+HASH_CHUNK_SIZE = 1024 * 1024
+
+HASHES_FILE = "hashes.json"
+METADATA_KEY = b"staging"
+
+
+@define
+class StagedSource:
+    source_file: str
+    path: Path
+    # Hash of the csv's content
+    content_hash: str
+    # Columns of the csv, in order
+    columns: List[str] = field(factory=list)
+    # Columns also staged parsed, as date_column(column), with these formats
+    dates: List[str] = field(factory=list)
+    formats: List[str] = field(factory=list)
+    rows: int = 0
+    # Rows the csv parser could not split into the header's columns, they are not staged
+    malformed_lines: int = 0
+
+
+def date_column(column: str) -> str:
+    return f"{column}{DATE_SUFFIX}"
+
+
+def file_hash(path: Path) -> str:
+    digest = blake2b(digest_size=16)
+    with path.open("rb") as data:
+        while chunk := data.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class HashMemo:
+    """Content hashes of files by path, size and mtime, so unchanged files are not read again."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.hashes: Dict[str, Dict[str, object]] = json.loads(path.read_text()) if path.exists() else {}
+
+    def get(self, file: Path) -> str:
+        stat = file.stat()
+        key = str(file.resolve())
+        known = self.hashes.get(key)
+
+        if known and known["size"] == stat.st_size and known["mtime_ns"] == stat.st_mtime_ns:
+            return str(known["hash"])
+
+        content_hash = file_hash(file)
+        self.hashes[key] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": content_hash}
+        return content_hash
+
+    def save(self) -> None:
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps(self.hashes, indent=2))
+        tmp.replace(self.path)
+
+
+def staged_path(
+        cache_dir: Path,
+        source_file: str,
+        content_hash: str,
+        delimiter: str,
+        dates: Sequence[str],
+        formats: Sequence[str] = DEFAULT_DATE_FORMATS,
+) -> Path:
+    """The staged file of a csv content, read with these options."""
+    key = blake2b(
+        json.dumps([STAGING_VERSION, content_hash, delimiter, sorted(dates), list(formats)]).encode(), digest_size=8
+    ).hexdigest()
+    return cache_dir / f"{Path(source_file).stem}.{key}.parquet"
+
+
+def stage_file(
+        csv_file: Path,
+        target: Path,
+        content_hash: str,
+        delimiter: str,
+        dates: Sequence[str],
+        formats: Sequence[str] = DEFAULT_DATE_FORMATS,
+        block_size: int = DEFAULT_BLOCK_SIZE,
+) -> StagedSource:
+    """Parses the csv into target, unless it is there already."""
+    if target.exists():
+        return read_metadata(target)
+
+    start = time.monotonic()
+    staged = StagedSource(csv_file.name, target, content_hash)
+
+    def skip_malformed(_) -> str:
+        staged.malformed_lines += 1
+        return "skip"
+
+    header = read_header(csv_file, delimiter)
+    staged.columns = header
+    dates = [column for column in dates if column in header]
+    staged.dates = dates
+    staged.formats = list(formats)
+    dictionary = pa.dictionary(pa.int32(), pa.string())
+
+    reader = pv.open_csv(
+        csv_file,
+        read_options=pv.ReadOptions(block_size=block_size),
+        parse_options=pv.ParseOptions(delimiter=delimiter, invalid_row_handler=skip_malformed),
+        # Everything as the strings of the csv, so consumers see exactly its values
+        convert_options=pv.ConvertOptions(
+            column_types={column: dictionary for column in header},
+            strings_can_be_null=False,
+        ),
+    )
+
+    schema = pa.schema(
+        [pa.field(column, dictionary) for column in header]
+        + [pa.field(date_column(column), pa.date32()) for column in dates]
+    )
+
+    tmp = target.with_name(target.name + ".tmp")
+
+    with pq.ParquetWriter(tmp, schema) as writer:
+        for batch in reader:
+            arrays = [batch.column(column) for column in header]
+            arrays += [parse_dates(pc.dictionary_decode(batch.column(column)), formats) for column in dates]
+
+            writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+            staged.rows += batch.num_rows
+
+        metadata = {"source_file": staged.source_file, "content_hash": content_hash, "columns": header,
+                    "dates": dates, "formats": staged.formats, "rows": staged.rows,
+                    "malformed_lines": staged.malformed_lines}
+        writer.add_key_value_metadata({METADATA_KEY: json.dumps(metadata)})
+
+    tmp.replace(target)
+
+    logging.info(f"Staged {staged.rows} rows of {csv_file} to {target} in {time.monotonic() - start:.1f}s")
+    return staged
+
+
+def read_metadata(path: Path) -> StagedSource:
+    metadata = json.loads(pq.read_metadata(path).metadata[METADATA_KEY])
+    return StagedSource(path=path, **metadata)
+
+
+def read_staged(
+        staged: StagedSource,
+        columns: Optional[Sequence[str]] = None,
+        batch_size: int = 256 * 1024,
+        decode: bool = True,
+) -> Iterator[pa.RecordBatch]:
+    """Batches of the staged columns, decoded to plain strings (unless not decode) like read from the csv."""
+    parquet = pq.ParquetFile(staged.path)
+
+    for batch in parquet.iter_batches(batch_size=batch_size, columns=list(columns) if columns is not None else None):
+        if decode:
+            batch = pa.RecordBatch.from_arrays(
+                [pc.dictionary_decode(array) if pa.types.is_dictionary(array.type) else array for array in batch],
+                names=batch.schema.names,
+            )
+        yield batch
+
+
+def stage_sources(
+        descriptors: Sequence[ImportDescriptor],
+        in_dir: Path,
+        cache_dir: Path,
+        delimiter: str,
+        formats: Sequence[str] = DEFAULT_DATE_FORMATS,
+        workers: Optional[int] = None,
+) -> Dict[str, StagedSource]:
+    """
+    Stages every existing sourceFile of the descriptors, each in its own process,
+    and removes the outdated staged files of the same sourceFiles.
+    """
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    memo = HashMemo(cache_dir / HASHES_FILE)
+
+    dates: Dict[str, List[str]] = {}
+    for descriptor in descriptors:
+        for source in descriptor.inputs:
+            columns = dates.setdefault(source.source_file, [])
+            columns.extend(column for column in date_columns(source) if column not in columns)
+
+    staged: Dict[str, StagedSource] = {}
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+
+        for source_file, columns in dates.items():
+            csv_file = in_dir / source_file
+            if not csv_file.exists():
+                logging.warning(f"Can't stage missing {csv_file}")
+                continue
+
+            content_hash = memo.get(csv_file)
+            target = staged_path(cache_dir, source_file, content_hash, delimiter, columns, formats)
+
+            if target.exists():
+                logging.info(f"{csv_file} is staged in {target}")
+
+            futures[source_file] = pool.submit(
+                stage_file, csv_file, target, content_hash, delimiter, columns, formats
+            )
+
+        for source_file, future in futures.items():
+            staged[source_file] = future.result()
+
+    memo.save()
+
+    current = {source.path for source in staged.values()}
+    for source_file in staged:
+        # Only the staged files of exactly this sourceFile, named like staged_path
+        for outdated in cache_dir.glob(f"{Path(source_file).stem}.{'?' * 16}.parquet"):
+            if outdated not in current:
+                logging.info(f"Removing outdated {outdated}")
+                outdated.unlink()
+
+    return staged
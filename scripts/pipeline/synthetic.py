@@ -0,0 +1,423 @@
+"""
+Generates MIMIC-shaped sourceFiles (admissions.csv, icd.csv) from a patient count and a seed, for tests without
+credentialed MIMIC-IV access and at many times its scale. Patients are generated in chunks with Arrow kernels,
+every chunk in a worker process from its own seed, and written as parts that are concatenated in chunk order,
+so the output only depends on the seed and the chunk size, and memory only on the chunk size.
+"""
+import datetime
+import logging
+import math
+import os
+import random
+import shutil
+import time
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from descriptors import ImportDescriptor
+
+DEFAULT_CHUNK_PATIENTS = 50_000
+
+FIRST_SUBJECT_ID = 10_000_000
+FIRST_HADM_ID = 20_000_000
+# Bounds the admissions of a patient, so hadm_ids of a chunk fit into chunk_patients * MAX_ADMISSIONS ids
+MAX_ADMISSIONS = 50
+MAX_DIAGNOSES = 39
+
+MEAN_ADMISSIONS = 2.4
+MEAN_DIAGNOSES = 11.0
+# Share of admissions coded in ICD-10, the others in ICD-9
+ICD10_SHARE = 0.6
+ICD10_CODES = 15_000
+ICD9_CODES = 7_000
+
+# Share of admissions without discharge or admission date, written as open date ranges
+OPEN_DISCHARGE = 0.01
+OPEN_ADMISSION = 0.002
+DYING_PATIENTS = 0.1
+# Share of dying patients that die during their last admission
+DYING_IN_HOSPITAL = 0.3
+EMERGENCY_DEPARTMENT = 0.4
+
+FIRST_YEAR = 2110
+LAST_YEAR = 2208
+EPOCH = datetime.date(1970, 1, 1).toordinal()
+
+# Categorical draws are quantized to 1 / LOOKUP_SIZE
+LOOKUP_SIZE = 4096
+
+PARTS_DIR = ".synthetic-parts"
+
+Weights = Sequence[Tuple[str, float]]
+
+GENDERS: Weights = [("F", 0.53), ("M", 0.47)]
+INSURANCES: Weights = [("Other", 0.55), ("Medicare", 0.35), ("Medicaid", 0.1)]
+LANGUAGES: Weights = [("ENGLISH", 0.9), ("?", 0.1)]
+MARITAL_STATUSES: Weights = [("MARRIED", 0.42), ("SINGLE", 0.37), ("WIDOWED", 0.12), ("DIVORCED", 0.07), ("", 0.02)]
+RACES: Weights = [
+    ("WHITE", 0.63), ("BLACK/AFRICAN AMERICAN", 0.14), ("OTHER", 0.04), ("UNKNOWN", 0.04),
+    ("HISPANIC/LATINO - PUERTO RICAN", 0.02), ("WHITE - OTHER EUROPEAN", 0.02), ("ASIAN", 0.015),
+    ("ASIAN - CHINESE", 0.015), ("HISPANIC OR LATINO", 0.015), ("WHITE - RUSSIAN", 0.01), ("UNABLE TO OBTAIN", 0.01),
+    ("BLACK/CAPE VERDEAN", 0.01), ("PATIENT DECLINED TO ANSWER", 0.005), ("AMERICAN INDIAN/ALASKA NATIVE", 0.005),
+    ("PORTUGUESE", 0.005), ("SOUTH AMERICAN", 0.005), ("NATIVE HAWAIIAN OR OTHER PACIFIC ISLANDER", 0.005),
+]
+ADMISSION_TYPES: Weights = [
+    ("EW EMER.", 0.34), ("EU OBSERVATION", 0.22), ("OBSERVATION ADMIT", 0.13), ("URGENT", 0.1),
+    ("SURGICAL SAME DAY ADMISSION", 0.08), ("DIRECT EMER.", 0.05), ("DIRECT OBSERVATION", 0.04), ("ELECTIVE", 0.03),
+    ("AMBULATORY OBSERVATION", 0.01),
+]
+ADMISSION_LOCATIONS: Weights = [
+    ("EMERGENCY ROOM", 0.5), ("PHYSICIAN REFERRAL", 0.24), ("TRANSFER FROM HOSPITAL", 0.08),
+    ("WALK-IN/SELF REFERRAL", 0.06), ("CLINIC REFERRAL", 0.05), ("PROCEDURE SITE", 0.03), ("PACU", 0.02),
+    ("TRANSFER FROM SKILLED NURSING FACILITY", 0.01), ("INFORMATION NOT AVAILABLE", 0.01),
+]
+DISCHARGE_LOCATIONS: Weights = [
+    ("HOME", 0.36), ("", 0.27), ("HOME HEALTH CARE", 0.2), ("SKILLED NURSING FACILITY", 0.11), ("REHAB", 0.02),
+    ("CHRONIC/LONG TERM ACUTE CARE", 0.01), ("HOSPICE", 0.01), ("AGAINST ADVICE", 0.01), ("ACUTE HOSPITAL", 0.01),
+]
+
+
+class Draws:
+    """Uniform [0, 1) arrays from Arrow's generator, seeded from a Python one."""
+
+    def __init__(self, seed: int):
+        self.random = random.Random(seed)
+
+    def uniform(self, count: int) -> pa.Array:
+        return pc.random(count, initializer=self.random.getrandbits(63))
+
+    def chance(self, count: int, probability: float) -> pa.Array:
+        return pc.less(self.uniform(count), probability)
+
+    def categorical(self, count: int, weights: Weights) -> pa.Array:
+        return pc.take(lookup(weights), indices(self.uniform(count), LOOKUP_SIZE))
+
+    def geometric(self, count: int, mean: float, cap: int) -> pa.Array:
+        """Counts >= 1 with the given mean, at most cap."""
+        p = 1 / mean
+        failures = floor(pc.divide(pc.ln(pc.subtract(1.0, self.uniform(count))), math.log(1 - p)))
+        return pc.min_element_wise(pc.add(failures, 1), cap)
+
+    def normal(self, count: int) -> pa.Array:
+        """Box-Muller."""
+        radius = pc.sqrt(pc.multiply(-2.0, pc.ln(pc.subtract(1.0, self.uniform(count)))))
+        return pc.multiply(radius, pc.cos(pc.multiply(2 * math.pi, self.uniform(count))))
+
+    def zipf(self, count: int, size: int) -> pa.Array:
+        """Ranks in [0, size) with frequencies falling like 1 / (rank + 1), from log-uniform draws."""
+        ranks = floor(pc.exp(pc.multiply(self.uniform(count), math.log(size + 1))))
+        return pc.min_element_wise(pc.subtract(ranks, 1), size - 1)
+
+    def integers(self, count: int, low: int, high: int) -> pa.Array:
+        """Uniform in [low, high)."""
+        return pc.add(indices(self.uniform(count), high - low), low)
+
+
+def day(year: int) -> int:
+    """Days since the epoch of the first of January."""
+    return datetime.date(year, 1, 1).toordinal() - EPOCH
+
+
+def floor(values: pa.Array) -> pa.Array:
+    return pc.cast(pc.floor(values), pa.int64())
+
+
+def indices(uniform: pa.Array, size: int) -> pa.Array:
+    return pc.min_element_wise(floor(pc.multiply(uniform, size)), size - 1)
+
+
+def lookup(weights: Weights) -> pa.Array:
+    """LOOKUP_SIZE values, each one as often as its share of the weights."""
+    total = sum(weight for _, weight in weights)
+    values: List[str] = []
+    cumulative = 0.0
+
+    for value, weight in weights:
+        cumulative += weight
+        values.extend([value] * (round(cumulative / total * LOOKUP_SIZE) - len(values)))
+
+    return pa.array(values, pa.string())
+
+
+def arange(start: int, count: int) -> pa.Array:
+    return pa.array(range(start, start + count), pa.int64())
+
+
+def expand(counts: pa.Array) -> Tuple[pa.Array, pa.Array]:
+    """For every count, that many children: the index of each child's parent and its position among its siblings."""
+    offsets = pa.concat_arrays([pa.array([0], pa.int64()), pc.cumulative_sum(counts)])
+    total = offsets[-1].as_py()
+
+    parents = pc.list_parent_indices(pa.LargeListArray.from_arrays(offsets, pa.nulls(total)))
+    positions = pc.subtract(arange(0, total), pc.take(offsets, parents))
+    return parents, positions
+
+
+def dates(days: pa.Array, missing: Optional[pa.Array] = None) -> pa.Array:
+    """ISO dates of days since the epoch, empty where missing."""
+    formatted = pc.cast(pc.cast(pc.cast(days, pa.int32()), pa.date32()), pa.string())
+    if missing is None:
+        return formatted
+    return pc.if_else(missing, pa.scalar(None, pa.string()), formatted)
+
+
+def icd_vocabulary(seed: int) -> Tuple[pa.Array, pa.Array]:
+    """Synthetic ICD-10 and ICD-9 codes in random order, rank 0 being the most frequent."""
+    rng = random.Random(seed)
+    digits = "0123456789"
+
+    def icd10() -> str:
+        letter = rng.choice("ABCDEFGHIJKLMNOPQRSTVWXYZ")
+        return letter + "".join(rng.choices(digits, k=2 + rng.choice([0, 1, 1, 2, 2])))
+
+    def icd9() -> str:
+        kind = rng.random()
+        if kind < 0.1:
+            return "V" + "".join(rng.choices(digits, k=2 + rng.choice([0, 1, 2])))
+        if kind < 0.15:
+            return "E9" + "".join(rng.choices(digits, k=2 + rng.choice([0, 1])))
+        return "".join(rng.choices(digits, k=3 + rng.choice([0, 1, 2])))
+
+    def unique(generate, count: int) -> pa.Array:
+        codes: Dict[str, None] = {}
+        while len(codes) < count:
+            codes[generate()] = None
+        return pa.array(list(codes), pa.string())
+
+    return unique(icd10, ICD10_CODES), unique(icd9, ICD9_CODES)
+
+
+def generate_chunk(
+        index: int,
+        patients: int,
+        chunk_patients: int,
+        seed: int,
+) -> Tuple[pa.Table, pa.Table]:
+    """Admissions and diagnoses of the patients of one chunk, with every column any import may use."""
+    draws = Draws(seed * 1_000_003 + index)
+    first_patient = index * chunk_patients
+
+    # Patients
+    subject_ids = arange(FIRST_SUBJECT_ID + first_patient, patients)
+    # More old than young patients
+    ages = pc.add(floor(pc.multiply(pc.sqrt(draws.uniform(patients)), 73)), 18)
+    anchor_years = draws.integers(patients, FIRST_YEAR, LAST_YEAR)
+    first_days = draws.integers(patients, day(FIRST_YEAR), day(LAST_YEAR))
+    # Days between the first and the last admission
+    spans = pc.multiply(draws.uniform(patients), 3650.0)
+    dying = draws.chance(patients, DYING_PATIENTS)
+    dying_in_hospital = pc.and_(dying, draws.chance(patients, DYING_IN_HOSPITAL))
+
+    patient_columns = {
+        "gender": draws.categorical(patients, GENDERS),
+        "insurance": draws.categorical(patients, INSURANCES),
+        "language": draws.categorical(patients, LANGUAGES),
+        "marital_status": draws.categorical(patients, MARITAL_STATUSES),
+        "race": draws.categorical(patients, RACES),
+    }
+
+    # Admissions, in order per patient
+    admission_counts = draws.geometric(patients, MEAN_ADMISSIONS, MAX_ADMISSIONS)
+    patient_of, position = expand(admission_counts)
+    admissions = len(patient_of)
+
+    count = pc.take(admission_counts, patient_of)
+    # Spread over the span of the patient, each admission in its own slot so they stay ordered
+    slot = pc.divide(pc.add(pc.cast(position, pa.float64()), draws.uniform(admissions)), pc.cast(count, pa.float64()))
+    admit_days = pc.add(
+        pc.take(first_days, patient_of), floor(pc.multiply(slot, pc.take(spans, patient_of)))
+    )
+    # Log-normal length of stay, about 4.5 days on average
+    stay = pc.min_element_wise(floor(pc.exp(pc.add(pc.multiply(draws.normal(admissions), 0.8), 1.2))), 365)
+    discharge_days = pc.add(admit_days, stay)
+
+    last = pc.equal(position, pc.subtract(count, 1))
+    expired = pc.and_(last, pc.take(dying_in_hospital, patient_of))
+
+    # Death after the last discharge for the ones not dying in hospital
+    last_discharge = pc.take(discharge_days, pc.subtract(pc.cumulative_sum(admission_counts), 1))
+    dod_days = pc.if_else(
+        dying_in_hospital, last_discharge, pc.add(last_discharge, draws.integers(patients, 1, 3 * 365))
+    )
+
+    open_discharge = pc.and_(draws.chance(admissions, OPEN_DISCHARGE), pc.invert(expired))
+    emergency = draws.chance(admissions, EMERGENCY_DEPARTMENT)
+    no_emergency = pc.invert(emergency)
+
+    hadm_ids = pc.add(
+        pc.add(pc.multiply(patient_of, MAX_ADMISSIONS), position),
+        FIRST_HADM_ID + first_patient * MAX_ADMISSIONS,
+    )
+
+    admission_table = pa.table({
+        "subject_id": pc.cast(pc.take(subject_ids, patient_of), pa.string()),
+        "hadm_id": pc.cast(hadm_ids, pa.string()),
+        "admittime": dates(admit_days, draws.chance(admissions, OPEN_ADMISSION)),
+        "dischtime": dates(discharge_days, open_discharge),
+        "deathtime": dates(discharge_days, pc.invert(expired)),
+        "admission_type": draws.categorical(admissions, ADMISSION_TYPES),
+        "admission_location": draws.categorical(admissions, ADMISSION_LOCATIONS),
+        "discharge_location": pc.if_else(expired, "DIED", draws.categorical(admissions, DISCHARGE_LOCATIONS)),
+        **{column: pc.take(values, patient_of) for column, values in patient_columns.items() if column != "gender"},
+        "edregtime": dates(admit_days, no_emergency),
+        "edouttime": dates(admit_days, no_emergency),
+        "hospital_expire_flag": pc.if_else(expired, "1", "0"),
+        "gender": pc.take(patient_columns["gender"], patient_of),
+        "anchor_age": pc.cast(pc.take(ages, patient_of), pa.string()),
+        "anchor_year": pc.cast(pc.take(anchor_years, patient_of), pa.string()),
+        "dod": pc.take(dates(dod_days, pc.invert(dying)), patient_of),
+    })
+
+    # Diagnoses, ICD-9 or ICD-10 per admission with Zipf distributed codes
+    icd10, icd9 = icd_vocabulary(seed)
+    diagnosis_counts = draws.geometric(admissions, MEAN_DIAGNOSES, MAX_DIAGNOSES)
+    admission_of, _ = expand(diagnosis_counts)
+    diagnoses = len(admission_of)
+
+    revision_10 = pc.take(draws.chance(admissions, ICD10_SHARE), admission_of)
+    codes = pc.if_else(
+        revision_10,
+        pc.take(icd10, draws.zipf(diagnoses, len(icd10))),
+        pc.take(icd9, draws.zipf(diagnoses, len(icd9))),
+    )
+
+    icd_table = pa.table({
+        "subject_id": pc.take(admission_table["subject_id"], admission_of),
+        "hadm_id": pc.take(admission_table["hadm_id"], admission_of),
+        "icd": codes,
+        "icd_version": pc.if_else(revision_10, "10", "9"),
+        "admittime": pc.take(admission_table["admittime"], admission_of),
+        "dischtime": pc.take(admission_table["dischtime"], admission_of),
+    })
+
+    return admission_table, icd_table
+
+
+# sourceFiles in the order of the tables of generate_chunk
+SOURCE_FILES = ["admissions.csv", "icd.csv"]
+
+
+def write_chunk(
+        index: int,
+        patients: int,
+        chunk_patients: int,
+        seed: int,
+        parts_dir: Path,
+        sources: Dict[str, List[str]],
+        delimiter: str,
+) -> Dict[str, Tuple[Path, int]]:
+    """Writes the part of every sourceFile ({sourceFile: columns}) of one chunk, without header."""
+    tables = dict(zip(SOURCE_FILES, generate_chunk(index, patients, chunk_patients, seed)))
+    parts = {}
+
+    for source_file, columns in sources.items():
+        table = tables[source_file].select(columns)
+        part = parts_dir / f"{source_file}.{index:06d}"
+        # Unquoted like the joined MIMIC files, none of the generated values needs quotes
+        pv.write_csv(table, part, pv.WriteOptions(include_header=False, delimiter=delimiter, quoting_style="none"))
+        parts[source_file] = (part, len(table))
+
+    return parts
+
+
+def source_columns(descriptors: Sequence[ImportDescriptor]) -> Dict[str, List[str]]:
+    """Columns of the generated sourceFiles read by the descriptors, in their order."""
+    generated = {source_file: table.column_names for source_file, table in zip(
+        SOURCE_FILES, generate_chunk(0, 1, 1, 0)
+    )}
+    sources = {}
+
+    for descriptor in descriptors:
+        for source in descriptor.inputs:
+            if source.source_file not in generated:
+                logging.warning(f"Can't generate {source.source_file} of {descriptor.name}, skipping")
+                continue
+
+            unknown = [column for column in source.source_columns if column not in generated[source.source_file]]
+            if unknown:
+                raise ValueError(f"Can't generate columns {unknown} of {source.source_file} for {descriptor.name}")
+
+            sources[source.source_file] = source.source_columns
+
+    return sources
+
+
+def generate_mimic(
+        descriptors: Sequence[ImportDescriptor],
+        out_dir: Path,
+        patients: int,
+        seed: int,
+        delimiter: str,
+        chunk_patients: int = DEFAULT_CHUNK_PATIENTS,
+        workers: Optional[int] = None,
+) -> Dict[str, int]:
+    """
+    Writes the sourceFiles of the descriptors that can be generated and returns their rows.
+    Chunks are generated ahead by at most twice the workers, the parts are appended as soon as they are next in order.
+    """
+    start = time.monotonic()
+    sources = source_columns(descriptors)
+    workers = workers or os.cpu_count() or 1
+
+    parts_dir = out_dir / PARTS_DIR
+    parts_dir.mkdir(parents=True, exist_ok=True)
+
+    targets = {source_file: out_dir / source_file for source_file in sources}
+    tmps = {source_file: target.with_name(target.name + ".tmp") for source_file, target in targets.items()}
+    outs = {source_file: tmp.open("wb") for source_file, tmp in tmps.items()}
+    rows = dict.fromkeys(sources, 0)
+
+    chunks = [
+        (index, min(chunk_patients, patients - first))
+        for index, first in enumerate(range(0, patients, chunk_patients))
+    ]
+
+    try:
+        for source_file, columns in sources.items():
+            outs[source_file].write((delimiter.join(columns) + "\n").encode())
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = []
+            remaining = iter(chunks)
+
+            def submit_next() -> None:
+                chunk = next(remaining, None)
+                if chunk is not None:
+                    pending.append(pool.submit(
+                        write_chunk, *chunk, chunk_patients, seed, parts_dir, sources, delimiter
+                    ))
+
+            for _ in range(2 * workers):
+                submit_next()
+
+            done = 0
+            while pending:
+                parts = pending.pop(0).result()
+                submit_next()
+
+                for source_file, (part, part_rows) in parts.items():
+                    with part.open("rb") as data:
+                        shutil.copyfileobj(data, outs[source_file], 1024 * 1024)
+                    part.unlink()
+                    rows[source_file] += part_rows
+
+                done += 1
+                if done % 10 == 0 or done == len(chunks):
+                    logging.info(f"Generated {done} of {len(chunks)} chunks, {sum(rows.values())} rows")
+    finally:
+        for out in outs.values():
+            out.close()
+        shutil.rmtree(parts_dir, ignore_errors=True)
+
+    for source_file, tmp in tmps.items():
+        os.replace(tmp, targets[source_file])
+        logging.info(f"Wrote {rows[source_file]} rows to {targets[source_file]}")
+
+    logging.info(f"Generated {patients} patients in {time.monotonic() - start:.1f}s")
+    return rows
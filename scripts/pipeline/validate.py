@@ -0,0 +1,232 @@
+"""
+Pre-flight validation of the sourceFiles against their import descriptors,
+so malformed values are found in seconds instead of after the preprocessor tripped its faultyLineThreshold.
+Files are read in Arrow record batches and every check is a vectorized compute kernel.
+"""
+import logging
+import time
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+
+from attr import define, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from descriptors import DEFAULT_DATE_FORMATS, ImportColumn, ImportDescriptor, ImportInput
+from pipeline.csvfiles import parse_dates, read_header
+from pipeline.staging import StagedSource, date_column, read_staged
+
+DEFAULT_BLOCK_SIZE = 64 * 1024 * 1024
+
+_REAL = r"^\s*[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?\s*$"
+
+PATTERNS = {
+    "INTEGER": r"^\s*[+-]?\d+\s*$",
+    "REAL": _REAL,
+    "DECIMAL": _REAL,
+    "MONEY": _REAL,
+    "BOOLEAN": r"^\s*(?i:true|false|1|0)\s*$",
+}
+
+# A check returns the mask of faulty rows of a batch
+Check = Callable[[pa.RecordBatch], pa.Array]
+
+
+@define
+class SourceReport:
+    source_file: str
+    rows: int = 0
+    faulty_lines: int = 0
+    # Rows the csv parser could not split into the header's columns
+    malformed_lines: int = 0
+    column_faults: Dict[str, int] = field(factory=dict)
+    missing_columns: List[str] = field(factory=list)
+    error: Optional[str] = None
+
+    @property
+    def fault_rate(self) -> float:
+        return self.faulty_lines / self.rows if self.rows else 0.0
+
+    def column_rates(self) -> Dict[str, float]:
+        return {column: faults / self.rows if self.rows else 0.0 for column, faults in self.column_faults.items()}
+
+    def passes(self, threshold: float) -> bool:
+        return not self.error and not self.missing_columns and self.fault_rate <= threshold
+
+
+def _present(values: pa.Array) -> pa.Array:
+    return pc.fill_null(pc.not_equal(pc.utf8_trim_whitespace(values), ""), False)
+
+
+def _dates(batch: pa.RecordBatch, column: str, formats: Sequence[str]) -> pa.Array:
+    """The dates of the column, taken from the staged file if it parsed them already."""
+    if date_column(column) in batch.schema.names:
+        return batch.column(date_column(column))
+    return parse_dates(batch.column(column), formats)
+
+
+def _unparseable_dates(batch: pa.RecordBatch, column: str, formats: Sequence[str]) -> pa.Array:
+    return pc.and_(_present(batch.column(column)), pc.is_null(_dates(batch, column, formats)))
+
+
+def column_checks(column: ImportColumn, formats: Sequence[str], primary: bool = False) -> List[Tuple[str, Check]]:
+    """The checks of one output column of a descriptor, named after the column."""
+    checks: List[Tuple[str, Check]] = []
+
+    if column.operation == "DATE_RANGE":
+        start, end = column.start_column, column.end_column
+
+        def check_range(batch: pa.RecordBatch) -> pa.Array:
+            starts, ends = batch.column(start), batch.column(end)
+            start_present, end_present = _present(starts), _present(ends)
+            start_dates, end_dates = _dates(batch, start, formats), _dates(batch, end, formats)
+
+            faults = pc.or_(
+                pc.and_(start_present, pc.is_null(start_dates)),
+                pc.and_(end_present, pc.is_null(end_dates)),
+            )
+            # An end before the start is never valid
+            faults = pc.or_(faults, pc.fill_null(pc.greater(start_dates, end_dates), False))
+
+            if not column.allow_open:
+                faults = pc.or_(faults, pc.xor(start_present, end_present))
+
+            return faults
+
+        checks.append((f"{column.name} ({start}..{end})", check_range))
+        return checks
+
+    if not column.input_column:
+        return checks
+
+    name = column.input_column
+
+    if column.input_type == "DATE":
+        checks.append((name, lambda batch: _unparseable_dates(batch, name, formats)))
+    elif column.input_type in PATTERNS:
+        pattern = PATTERNS[column.input_type]
+        checks.append((name, lambda batch: pc.and_(
+            _present(batch.column(name)),
+            pc.invert(pc.fill_null(pc.match_substring_regex(batch.column(name), pattern), False)),
+        )))
+
+    if primary:
+        checks.append((f"{name} (primary)", lambda batch: pc.invert(_present(batch.column(name)))))
+
+    return checks
+
+
+def validate_source(
+        source: ImportInput,
+        in_dir: Path,
+        delimiter: str,
+        formats: Sequence[str] = DEFAULT_DATE_FORMATS,
+        block_size: int = DEFAULT_BLOCK_SIZE,
+        staged: Optional[StagedSource] = None,
+) -> SourceReport:
+    """Reads the staged Parquet file of the sourceFile if given, instead of parsing the csv again."""
+    report = SourceReport(source.source_file)
+    path = in_dir / source.source_file
+
+    if staged is None and not path.exists():
+        report.error = f"{path} does not exist"
+        return report
+
+    header = staged.columns if staged is not None else read_header(path, delimiter)
+    columns = source.source_columns
+    report.missing_columns = [column for column in columns if column not in header]
+
+    if report.missing_columns:
+        return report
+
+    checks = column_checks(source.primary, formats, primary=True)
+    for column in source.output:
+        checks.extend(column_checks(column, formats))
+
+    report.column_faults = {name: 0 for name, _ in checks}
+
+    def skip_malformed(_) -> str:
+        report.malformed_lines += 1
+        return "skip"
+
+    if staged is not None:
+        # Staging skipped and counted them already
+        report.malformed_lines = staged.malformed_lines
+        # The staged dates only hold for the formats they were parsed with
+        dates = staged.dates if staged.formats == list(formats) else []
+        reader = read_staged(staged, columns + [date_column(column) for column in dates if column in columns])
+    else:
+        reader = pv.open_csv(
+            path,
+            read_options=pv.ReadOptions(block_size=block_size),
+            parse_options=pv.ParseOptions(delimiter=delimiter, invalid_row_handler=skip_malformed),
+            convert_options=pv.ConvertOptions(
+                include_columns=columns,
+                column_types={column: pa.string() for column in columns},
+                strings_can_be_null=False,
+            ),
+        )
+
+    for batch in reader:
+        faulty = None
+
+        for name, check in checks:
+            mask = check(batch)
+            report.column_faults[name] += pc.sum(mask).as_py() or 0
+            faulty = mask if faulty is None else pc.or_(faulty, mask)
+
+        report.rows += batch.num_rows
+        if faulty is not None:
+            report.faulty_lines += pc.sum(faulty).as_py() or 0
+
+    report.rows += report.malformed_lines
+    report.faulty_lines += report.malformed_lines
+
+    return report
+
+
+def log_report(report: SourceReport, threshold: float) -> None:
+    if report.error:
+        logging.error(f"{report.source_file}: {report.error}")
+        return
+
+    if report.missing_columns:
+        logging.error(f"{report.source_file}: missing columns {report.missing_columns}")
+        return
+
+    details = ", ".join(f"{column} {rate:.4%}" for column, rate in report.column_rates().items() if rate > 0)
+    if report.malformed_lines:
+        details = f"{report.malformed_lines} malformed lines, {details}"
+
+    msg = (f"{report.source_file}: {report.faulty_lines} of {report.rows} lines faulty ({report.fault_rate:.4%},"
+           f" threshold {threshold:.2%}){': ' + details if details else ''}")
+
+    if report.passes(threshold):
+        logging.info(msg)
+    else:
+        logging.error(msg)
+
+
+def validate_imports(
+        descriptors: Sequence[ImportDescriptor],
+        in_dir: Path,
+        delimiter: str,
+        threshold: float,
+        formats: Sequence[str] = DEFAULT_DATE_FORMATS,
+        staged: Optional[Dict[str, StagedSource]] = None,
+) -> List[SourceReport]:
+    """Validates every sourceFile of the descriptors and logs a report per file, staged ones from their Parquet file."""
+    reports = []
+    staged = staged or {}
+
+    for descriptor in descriptors:
+        for source in descriptor.inputs:
+            start = time.monotonic()
+            report = validate_source(source, in_dir, delimiter, formats, staged=staged.get(source.source_file))
+            log_report(report, threshold)
+            logging.debug(f"Validated {source.source_file} in {time.monotonic() - start:.1f}s")
+            reports.append(report)
+
+    return reports
@@ -0,0 +1,274 @@
+"""
+Approximate distinct counts of the primary and id columns of the sourceFiles, to check an import against.
+Every sourceFile is read once in its own process into HyperLogLog sketches, which are merged per table.
+"""
+import logging
+import math
+import multiprocessing
+import time
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+
+from attr import define, field
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import blake2b
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from descriptors import ImportDescriptor, ImportInput
+
+# 2^14 registers, about 0.8% standard error
+DEFAULT_PRECISION = 14
+
+DEFAULT_BLOCK_SIZE = 16 * 1024 * 1024
+
+
+# Decimal integers without leading zeros, the values that can be hashed as numbers without collisions
+_CANONICAL_INTEGER = r"^(0|[1-9][0-9]{0,18})$"
+
+
+def _u64(value: int) -> pa.Scalar:
+    return pa.scalar(value, pa.uint64())
+
+
+def splitmix64(values: pa.Array) -> pa.Array:
+    """The splitmix64 finalizer as wrapping uint64 kernels."""
+    def mix(hashed: pa.Array, shift: int, factor: int) -> pa.Array:
+        return pc.multiply(pc.bit_wise_xor(hashed, pc.shift_right(hashed, _u64(shift))), _u64(factor))
+
+    hashed = pc.add(values, _u64(0x9E3779B97F4A7C15))
+    hashed = mix(hashed, 30, 0xBF58476D1CE4E5B9)
+    hashed = mix(hashed, 27, 0x94D049BB133111EB)
+    return pc.bit_wise_xor(hashed, pc.shift_right(hashed, _u64(31)))
+
+
+@define
+class HyperLogLog:
+    """
+    HyperLogLog over 64 bit hashes, which are the same in every process so sketches can be merged.
+    Integer ids are hashed by splitmix64 in Arrow kernels, other values by blake2b one at a time.
+    """
+    precision: int = DEFAULT_PRECISION
+    registers: bytearray = field()
+
+    @registers.default
+    def _registers(self) -> bytearray:
+        return bytearray(1 << self.precision)
+
+    def add_array(self, values: pa.Array) -> None:
+        values = pc.filter(values, pc.not_equal(values, ""))
+        integers = pc.match_substring_regex(values, _CANONICAL_INTEGER)
+
+        self.add_hashes(splitmix64(pc.cast(pc.filter(values, integers), pa.uint64())))
+        self.add_all(pc.unique(pc.filter(values, pc.invert(integers))).to_pylist())
+
+    def add_hashes(self, hashed: pa.Array) -> None:
+        if not len(hashed):
+            return
+
+        shift = 64 - self.precision
+        index = pc.shift_right(hashed, _u64(shift))
+        rest = pc.bit_wise_and(hashed, _u64((1 << shift) - 1))
+
+        # Position of the first set bit of the rest, rest < 2^50 converts to float exactly
+        rank = pc.subtract(float(shift), pc.floor(pc.log2(pc.cast(rest, pa.float64()))))
+        rank = pc.if_else(pc.equal(rest, _u64(0)), float(shift + 1), rank)
+
+        maxima = pa.table({"index": index, "rank": rank}).group_by("index").aggregate([("rank", "max")])
+
+        registers = self.registers
+        for position, rank in zip(maxima.column("index").to_pylist(), maxima.column("rank_max").to_pylist()):
+            if rank > registers[position]:
+                registers[position] = int(rank)
+
+    def add_all(self, values: Iterable[str]) -> None:
+        shift = 64 - self.precision
+        mask = (1 << shift) - 1
+        registers = self.registers
+
+        for value in values:
+            hashed = int.from_bytes(blake2b(value.encode(), digest_size=8).digest(), "big")
+            index, rest = hashed >> shift, hashed & mask
+            rank = shift - rest.bit_length() + 1
+            if rank > registers[index]:
+                registers[index] = rank
+
+    def merge(self, other: "HyperLogLog") -> None:
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def estimate(self) -> int:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / sum(2.0 ** -register for register in self.registers)
+
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small cardinalities
+            return round(m * math.log(m / zeros))
+
+        return round(raw)
+
+
+@define
+class SourceCounts:
+    source_file: str
+    table: str
+    rows: int = 0
+    # Sketch per column of the csv
+    sketches: Dict[str, HyperLogLog] = field(factory=dict)
+
+
+@define
+class TableCounts:
+    table: str
+    primary: str
+    rows: int = 0
+    sketches: Dict[str, HyperLogLog] = field(factory=dict)
+
+    @property
+    def entities(self) -> int:
+        return self.sketches[self.primary].estimate() if self.primary in self.sketches else 0
+
+    def add(self, counts: SourceCounts) -> None:
+        self.rows += counts.rows
+        for column, sketch in counts.sketches.items():
+            if column in self.sketches:
+                self.sketches[column].merge(sketch)
+            else:
+                self.sketches[column] = sketch
+
+
+def key_columns(source: ImportInput) -> Dict[str, str]:
+    """{csv column: output name} of the primary column and the copied `*_id` columns."""
+    columns = {source.primary.input_column: source.primary.name}
+
+    for output in source.output:
+        if output.input_column and output.name.endswith("_id") and output.operation == "COPY":
+            columns.setdefault(output.input_column, output.name)
+
+    return columns
+
+
+def count_source(
+        csv_file: Path,
+        table: str,
+        columns: Dict[str, str],
+        delimiter: str,
+        precision: int = DEFAULT_PRECISION,
+        block_size: int = DEFAULT_BLOCK_SIZE,
+) -> SourceCounts:
+    """Counts rows and sketches the columns ({csv column: output name})."""
+    start = time.monotonic()
+
+    reader = pv.open_csv(
+        csv_file,
+        read_options=pv.ReadOptions(block_size=block_size),
+        parse_options=pv.ParseOptions(delimiter=delimiter),
+        convert_options=pv.ConvertOptions(
+            include_columns=list(columns),
+            column_types={column: pa.string() for column in columns},
+            strings_can_be_null=False,
+        ),
+    )
+
+    counts = SourceCounts(csv_file.name, table, sketches={name: HyperLogLog(precision) for name in columns.values()})
+
+    for batch in reader:
+        counts.rows += batch.num_rows
+
+        for column, name in columns.items():
+            counts.sketches[name].add_array(batch.column(column))
+
+    logging.info(f"Sketched {counts.rows} rows of {csv_file} in {time.monotonic() - start:.1f}s")
+    return counts
+
+
+def count_tables(
+        descriptors: Iterable[ImportDescriptor],
+        csv_dir: Path,
+        delimiter: str,
+        precision: int = DEFAULT_PRECISION,
+        workers: Optional[int] = None,
+) -> Dict[str, TableCounts]:
+    """Rows and distinct counts per table, merged over all sourceFiles of the table.
+
+    Runs from a scheduler thread while the uploads are in flight, so the workers are spawned:
+    forking a threaded process copies locks held by the other threads.
+    """
+    tables: Dict[str, TableCounts] = {}
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = []
+
+        for descriptor in descriptors:
+            for source in descriptor.inputs:
+                csv_file = csv_dir / source.source_file
+
+                if not csv_file.exists():
+                    logging.warning(f"Missing {csv_file} of {descriptor.name}, not counted")
+                    continue
+
+                tables.setdefault(descriptor.table, TableCounts(descriptor.table, source.primary.name))
+                futures.append(pool.submit(
+                    count_source, csv_file, descriptor.table, key_columns(source), delimiter, precision
+                ))
+
+        for future in futures:
+            counts = future.result()
+            tables[counts.table].add(counts)
+
+    return tables
+
+
+def relative_difference(expected: int, actual: int) -> float:
+    if expected == actual:
+        return 0.0
+    return abs(actual - expected) / max(expected, actual)
+
+
+def compare_counts(
+        tables: Dict[str, TableCounts],
+        server: Dict[str, Dict[str, Optional[int]]],
+        tolerance: float,
+) -> List[str]:
+    """
+    Logs the counts of the sourceFiles next to the ones of the server ({table: {"entities": .., "rows": ..}})
+    and returns the tables differing by more than tolerance.
+    """
+    flagged = []
+
+    logging.info(f"{'table':<20} {'entities':>10} {'server':>10} {'rows':>12} {'server':>12}  id columns")
+
+    for name, counts in sorted(tables.items()):
+        reported = server.get(name, {})
+        entities, rows = reported.get("entities"), reported.get("rows")
+        ids = ", ".join(
+            f"{column} ~{sketch.estimate()}" for column, sketch in counts.sketches.items() if column != counts.primary
+        )
+
+        logging.info(
+            f"{name:<20} {counts.entities:>10} {entities if entities is not None else '-':>10} "
+            f"{counts.rows:>12} {rows if rows is not None else '-':>12}  {ids}"
+        )
+
+        differences = [
+            (what, expected, actual)
+            for what, expected, actual in (("entities", counts.entities, entities), ("rows", counts.rows, rows))
+            if actual is not None and relative_difference(expected, actual) > tolerance
+        ]
+
+        if entities is None and rows is None:
+            logging.warning(f"The server reported no counts for table {name}")
+
+        for what, expected, actual in differences:
+            logging.error(
+                f"Table {name} has {actual} {what} on the server, the sourceFiles about {expected} "
+                f"({relative_difference(expected, actual):.1%} > {tolerance:.1%})"
+            )
+
+        if differences:
+            flagged.append(name)
+
+    return flagged
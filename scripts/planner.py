@@ -0,0 +1,120 @@
+"""Orders cqpp uploads so the largest tables start first (longest-processing-time-first)."""
+import logging
+
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, TypeVar
+
+from descriptors import ImportDescriptor
+from pipeline.verify import TableCounts, count_source
+
+T = TypeVar("T")
+
+# glob keeps the order the files were found in
+ORDER_KEYS = ["size", "entities", "name", "glob"]
+
+ENTITIES_SUFFIX = ".entities"
+
+
+def split_cqpp_name(cqpp: Path) -> Optional[List[str]]:
+    """Returns [table, tag] for files named `$table.$tag.cqpp`."""
+    match = cqpp.name.split(".")
+    if len(match) != 3 or match[-1] != "cqpp":
+        return None
+    return match[:2]
+
+
+class EntityCounter:
+    """
+    Number of entities of a cqpp, which decides which import fills the dictionary first.
+    Read from the sidecar `$table.$tag.cqpp.entities` if present,
+    else estimated once per table from the primary column of the source csvs of the table's import descriptors,
+    and cached in the sidecars of the table's cqpps.
+    """
+
+    def __init__(self, descriptors: Sequence[ImportDescriptor], csv_dir: Optional[Path], delimiter: str):
+        self.descriptors = descriptors
+        self.csv_dir = csv_dir
+        self.delimiter = delimiter
+        # Entities per table, None if they can't be counted
+        self.tables: Dict[str, Optional[int]] = {}
+
+    def count_table(self, table: str) -> Optional[int]:
+        """Approximate distinct count of the primary column over all sourceFiles of the table."""
+        counts: Optional[TableCounts] = None
+
+        for descriptor in self.descriptors:
+            if descriptor.table != table:
+                continue
+
+            for source in descriptor.inputs:
+                source_file = self.csv_dir / source.source_file
+                if not source_file.exists():
+                    logging.debug(f"Cannot count entities of {table}, {source_file} is missing")
+                    return None
+
+                if counts is None:
+                    counts = TableCounts(table, source.primary.name)
+
+                columns = {source.primary.input_column: source.primary.name}
+                try:
+                    counts.add(count_source(source_file, table, columns, self.delimiter))
+                except ValueError as error:
+                    logging.warning(f"Cannot count entities of {table} in {source_file}: {error}")
+                    return None
+
+        if counts is None:
+            return None
+
+        logging.info(f"Counted about {counts.entities} entities for {table}")
+        return counts.entities
+
+    def __call__(self, cqpp: Path) -> Optional[int]:
+        sidecar = cqpp.with_name(cqpp.name + ENTITIES_SUFFIX)
+
+        if sidecar.exists():
+            return int(sidecar.read_text().strip())
+
+        name = split_cqpp_name(cqpp)
+        if name is None or self.csv_dir is None:
+            return None
+
+        table = name[0]
+        if table not in self.tables:
+            self.tables[table] = self.count_table(table)
+
+        entities = self.tables[table]
+        if entities is not None:
+            sidecar.write_text(f"{entities}\n")
+        return entities
+
+
+def plan_uploads(
+        items: List[T],
+        order: str,
+        size: Callable[[T], int],
+        entities: Optional[Callable[[T], Optional[int]]] = None,
+        name: Callable[[T], str] = str,
+) -> List[T]:
+    """
+    Orders items for a pool of slots that are filled in order (like the per dataset semaphores).
+    For size and entities this is longest-processing-time-first: heaviest items go first,
+    every free slot takes the next heaviest, which bounds the makespan by 4/3 of the optimum.
+    Items without an entity count go after those with one, ordered by size.
+    """
+    if order == "glob":
+        return list(items)
+
+    if order == "name":
+        return sorted(items, key=name)
+
+    keys: Dict[int, Any]
+    if order == "size":
+        keys = {id(item): size(item) for item in items}
+    elif order == "entities":
+        if entities is None:
+            raise ValueError("Ordering by entities needs an entity counter")
+        keys = {id(item): (entities(item) or -1, size(item)) for item in items}
+    else:
+        raise ValueError(f"Unknown order {order}, choose one of {ORDER_KEYS}")
+
+    return sorted(items, key=lambda item: keys[id(item)], reverse=True)
@@ -0,0 +1,87 @@
+#!python3
+
+import logging
+import sys
+
+# Argument Parser
+from pathlib import Path
+
+from common import get_configured_arg_parser, configure_logger
+from descriptors import csv_delimiter, faulty_line_threshold, load_config, load_import_descriptors
+from pipeline.partition import DEFAULT_PREPROCESS_COMMAND, preprocess_partitioned
+from pipeline.staging import stage_sources
+from pipeline.validate import validate_imports
+from watch import DONE_MARKER
+
+root = Path(__file__).parent.parent
+
+parser = get_configured_arg_parser(with_api=False, description='Preprocess the sourceFiles in partitions by subject.')
+
+parser.add_argument('--imports', nargs='+', help='Import descriptors or folders of them.', type=Path,
+                    default=[root / 'datasets' / 'mimic' / 'imports'])
+parser.add_argument('--in', help='Folder of the sourceFiles.', type=Path, default=root / 'csv')
+parser.add_argument('--work', help='Folder for partitioned csvs and descriptors.', type=Path, default=root / 'csv' / 'partitions')
+parser.add_argument('--out', help='Folder to write the cqpps to.', type=Path, default=root / 'cqpp' / 'mimic')
+parser.add_argument('--partitions', help='Number of partitions per sourceFile.', type=int, default=4)
+parser.add_argument('--jobs', help='Partitions preprocessed at the same time, default is the number of cores.', type=int)
+parser.add_argument('--command', help='Preprocess command, with placeholders {desc}, {csv}, {out} and {tag}.',
+                    default=DEFAULT_PREPROCESS_COMMAND)
+parser.add_argument('--force', help='Also preprocess partitions that are up to date.', action='store_true')
+parser.add_argument('--skip-validation', help='Do not check the sourceFiles against the descriptors first.',
+                    action='store_true')
+parser.add_argument('--staging', help='Folder of the Parquet staging cache, default is `staging` in --work.',
+                    type=Path)
+parser.add_argument('--no-staging', help='Read the csvs for validation and partitioning directly.', action='store_true')
+
+arg_dict = vars(parser.parse_args())
+
+configure_logger(arg_dict)
+
+if arg_dict['partitions'] < 1:
+    logging.error("Need at least one partition.")
+    sys.exit(1)
+
+config = load_config(arg_dict['config'])
+descriptors = load_import_descriptors(arg_dict['imports'])
+
+# Parsed once, then validated and partitioned from Parquet
+staged = None
+if not arg_dict['no_staging']:
+    staged = stage_sources(
+        descriptors, arg_dict['in'], arg_dict['staging'] or arg_dict['work'] / 'staging', csv_delimiter(config)
+    )
+
+if not arg_dict['skip_validation']:
+    threshold = faulty_line_threshold(config)
+    reports = validate_imports(descriptors, arg_dict['in'], csv_delimiter(config), threshold, staged=staged)
+
+    if not all(report.passes(threshold) for report in reports):
+        logging.error("Validation failed, not preprocessing.")
+        sys.exit(1)
+
+# request.py --watch uploads the cqpps until the marker of a completed run appears
+marker = arg_dict['out'] / DONE_MARKER
+marker.unlink(missing_ok=True)
+
+results = preprocess_partitioned(
+    descriptors=descriptors,
+    in_dir=arg_dict['in'],
+    work_dir=arg_dict['work'],
+    out_dir=arg_dict['out'],
+    partitions=arg_dict['partitions'],
+    delimiter=csv_delimiter(config),
+    command=arg_dict['command'],
+    jobs=arg_dict['jobs'],
+    force=arg_dict['force'],
+    staged=staged,
+)
+
+failed = [tag for tag, error in results.items() if error]
+
+if failed:
+    logging.error(f"Failed partitions {failed}, rerun to retry only those")
+    sys.exit(1)
+
+marker.touch()
+
+logging.info(f"Preprocessed {len(results)} partitions")
@@ -0,0 +1,123 @@
+"""Live throughput and ETA reporting for bulk transfers."""
+import asyncio
+import logging
+import time
+
+from typing import Dict, Hashable, Optional
+
+
+def human_bytes(count: float) -> str:
+    for unit in ["B", "KB", "MB", "GB"]:
+        if abs(count) < 1024:
+            return f"{count:.1f} {unit}"
+        count /= 1024
+    return f"{count:.1f} TB"
+
+
+def human_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+
+
+class _Counter:
+    def __init__(self, total: int = 0):
+        self.total = total
+        self.done = 0
+        self.started = time.monotonic()
+        # state at the previous report, to get the current rather than the average rate
+        self.reported_done = 0
+        self.reported_at = self.started
+
+    def rate(self, now: float) -> float:
+        return self.done / max(now - self.started, 1e-9)
+
+    def window_rate(self, now: float) -> float:
+        rate = (self.done - self.reported_done) / max(now - self.reported_at, 1e-9)
+        self.reported_done = self.done
+        self.reported_at = now
+        return rate
+
+
+class TransferProgress:
+    """
+    Counts transferred bytes per file, per group (e.g. dataset) and overall.
+    report() logs current bytes/s and ETA, run() does so periodically while a transfer is in progress.
+    """
+
+    def __init__(self, name: str = "Transfer"):
+        self.name = name
+        self.overall = _Counter()
+        self.groups: Dict[Hashable, _Counter] = {}
+        self.files: Dict[Hashable, _Counter] = {}
+        self.file_groups: Dict[Hashable, Hashable] = {}
+
+    def plan(self, group: Hashable, size: int) -> None:
+        """Announces size bytes that will be transferred for group, used to compute the ETA."""
+        self.overall.total += size
+        self.groups.setdefault(group, _Counter()).total += size
+
+    def start(self, group: Hashable, file: Hashable, size: int) -> None:
+        """Starts counting file, whose key must be unique among the transfers in progress."""
+        if file in self.files:
+            # A second transfer under the same key would clobber the first and be finished twice
+            raise ValueError(f"{self.name} of {file} is already in progress")
+        self.groups.setdefault(group, _Counter())
+        self.files[file] = _Counter(size)
+        self.file_groups[file] = group
+
+    def advance(self, file: Hashable, count: int) -> None:
+        self.files[file].done += count
+        self.groups[self.file_groups[file]].done += count
+        self.overall.done += count
+
+    def restart(self, file: Hashable) -> None:
+        """Forgets the bytes of a failed attempt, so a retry is not counted twice."""
+        counter = self.files[file]
+        self.groups[self.file_groups[file]].done -= counter.done
+        self.overall.done -= counter.done
+        self.files[file] = _Counter(counter.total)
+
+    def finish(self, file: Hashable) -> None:
+        counter = self.files.pop(file)
+        self.file_groups.pop(file)
+
+        elapsed = time.monotonic() - counter.started
+        logging.info(
+            f"{self.name} of {file}: {human_bytes(counter.done)} in {human_duration(elapsed)}"
+            f" at {human_bytes(counter.rate(time.monotonic()))}/s"
+        )
+
+    def report(self) -> None:
+        now = time.monotonic()
+        overall = self.overall
+
+        rate = overall.window_rate(now)
+        average = overall.rate(now)
+        remaining = max(overall.total - overall.done, 0)
+        eta = human_duration(remaining / average) if average > 0 else "?"
+        percent = 100 * overall.done / overall.total if overall.total else 100
+
+        groups = ", ".join(f"{group}: {human_bytes(counter.window_rate(now))}/s" for group, counter in self.groups.items())
+        files = ", ".join(
+            f"{file} {100 * counter.done / max(counter.total, 1):.0f}% at {human_bytes(counter.window_rate(now))}/s"
+            for file, counter in self.files.items()
+        )
+
+        logging.info(
+            f"{self.name}: {human_bytes(overall.done)} of {human_bytes(overall.total)} ({percent:.0f}%)"
+            f" at {human_bytes(rate)}/s (avg {human_bytes(average)}/s), ETA {eta}"
+            f" | {groups} | {files or 'idle'}"
+        )
+
+    async def run(self, interval: Optional[float]) -> None:
+        """Reports every interval seconds until cancelled, does nothing if interval is not set."""
+        if not interval:
+            return
+
+        while True:
+            await asyncio.sleep(interval)
+            self.report()
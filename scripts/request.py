@@ -1,19 +1,20 @@
 #!python3
 
 import aiohttp
+import argparse
 import asyncio
-import gzip
 import logging
 import sys
-import time
 
-from asyncio import Semaphore
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from requests import Response, Session
-from typing import Any, Dict, List, Set, Optional
+from typing import Any, Dict, List, Set, Optional, Tuple, Union
 
-from actions.actions_def import Action, exclude_tag
+from actions.actions_def import Action, exclude_tag, get_dependents
+from actions.instrument import instrument
 from actions.parse_arguments import configure_arg_parser_for_actions, get_request
+from actions.scheduler import run_actions
 from common import (
     JSON_HEADER,
     Dataset,
@@ -25,25 +26,39 @@ from common import (
     log_request,
     remove_suffix,
 )
-
-
-def main_request():
-    # Here is the order of execution for the actions defined.
-    actions_ordered = [
+from descriptors import csv_delimiter, load_config, load_import_descriptors
+from jobs import DEFAULT_JOB_TIMEOUT, DEFAULT_POLL_INTERVAL, wait_for_jobs
+from manifest import CqppManifest, hash_files
+from metrics import record_request, recorder
+from pipeline.verify import compare_counts, count_tables
+from planner import ORDER_KEYS, EntityCounter, plan_uploads
+from progress import TransferProgress
+from streaming import DEFAULT_CHUNK_SIZE, mmap_chunks
+from limiter import DEFAULT_MAX_PARALLELISM, AdaptiveLimiter, FixedLimiter
+from uploader import DEFAULT_PARALLELISM, ResponseSnapshot, UploadJob, send_with_retries, upload_jobs
+from watch import DEFAULT_WATCH_INTERVAL, DEFAULT_WATCH_TIMEOUT, DONE_MARKER, finalized_files
+
+
+def get_actions() -> List[Action]:
+    # Here is the order of execution for the actions defined, which is also used for --from/--to.
+    # Actions run as soon as their (requested) dependencies have finished, independent ones run concurrently.
+    return [
         Action("dataset", create_dataset),
-        Action("mapping", upload_mappings),
-        Action("secondaryid", create_secondary_ids),
-        Action("search", upload_search_index),
-        Action("table", create_tables),
-        Action("concept", create_concepts),
-        Action("cqpp", upload_cqpps),
-        Action("structure", upload_structures),
-        Action("preview", add_preview_config),
-        Action("decoding", upload_id_mappings),
-        Action("update", submit_update_matching_stats),
+        Action("mapping", upload_mappings, depends_on={"dataset"}),
+        Action("secondaryid", create_secondary_ids, depends_on={"dataset"}),
+        Action("search", upload_search_index, depends_on={"dataset"}),
+        Action("table", create_tables, depends_on={"dataset", "secondaryid"}),
+        Action("concept", create_concepts, depends_on={"table", "search", "mapping"}),
+        Action("cqpp", upload_cqpps, depends_on={"table"}),
+        Action("structure", upload_structures, depends_on={"concept"}),
+        Action("preview", add_preview_config, depends_on={"concept"}),
+        Action("decoding", upload_id_mappings, depends_on={"dataset"}),
+        Action("update", submit_update_matching_stats, depends_on={"cqpp", "concept"}),
+        Action("verify", verify_import, depends_on={"update"}),
     ]
 
-    # Argument Parser
+
+def get_request_arg_parser(actions_ordered: List[Action]) -> argparse.ArgumentParser:
     parser = get_configured_arg_parser()
     configure_arg_parser_for_actions(
         parser, {act.name for act in actions_ordered}, exclude_tag
@@ -51,6 +66,7 @@ def main_request():
 
     parser.add_argument("--cqpp", help="Root folder of preprocessed files.", type=Path)
     parser.add_argument("--decode", help="Root folder of PID-decode files.", type=Path)
+    parser.add_argument("--csv", help="Folder of the csvs the cqpps were preprocessed from, used to count entities.", type=Path)
     parser.add_argument(
         "--json",
         help="Root folder of json files that will be created/used.",
@@ -59,11 +75,160 @@ def main_request():
     )
     parser.add_argument(
         "--parallelism",
-        help="Number of threads per Dataset to upload CQPPs. If None, will upload sequentially for all datasets, so at least 1 is recommended.",
+        help="Number of concurrent uploads per Dataset, for the json actions, decode and cqpp. "
+             f"Default is {DEFAULT_PARALLELISM}, 0 uploads sequentially for all datasets.",
+        type=int,
+        default=DEFAULT_PARALLELISM,
+    )
+
+    parser.add_argument(
+        "--reupload",
+        help="Upload all cqpps, even those the manifest of previous runs records as already uploaded.",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--retries",
+        help="Number of retries for a cqpp or decoding upload that failed with a connection error, timeout or 5xx.",
+        type=int,
+        default=3,
+    )
+    parser.add_argument(
+        "--retry-backoff",
+        help="Base delay in seconds of the exponential backoff between retries.",
+        type=float,
+        default=2.0,
+    )
+
+    parser.add_argument(
+        "--chunk-size",
+        help="Size in bytes of the chunks cqpps are streamed in.",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+    )
+    parser.add_argument(
+        "--progress-interval",
+        help="Seconds between throughput/ETA reports while uploading cqpps, 0 to disable.",
+        type=float,
+        default=10,
+    )
+
+    parser.add_argument(
+        "--cqpp-order",
+        help="Order of cqpp uploads per dataset: largest first by file size or entity count"
+             " (from `$table.$tag.cqpp.entities` or counted in --csv), by name, or as found (glob).",
+        choices=ORDER_KEYS,
+        default="size",
+    )
+
+    parser.add_argument(
+        "--decode-plain",
+        help="Decompress decoding files on the client instead of sending them gzip encoded.",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--adaptive",
+        help="Adapt the number of concurrent cqpp uploads, shared by all datasets, to the server's latency and errors. "
+             "--parallelism is the initial number.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--max-parallelism",
+        help="Upper bound of --adaptive.",
         type=int,
-        default=None,
+        default=DEFAULT_MAX_PARALLELISM,
+    )
+
+    parser.add_argument(
+        "--watch",
+        help="Upload cqpps while they are preprocessed, as soon as each is complete, until the marker appears.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--watch-marker",
+        help="File in each cqpp folder that marks the end of preprocessing.",
+        default=DONE_MARKER,
+    )
+    parser.add_argument(
+        "--watch-interval",
+        help="Seconds between looks at the cqpp folders, a file is complete once it did not change in between.",
+        type=float,
+        default=DEFAULT_WATCH_INTERVAL,
+    )
+    parser.add_argument(
+        "--watch-timeout",
+        help="Seconds without new or growing cqpps and without the marker after which --watch fails, "
+             "e.g. because preprocessing failed. 0 to wait forever.",
+        type=float,
+        default=DEFAULT_WATCH_TIMEOUT,
+    )
+
+    parser.add_argument(
+        "--job-timeout",
+        help="Seconds to wait for the server to finish importing cqpps with --wait-imports, "
+             "and for the matching stats with --wait-update. 0 to not wait.",
+        type=float,
+        default=DEFAULT_JOB_TIMEOUT,
+    )
+    parser.add_argument(
+        "--job-poll-interval",
+        help="Seconds between polls of the job status.",
+        type=float,
+        default=DEFAULT_POLL_INTERVAL,
+    )
+    parser.add_argument(
+        "--wait-imports",
+        help="Wait until the server imported the cqpps before finishing the cqpp action. "
+             "Implied if an action depending on cqpp (update, verify) is requested too.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--wait-update",
+        help="Wait until the matching stats are updated before finishing.",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--verify-tolerance",
+        help="Relative difference between the entities and rows of a table on the server and in the csvs (--csv) "
+             "that fails the verify action.",
+        type=float,
+        default=0.03,
+    )
+
+    parser.add_argument("--metrics", help="JSONL file to append an event per admin API request to.", type=Path)
+    parser.add_argument(
+        "--profile",
+        help="Folder to write a CPU and allocation profile per action to. Actions run one at a time then.",
+        type=Path,
+    )
+
+    return parser
+
+
+def get_action_arguments(arg_dict: Dict[str, Any]) -> Dict[str, Any]:
+    """The keyword arguments every Action.callable is called with."""
+    api_url, session = get_authorized_session(arg_dict)
+
+    return dict(
+        arg_dict=arg_dict,
+        data_dir=arg_dict["cqpp"],
+        decoding_dir=arg_dict["decode"] or arg_dict["cqpp"],
+        json_dir=arg_dict["json"],
+        parallel=arg_dict["parallelism"],
+        datasets=get_datasets(arg_dict),
+        session=session,
+        api_datasets=api_url + "/datasets",
     )
 
+
+def main_request():
+    actions_ordered = get_actions()
+
+    # Argument Parser
+    parser = get_request_arg_parser(actions_ordered)
+
     arg_dict = vars(parser.parse_args())
 
     configure_logger(arg_dict)
@@ -72,40 +237,32 @@ def main_request():
         act.name for act in get_request(arg_dict, actions_ordered, exclude_tag)
     }
 
-    data_dir: Path = arg_dict["cqpp"]
-
-    parallel: Optional[int] = arg_dict["parallelism"]
+    parallel: int = arg_dict["parallelism"]
 
-    api_url, session = get_authorized_session(arg_dict)
+    # Only worth waiting for the imports if something in this run reads the imported data
+    arg_dict["wait_imports"] = arg_dict["wait_imports"] or bool(request & get_dependents("cqpp", actions_ordered))
 
     logging.debug(arg_dict)
 
-    if parallel and parallel < 1:
-        logging.error("Need at least one thread per Dataset.")
+    if parallel < 0:
+        logging.error("Need at least one upload per Dataset, or 0 for sequential uploads.")
         sys.exit(1)
 
-    failures: List[Response] = []
+    failures: List[Union[Response, ResponseSnapshot]] = []
 
-    remaining = len(request)
-    selection = get_datasets(arg_dict)
-
-    for action in actions_ordered:
-        if action.name in request:
-            failures.extend(action.callable(
-                arg_dict=arg_dict,
-                data_dir=data_dir,
-                decoding_dir=arg_dict.get("decode", data_dir),
-                json_dir=arg_dict["json"],
-                parallel=parallel,
-                datasets=selection,
-                session=session,
-                api_datasets=api_url + "/datasets",
-            ))
+    profile_dir: Optional[Path] = arg_dict["profile"]
+    recorder.configure(arg_dict["metrics"])
+
+    failures.extend(run_actions(
+        [instrument(action, profile_dir) for action in actions_ordered],
+        request,
+        # Allocations are traced per process, so profiles are only meaningful one action at a time
+        max_workers=1 if profile_dir else None,
+        **get_action_arguments(arg_dict),
+    ))
 
-            remaining -= 1
-            # If this is the last action, we do not have to wait
-            if remaining > 0:
-                time.sleep(5)
+    recorder.log_summary()
+    recorder.close()
 
     if not failures:
         sys.exit(0)
@@ -138,6 +295,11 @@ def create_dataset(
             headers=JSON_HEADER,
         )
 
+        record_request(
+            "POST", api_datasets, resp.status_code, resp.elapsed.total_seconds(),
+            bytes_sent=len(resp.request.body or b""), dataset=dataset.name,
+        )
+
         msg = f"Creating dataset {dataset.name}"
         log_request(msg=msg, response=resp)
 
@@ -145,239 +307,334 @@ def create_dataset(
 
 
 def add_preview_config(
+        arg_dict: Dict[str, Any],
         datasets: Set[Dataset],
-        session: Session,
+        parallel: Optional[int],
         api_datasets: str,
         json_dir: Path,
         **_,  # ignore remaining keyword arguments
-) -> List[Response]:
-    failures: List[Response] = []
-    for dataset in datasets:
-        api_preview = f"{api_datasets}/{dataset.name}/preview"
-        preview = json_dir / dataset.id / f"preview.json"
-
-        resp = session.post(api_preview, data=preview.open("rb"), headers=JSON_HEADER)
-
-        msg = f"Upload preview for {dataset.name} with response {resp.status_code}"
-        log_request(msg=msg, response=resp)
-
-        if not resp.ok:
-            failures.append(resp)
+) -> List[ResponseSnapshot]:
+    jobs = (
+        UploadJob(
+            dataset=dataset,
+            url=f"{api_datasets}/{dataset.name}/preview",
+            file=json_dir / dataset.id / "preview.json",
+            label=f"Upload preview for {dataset.name}",
+        )
+        for dataset in datasets
+    )
 
-    return failures
+    return upload_jobs(arg_dict, jobs, parallel)
 
 
 def create_secondary_ids(
+        arg_dict: Dict[str, Any],
         datasets: Set[Dataset],
-        session: Session,
+        parallel: Optional[int],
         api_datasets: str,
         json_dir: Path,
         **_,  # ignore remaining keyword arguments
-) -> List[Response]:
-    failures: List[Response] = []
-
-    for dataset in datasets:
-        api_secondary_ids = f"{api_datasets}/{dataset.name}/secondaryId"
-
-        for secondary_id in (json_dir / dataset.id / "secondaryIds").glob("*.json"):
-
-            resp = session.post(
-                api_secondary_ids, data=secondary_id.open("rb"), headers=JSON_HEADER
-            )
-
-            secondary_id_name = remove_suffix(secondary_id.name, ".import.json")
-            msg = f"Upload secondaryId {dataset.name}.{secondary_id_name} with response {resp.status_code}"
-            log_request(msg=msg, response=resp)
-
-            if not resp.ok:
-                failures.append(resp)
+) -> List[ResponseSnapshot]:
+    jobs = (
+        UploadJob(
+            dataset=dataset,
+            url=f"{api_datasets}/{dataset.name}/secondaryId",
+            file=secondary_id,
+            label=f"Upload secondaryId {dataset.name}.{remove_suffix(secondary_id.name, '.import.json')}",
+        )
+        for dataset in datasets
+        for secondary_id in (json_dir / dataset.id / "secondaryIds").glob("*.json")
+    )
 
-    return failures
+    return upload_jobs(arg_dict, jobs, parallel)
 
 
 def upload_mappings(
+        arg_dict: Dict[str, Any],
         datasets: Set[Dataset],
-        session: Session,
+        parallel: Optional[int],
         api_datasets: str,
         json_dir: Path,
         **_,  # ignore remaining keyword arguments
-) -> List[Response]:
-    failures: List[Response] = []
-
-    for dataset in datasets:
-        api = f"{api_datasets}/{dataset.name}/internToExtern"
-
-        for id in (json_dir / dataset.id / "mappings").glob("*.json"):
-
-            resp = session.post(
-                api, data=id.open("rb"), headers=JSON_HEADER
-            )
-
-            name = remove_suffix(id.name, ".mapping.json")
-            msg = f"Upload internToExtern mapping {dataset.name}.{name} with response {resp.status_code}"
-            log_request(msg=msg, response=resp)
-
-            if not resp.ok:
-                failures.append(resp)
+) -> List[ResponseSnapshot]:
+    jobs = (
+        UploadJob(
+            dataset=dataset,
+            url=f"{api_datasets}/{dataset.name}/internToExtern",
+            file=id,
+            label=f"Upload internToExtern mapping {dataset.name}.{remove_suffix(id.name, '.mapping.json')}",
+        )
+        for dataset in datasets
+        for id in (json_dir / dataset.id / "mappings").glob("*.json")
+    )
 
-    return failures
+    return upload_jobs(arg_dict, jobs, parallel)
 
 
 def upload_search_index(
+        arg_dict: Dict[str, Any],
         datasets: Set[Dataset],
-        session: Session,
+        parallel: Optional[int],
         api_datasets: str,
         json_dir: Path,
         **_,  # ignore remaining keyword arguments
-) -> List[Response]:
-    failures: List[Response] = []
-
-    for dataset in datasets:
-        api = f"{api_datasets}/{dataset.name}/searchIndex"
-
-        for id in (json_dir / dataset.id / "searchIndex").glob("*.json"):
-
-            resp = session.post(
-                api, data=id.open("rb"), headers=JSON_HEADER
-            )
-
-            name = remove_suffix(id.name, ".filter.json")
-            msg = f"Upload search index mapping {dataset.name}.{name} with response {resp.status_code}"
-            log_request(msg=msg, response=resp)
-
-            if not resp.ok:
-                failures.append(resp)
+) -> List[ResponseSnapshot]:
+    jobs = (
+        UploadJob(
+            dataset=dataset,
+            url=f"{api_datasets}/{dataset.name}/searchIndex",
+            file=id,
+            label=f"Upload search index mapping {dataset.name}.{remove_suffix(id.name, '.filter.json')}",
+        )
+        for dataset in datasets
+        for id in (json_dir / dataset.id / "searchIndex").glob("*.json")
+    )
 
-    return failures
+    return upload_jobs(arg_dict, jobs, parallel)
 
 
 def create_tables(
+        arg_dict: Dict[str, Any],
         datasets: Set[Dataset],
-        session: Session,
+        parallel: Optional[int],
         api_datasets: str,
         json_dir: Path,
         **_,  # ignore remaining keyword arguments
-) -> List[Response]:
-    failures: List[Response] = []
-
-    for dataset in datasets:
-        for table_file in (json_dir / dataset.id / "tables").glob("*.table.json"):
-
-            api_tables = f"{api_datasets}/{dataset.name}/tables"
-
-            resp = session.post(
-                api_tables, data=table_file.open("rb"), headers=JSON_HEADER
-            )
-
-            table_file_name = remove_suffix(table_file.name, ".table.json")
-            msg = f"Upload table {dataset.name}.{table_file_name} with response {resp.status_code}"
-            log_request(msg=msg, response=resp)
-
-            if not resp.ok:
-                failures.append(resp)
+) -> List[ResponseSnapshot]:
+    jobs = (
+        UploadJob(
+            dataset=dataset,
+            url=f"{api_datasets}/{dataset.name}/tables",
+            file=table_file,
+            label=f"Upload table {dataset.name}.{remove_suffix(table_file.name, '.table.json')}",
+        )
+        for dataset in datasets
+        for table_file in (json_dir / dataset.id / "tables").glob("*.table.json")
+    )
 
-    return failures
+    return upload_jobs(arg_dict, jobs, parallel)
 
 
 def create_concepts(
+        arg_dict: Dict[str, Any],
         datasets: Set[Dataset],
-        session: Session,
+        parallel: Optional[int],
         api_datasets: str,
         json_dir: Path,
         **_,  # ignore remaining keyword arguments
-) -> List[Response]:
-    failures: List[Response] = []
-
-    for dataset in datasets:
-        api_concepts = f"{api_datasets}/{dataset.name}/concepts"
-
-        for concept in (json_dir / dataset.id / "concepts").glob("*.concept.json"):
-
-            resp = session.post(
-                api_concepts, data=concept.open("rb"), headers=JSON_HEADER
-            )
-
-            concept_name = remove_suffix(concept.name, ".concept.json")
-            msg = f"Upload concept {dataset.name}.{concept_name} with response {resp.status_code}"
-            log_request(msg=msg, response=resp)
-
-            if not resp.ok:
-                failures.append(resp)
+) -> List[ResponseSnapshot]:
+    jobs = (
+        UploadJob(
+            dataset=dataset,
+            url=f"{api_datasets}/{dataset.name}/concepts",
+            file=concept,
+            label=f"Upload concept {dataset.name}.{remove_suffix(concept.name, '.concept.json')}",
+        )
+        for dataset in datasets
+        for concept in (json_dir / dataset.id / "concepts").glob("*.concept.json")
+    )
 
-    return failures
+    return upload_jobs(arg_dict, jobs, parallel)
 
 
 def upload_cqpps(
         arg_dict: Dict[str, Any],
         datasets: Set[Dataset],
         parallel: Optional[int],
+        session: Session,
         api_datasets: str,
         data_dir: Path,
+        json_dir: Path,
         **_,  # ignore remaining keyword arguments
-) -> List[Response]:  # This action doesn't return any failures, only an empty List
+) -> List[ResponseSnapshot]:
     async def upload_cqpp(
             dataset: Dataset,
             cqpp: Path,
+            method: str,
             session: aiohttp.ClientSession,
-            semaphores: Dict[Dataset, Semaphore],
-    ):
+            limiter: Union[AdaptiveLimiter, FixedLimiter],
+            manifest: CqppManifest,
+            progress: TransferProgress,
+    ) -> ResponseSnapshot:
 
         api_cqpps = f"{api_datasets}/{dataset.name}/cqpp"
+        size = cqpp.stat().st_size
+        # File names repeat across datasets
+        file = f"{dataset.name}/{cqpp.name}"
+
+        async def send() -> ResponseSnapshot:
+            progress.restart(file)
+
+            body = mmap_chunks(cqpp, arg_dict["chunk_size"], lambda count: progress.advance(file, count))
+
+            async with session.request(
+                    method,
+                    api_cqpps,
+                    data=body,
+                    # Explicit length, so the body is not sent chunked
+                    headers={"Content-Type": "application/octet-stream", "Content-Length": str(size)},
+            ) as resp:
+                return ResponseSnapshot(api_cqpps, resp.status, await resp.text())
+
+        async with limiter.slot(dataset) as lease:
+            progress.start(dataset.name, file, size)
+
+            snapshot = await send_with_retries(
+                send, api_cqpps, f"Upload cqpp {cqpp} ({method})", arg_dict["retries"], arg_dict["retry_backoff"],
+                on_attempt=lambda attempt: lease.feedback(attempt.status_code, attempt.elapsed, size),
+            )
 
-        async with semaphores[dataset]:
-            with open(cqpp, "rb") as data:
-                try:
-                    async with session.post(
-                            api_cqpps,
-                            data=data,
-                            headers={"Content-Type": "application/octet-stream"},
-                    ) as resp:
-                        await resp.text()
-                        logging.info(f"Uploaded cqpp {cqpp}")
-                except Exception as err:
-                    logging.warning(f"Failed to upload Cqpp {cqpp}:{err}")
+            progress.finish(file)
+
+        record_request(
+            method, api_cqpps, snapshot.status_code, snapshot.elapsed,
+            bytes_sent=size, dataset=dataset.name, file=cqpp, retries=snapshot.retries,
+        )
+        manifest.record(cqpp, snapshot.status_code or None, snapshot.ok)
+        log_request(msg=f"Uploaded cqpp {cqpp} ({method}) with response {snapshot.status_code}", response=snapshot)
+
+        return snapshot
 
     async def do_upload(
             loop: asyncio.AbstractEventLoop, datasets: Set[Dataset], parallel: Optional[int]
-    ) -> None:
+    ) -> List[ResponseSnapshot]:
         aio_session: aiohttp.ClientSession
 
-        async with aiohttp.ClientSession(
-                headers=get_auth_headers(arg_dict)
-        ) as aio_session:
+        manifests: Dict[Dataset, CqppManifest] = {}
+        planned: Dict[Dataset, List[Tuple[Path, str]]] = {}
+        progress = TransferProgress("Upload")
+        delimiter = csv_delimiter(load_config(arg_dict["config"]))
+
+        # Hash new and changed files of all datasets in one pool
+        pool = ThreadPoolExecutor(thread_name_prefix="hash")
 
-            if parallel:
-                slots = int(parallel)
-                logging.info(f"Uploading to {datasets} using {parallel} per dataset")
+        try:
+            if arg_dict["watch"]:
+                for dataset in datasets:
+                    cqpp_dir = data_dir / dataset.id / "cqpp"
+                    manifests[dataset] = CqppManifest.load(cqpp_dir, api_datasets)
+                    planned[dataset] = []
             else:
-                single_semaphore = Semaphore(1)
+                for dataset in datasets:
+                    cqpp_dir = data_dir / dataset.id / "cqpp"
+                    cqpps = sorted(cqpp_dir.glob("*.cqpp"))
 
-            # If parallelism is set, distribute it evenly among datasets,
-            # else return single_semaphore for all, making this single_threaded.
-            dataset_semaphores: Dict[Dataset, Semaphore] = {
-                dataset: Semaphore(slots) if parallel else single_semaphore
-                for dataset in datasets
-            }
+                    manifest = CqppManifest.load(cqpp_dir, api_datasets)
+                    manifest.refresh(cqpps, pool)
 
-            tasks: List[asyncio.Task] = []
+                    imports = json_dir / dataset.id / "imports"
+                    count_entities = EntityCounter(
+                        load_import_descriptors([imports]) if imports.exists() else [], arg_dict["csv"], delimiter
+                    )
+
+                    # Import tables with most distinct PIDs first for dictionary
+                    manifests[dataset] = manifest
+                    planned[dataset] = plan_uploads(
+                        manifest.plan(cqpps, reupload=arg_dict["reupload"]),
+                        arg_dict["cqpp_order"],
+                        size=lambda planned_cqpp: manifest.entries[planned_cqpp[0].name].size,
+                        entities=lambda planned_cqpp: count_entities(planned_cqpp[0]),
+                        name=lambda planned_cqpp: planned_cqpp[0].name,
+                    )
+
+                    for cqpp, _ in planned[dataset]:
+                        progress.plan(dataset.name, manifest.entries[cqpp.name].size)
+
+                    logging.info(f"Uploading {len(planned[dataset])} of {len(cqpps)} cqpps for {dataset}")
+
+            async with aiohttp.ClientSession(
+                    headers=get_auth_headers(arg_dict)
+            ) as aio_session:
+
+                limiter: Union[AdaptiveLimiter, FixedLimiter]
+
+                if arg_dict["adaptive"]:
+                    limiter = AdaptiveLimiter(initial=parallel or 2, maximum=arg_dict["max_parallelism"], name="cqpp uploads")
+                    logging.info(f"Uploading to {datasets} using between 1 and {limiter.maximum} in total")
+                else:
+                    limiter = FixedLimiter(datasets, parallel)
+                    if parallel:
+                        logging.info(f"Uploading to {datasets} using {parallel} per dataset")
 
-            for dataset in datasets:
-                for cqpp in (data_dir / dataset.id / "cqpp/").glob("*.cqpp"):
+                tasks: List[asyncio.Task] = []
+
+                def enqueue(dataset: Dataset, cqpp: Path, method: str) -> None:
                     tasks.append(
                         loop.create_task(
-                            upload_cqpp(dataset, cqpp, aio_session, dataset_semaphores)
+                            upload_cqpp(dataset, cqpp, method, aio_session, limiter, manifests[dataset], progress)
                         )
                     )
 
-            await asyncio.gather(*tasks)
+                async def watch(dataset: Dataset) -> List[ResponseSnapshot]:
+                    """Uploads the cqpps of a dataset as preprocessing finishes them, in the order they are done."""
+                    manifest = manifests[dataset]
+                    cqpp_dir = data_dir / dataset.id / "cqpp"
+                    finalized: List[Path] = []
+
+                    try:
+                        async for ready in finalized_files(
+                                cqpp_dir, marker=arg_dict["watch_marker"], interval=arg_dict["watch_interval"],
+                                timeout=arg_dict["watch_timeout"],
+                        ):
+                            finalized.extend(ready)
+                            # Only the hashing leaves the loop, the manifest is updated here like by the uploads
+                            stale = manifest.stale(ready)
+                            manifest.update(await loop.run_in_executor(None, hash_files, stale, pool))
+
+                            for cqpp, method in manifest.plan(ready, reupload=arg_dict["reupload"]):
+                                progress.plan(dataset.name, manifest.entries[cqpp.name].size)
+                                enqueue(dataset, cqpp, method)
+                    except TimeoutError as error:
+                        logging.error(f"Stopped watching {cqpp_dir}: {error}")
+                        return [ResponseSnapshot(str(cqpp_dir), 0, str(error))]
+
+                    # All files are known once the marker appeared, the others don't exist anymore
+                    manifest.prune(finalized)
+                    return []
+
+                for dataset in datasets:
+                    for cqpp, method in planned[dataset]:
+                        enqueue(dataset, cqpp, method)
+
+                reporter = loop.create_task(progress.run(arg_dict["progress_interval"]))
+
+                watch_failures: List[ResponseSnapshot] = []
+
+                try:
+                    if arg_dict["watch"]:
+                        for dataset_failures in await asyncio.gather(*(watch(dataset) for dataset in datasets)):
+                            watch_failures.extend(dataset_failures)
+                    responses = await asyncio.gather(*tasks)
+                finally:
+                    reporter.cancel()
+                    for manifest in manifests.values():
+                        manifest.save()
+        finally:
+            pool.shutdown()
+
+        if responses:
+            progress.report()
+
+        failures = [response for response in responses if not response.ok]
+
+        if failures:
+            logging.error(f"Failed to upload {len(failures)} of {len(responses)} cqpps, rerun to resume them")
+
+        return failures + watch_failures
 
     loop = asyncio.new_event_loop()
 
-    loop.run_until_complete(do_upload(loop, datasets, parallel))
+    failures = loop.run_until_complete(do_upload(loop, datasets, parallel))
 
     loop.close()
 
-    return []  # This action doesn't return any failures
+    # The manager imports in the background, actions depending on the data have to wait for it
+    if arg_dict["wait_imports"]:
+        failures.extend(wait_for_jobs(
+            session, api_datasets, datasets, arg_dict["job_timeout"], arg_dict["job_poll_interval"], "imports"
+        ))
+
+    return failures
 
 
 def upload_structures(
@@ -392,11 +649,16 @@ def upload_structures(
     for dataset in datasets:
         api_structure = f"{api_datasets}/{dataset.name}/structure"
 
-        with open(
-                str(json_dir / dataset.id / f"structure_{dataset.id}.json"), "rb"
-        ) as data:
+        structure = json_dir / dataset.id / f"structure_{dataset.id}.json"
+
+        with open(str(structure), "rb") as data:
             resp = session.post(api_structure, data=data, headers=JSON_HEADER)
 
+            record_request(
+                "POST", api_structure, resp.status_code, resp.elapsed.total_seconds(),
+                bytes_sent=structure.stat().st_size, dataset=dataset.name, file=structure,
+            )
+
             msg = f"Upload structure json for dataset {dataset.id} with response {resp.status_code}"
             log_request(msg=msg, response=resp)
 
@@ -407,60 +669,135 @@ def upload_structures(
 
 
 def upload_id_mappings(
+        arg_dict: Dict[str, Any],
         datasets: Set[Dataset],
-        session: Session,
+        parallel: Optional[int],
         decoding_dir: Path,
         api_datasets: str,
         **_,  # ignore remaining keyword arguments
-) -> List[Response]:
-    headers = {"Content-Type": "application/octet-stream"}
+) -> List[ResponseSnapshot]:
+    decodings: Dict[Dataset, Path] = {}
 
     for dataset in datasets:
 
         if "adb" not in dataset.sources:
             continue
 
-        decodings = list((decoding_dir / dataset.id / "csv").glob("decoding.*.csv.gz"))
+        found = list((decoding_dir / dataset.id / "csv").glob("decoding.*.csv.gz"))
 
-        if len(decodings) != 1:
+        if len(found) != 1:
             raise ValueError(
-                f"Found {len(decodings)} files. Need exactly one. (dir = {decoding_dir})"
-            )
-
-        decoding = decodings[0]
-
-        with gzip.open(decoding, "rb") as data:
-            resp = session.post(
-                f"{api_datasets}/{dataset.name}/mapping", headers=headers, data=data
+                f"Found {len(found)} files. Need exactly one. (dir = {decoding_dir})"
             )
 
-            msg = f"Upload decoding file {decoding} for dataset {dataset} with response {resp.status_code}"
-            log_request(msg=msg, response=resp)
+        decodings[dataset] = found[0]
+
+    # The files are already gzip, so they are passed through as they are and inflated by the server
+    jobs = (
+        UploadJob(
+            dataset=dataset,
+            url=f"{api_datasets}/{dataset.name}/mapping",
+            file=decoding,
+            label=f"Upload decoding file {decoding} for dataset {dataset}",
+            headers={"Content-Type": "application/octet-stream", "Content-Encoding": "gzip"},
+            decompressed=arg_dict["decode_plain"],
+            retries=arg_dict["retries"],
+            backoff=arg_dict["retry_backoff"],
+            chunk_size=arg_dict["chunk_size"],
+        )
+        for dataset, decoding in decodings.items()
+    )
 
-    return []  # This action doesn't return any failures
+    return upload_jobs(arg_dict, jobs, parallel)
 
 
 def submit_update_matching_stats(
+        arg_dict: Dict[str, Any],
         datasets: Set[Dataset],
         session: Session,
         api_datasets: str,
         **_,  # ignore remaining keyword arguments
-) -> List[Response]:
+) -> List[Union[Response, ResponseSnapshot]]:
     logging.info("Submit UpdateMatchingStats")
 
-    failures: List[Response] = []
+    failures: List[Union[Response, ResponseSnapshot]] = []
 
     for dataset in datasets:
         api_update = f"{api_datasets}/{dataset.name}/update-matching-stats"
 
         resp = session.post(api_update)
 
+        record_request("POST", api_update, resp.status_code, resp.elapsed.total_seconds(), dataset=dataset.name)
+
         msg = f"Execute updateMatchingStats for dataset {dataset.name} with responds {resp.status_code}"
         log_request(msg=msg, response=resp)
 
         if not resp.ok:
             failures.append(resp)
 
+    if arg_dict["wait_update"]:
+        failures.extend(wait_for_jobs(
+            session, api_datasets, datasets, arg_dict["job_timeout"], arg_dict["job_poll_interval"], "matching stats"
+        ))
+
+    return failures
+
+
+def server_table_counts(raw: Dict[str, Any]) -> Dict[str, Optional[int]]:
+    """Entities and rows of a table, reported for the table or summed over its imports."""
+    imports = raw.get("imports", [])
+
+    def total(key: str) -> Optional[int]:
+        if key in raw:
+            return raw[key]
+        values = [table_import.get(key) for table_import in imports]
+        return sum(values) if values and None not in values else None
+
+    return {"entities": total("numberOfEntities"), "rows": total("numberOfEntries")}
+
+
+def verify_import(
+        arg_dict: Dict[str, Any],
+        datasets: Set[Dataset],
+        session: Session,
+        api_datasets: str,
+        json_dir: Path,
+        **_,  # ignore remaining keyword arguments
+) -> List[Union[Response, ResponseSnapshot]]:
+    if not arg_dict["csv"]:
+        logging.info("Not verifying the import without the csvs (--csv)")
+        return []
+
+    failures: List[Union[Response, ResponseSnapshot]] = []
+    delimiter = csv_delimiter(load_config(arg_dict["config"]))
+
+    for dataset in datasets:
+        imports = json_dir / dataset.id / "imports"
+        if not imports.exists():
+            logging.info(f"Not verifying {dataset} without import descriptors in {imports}")
+            continue
+
+        logging.info(f"Verifying {dataset}")
+        tables = count_tables(load_import_descriptors([imports]), arg_dict["csv"], delimiter)
+
+        server: Dict[str, Dict[str, Optional[int]]] = {}
+        for table in tables:
+            api_table = f"{api_datasets}/{dataset.name}/tables/{table}"
+            resp = session.get(api_table)
+            record_request("GET", api_table, resp.status_code, resp.elapsed.total_seconds(), dataset=dataset.name)
+
+            if not resp.ok:
+                log_request(msg=f"Get table {dataset.name}.{table} with response {resp.status_code}", response=resp)
+                failures.append(resp)
+                continue
+
+            server[table] = server_table_counts(resp.json())
+
+        for table in compare_counts(tables, server, arg_dict["verify_tolerance"]):
+            failures.append(ResponseSnapshot(
+                f"{api_datasets}/{dataset.name}/tables/{table}", 0, f"Counts of {dataset.name}.{table} differ"
+            ))
+
     return failures
 
 
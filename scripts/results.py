@@ -0,0 +1,284 @@
+"""
+Downloads of query results from the ARROW and CSV result providers, streamed in record batches.
+A thread reads and parses the response into a bounded queue while the caller's sink consumes it,
+so memory holds a few batches no matter how large the result is.
+"""
+import csv
+import io
+import logging
+import queue
+import threading
+import time
+
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+
+from attr import define
+from pathlib import Path
+from requests import Response, Session
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Protocol, Tuple
+
+from progress import human_bytes, human_duration
+
+RESULT_FORMATS = ["arrow", "csv"]
+
+DEFAULT_BUFFER_BATCHES = 4
+
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+
+# Result provider paths below the query API
+RESULT_PATHS = {
+    "arrow": "result/arrow/{query}.arrs",
+    "csv": "result/csv/{query}.csv",
+}
+
+
+class ResultSink(Protocol):
+    def write(self, batch: pa.RecordBatch) -> None:
+        ...
+
+    def close(self) -> None:
+        ...
+
+
+class ArrowSink:
+    """Writes the batches as an Arrow IPC stream, opened with the schema of the first batch."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.writer: Optional[ipc.RecordBatchStreamWriter] = None
+
+    def write(self, batch: pa.RecordBatch) -> None:
+        if self.writer is None:
+            self.writer = ipc.new_stream(str(self.path), batch.schema)
+        self.writer.write_batch(batch)
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+
+
+class ParquetSink:
+    def __init__(self, path: Path):
+        self.path = path
+        self.writer: Optional[pq.ParquetWriter] = None
+
+    def write(self, batch: pa.RecordBatch) -> None:
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(str(self.path), batch.schema)
+        self.writer.write_batch(batch)
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+
+
+class CsvSink:
+    def __init__(self, path: Path, delimiter: str):
+        self.path = path
+        self.delimiter = delimiter
+        self.writer: Optional[pv.CSVWriter] = None
+
+    def write(self, batch: pa.RecordBatch) -> None:
+        if self.writer is None:
+            self.writer = pv.CSVWriter(
+                str(self.path), batch.schema, write_options=pv.WriteOptions(delimiter=self.delimiter)
+            )
+        self.writer.write_batch(batch)
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+
+
+class CallbackSink:
+    """Hands every batch to an in-process consumer."""
+
+    def __init__(self, callback: Callable[[pa.RecordBatch], Any]):
+        self.callback = callback
+
+    def write(self, batch: pa.RecordBatch) -> None:
+        self.callback(batch)
+
+    def close(self) -> None:
+        pass
+
+
+def file_sink(path: Path, delimiter: str) -> ResultSink:
+    """A sink writing the format of the file's suffix: .parquet, .csv or else an Arrow stream."""
+    if path.suffix == ".parquet":
+        return ParquetSink(path)
+    if path.suffix == ".csv":
+        return CsvSink(path, delimiter)
+    return ArrowSink(path)
+
+
+@define
+class DownloadStats:
+    query: str
+    format: str
+    bytes: int = 0
+    rows: int = 0
+    batches: int = 0
+    seconds: float = 0.0
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.bytes / self.seconds if self.seconds else 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+class CountingStream(io.RawIOBase):
+    """The body of a streamed response, decoded if it is content encoded anyway, counting the bytes read."""
+
+    def __init__(self, response: Response):
+        self.response = response
+        # The raw stream does not undo a Content-Encoding (e.g. gzip of a proxy) unless told to
+        self.response.raw.decode_content = True
+        self.count = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: Any) -> int:
+        read = self.response.raw.readinto(buffer)
+        self.count += read
+        return read
+
+
+def arrow_batches(stream: io.BufferedReader) -> Iterator[pa.RecordBatch]:
+    with ipc.open_stream(stream) as reader:
+        yield from reader
+
+
+def csv_batches(stream: io.BufferedReader, delimiter: str, block_size: int) -> Iterator[pa.RecordBatch]:
+    """
+    Parses the csv in blocks. Columns are read as strings, as formatted by the result provider,
+    since types inferred from the first block can fail on later ones.
+    """
+    header_line = stream.readline().decode("utf-8-sig")
+    if not header_line:
+        return
+
+    columns = next(csv.reader([header_line], delimiter=delimiter))
+
+    reader = pv.open_csv(
+        stream,
+        read_options=pv.ReadOptions(column_names=columns, block_size=block_size, use_threads=False),
+        parse_options=pv.ParseOptions(delimiter=delimiter, newlines_in_values=True),
+        convert_options=pv.ConvertOptions(
+            column_types={column: pa.string() for column in columns},
+            strings_can_be_null=True,
+        ),
+    )
+    yield from reader
+
+
+_DONE = object()
+
+
+def pump(batches: Iterable[pa.RecordBatch], buffer: queue.Queue, stop: threading.Event) -> None:
+    """Moves the batches to the buffer until they run out or the consumer stops, then the end or the error."""
+    def put(item: Any) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    try:
+        for batch in batches:
+            if not put(batch):
+                return
+        put(_DONE)
+    except Exception as error:
+        put(error)
+
+
+def open_result(session: Session, api: str, query: str, formats: List[str]) -> Optional[Tuple[str, Response]]:
+    """The format and streamed response of the first result provider answering, tried in order."""
+    for result_format in formats:
+        url = f"{api}/{RESULT_PATHS[result_format].format(query=query)}"
+        # Arrow and csv are parsed while streamed, compression would only cost time on both ends of a fast link
+        resp = session.get(url, params={"pretty": "false"}, headers={"Accept-Encoding": "identity"}, stream=True)
+
+        if resp.ok:
+            return result_format, resp
+
+        logging.warning(
+            f"Result {query} is not available as {result_format}, response {resp.status_code}: {resp.text[:200]}"
+        )
+        resp.close()
+
+    return None
+
+
+def download_result(
+        session: Session,
+        api: str,
+        query: str,
+        sink: ResultSink,
+        formats: List[str] = RESULT_FORMATS,
+        delimiter: str = ";",
+        buffer_batches: int = DEFAULT_BUFFER_BATCHES,
+        block_size: int = DEFAULT_BLOCK_SIZE,
+) -> Optional[DownloadStats]:
+    """
+    Streams the result of the query into the sink, from the first of the formats its server provides.
+    Returns None if none is provided. The sink is not closed.
+    """
+    start = time.monotonic()
+
+    opened = open_result(session, api, query, formats)
+    if opened is None:
+        return None
+
+    result_format, resp = opened
+    stats = DownloadStats(query, result_format)
+    body = CountingStream(resp)
+    stream = io.BufferedReader(body, buffer_size=block_size)
+
+    if stats.format == "arrow":
+        batches = arrow_batches(stream)
+    else:
+        batches = csv_batches(stream, delimiter, block_size)
+
+    buffer: queue.Queue = queue.Queue(maxsize=buffer_batches)
+    stop = threading.Event()
+    reader = threading.Thread(target=pump, args=(batches, buffer, stop), name=f"result-{query}", daemon=True)
+    reader.start()
+
+    try:
+        while True:
+            item = buffer.get()
+
+            if item is _DONE:
+                break
+            if isinstance(item, Exception):
+                raise item
+
+            sink.write(item)
+            stats.rows += item.num_rows
+            stats.batches += 1
+    finally:
+        stop.set()
+        # Unblocks the reader if it waits for the network
+        resp.close()
+        reader.join()
+
+    stats.bytes = body.count
+    stats.seconds = time.monotonic() - start
+
+    logging.info(
+        f"Downloaded {stats.rows} rows of {query} as {stats.format} in {stats.batches} batches: "
+        f"{human_bytes(stats.bytes)} in {human_duration(stats.seconds)} at {human_bytes(stats.bytes_per_second)}/s, "
+        f"{stats.rows_per_second:.0f} rows/s"
+    )
+    return stats
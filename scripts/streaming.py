@@ -0,0 +1,80 @@
+"""Streaming request bodies for large files, read through a memory map instead of copying into buffers."""
+import asyncio
+import gzip
+import mmap
+import os
+
+from pathlib import Path
+from typing import AsyncIterator, Callable, Optional
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+
+async def mmap_chunks(
+        path: Path,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        on_chunk: Optional[Callable[[int], None]] = None,
+) -> AsyncIterator[memoryview]:
+    """
+    Yields the file as memoryview slices of a read-only memory map.
+    The slices reference the page cache directly, so nothing is copied into user space buffers.
+    aiohttp only asks for the next chunk once the previous one was handed to the transport and drained,
+    and pages of chunks that were sent already are dropped from the map, so client memory stays flat no matter how large the file is.
+    on_chunk is called with the size of every chunk, right before it is yielded.
+    """
+    # madvise needs page aligned offsets
+    chunk_size = max(mmap.PAGESIZE, chunk_size - chunk_size % mmap.PAGESIZE)
+
+    with path.open("rb") as data:
+        size = os.fstat(data.fileno()).st_size
+
+        if size == 0:
+            return
+
+        mapped = mmap.mmap(data.fileno(), 0, access=mmap.ACCESS_READ)
+
+    can_advise = hasattr(mapped, "madvise")
+
+    if can_advise:
+        mapped.madvise(mmap.MADV_SEQUENTIAL)
+
+    view = memoryview(mapped)
+
+    try:
+        for offset in range(0, size, chunk_size):
+            chunk = view[offset:offset + chunk_size]
+
+            if on_chunk:
+                on_chunk(len(chunk))
+
+            yield chunk
+
+            # Dropping pages of a read-only file map is always safe, they would be read from the file again
+            sent = offset - chunk_size
+            if can_advise and sent >= 0:
+                mapped.madvise(mmap.MADV_DONTNEED, sent, chunk_size)
+    finally:
+        view.release()
+        try:
+            mapped.close()
+        except BufferError:
+            # The transport may still hold a slice of an aborted request, the map is released with it.
+            pass
+
+
+async def gunzip_chunks(
+        path: Path,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        on_chunk: Optional[Callable[[int], None]] = None,
+) -> AsyncIterator[bytes]:
+    """Yields the decompressed content of a gzip file, decompressing on a worker thread off the event loop."""
+    with gzip.open(path, "rb") as data:
+        while True:
+            chunk = await asyncio.to_thread(data.read, chunk_size)
+            if not chunk:
+                return
+
+            if on_chunk:
+                on_chunk(len(chunk))
+
+            yield chunk
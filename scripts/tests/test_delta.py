@@ -0,0 +1,108 @@
+"""High-water marks of appended, rewritten and truncated sourceFiles. Run from scripts/: python -m unittest discover tests"""
+import csv
+import tempfile
+import unittest
+
+from pathlib import Path
+
+from pipeline.delta import extract_delta, initial_watermark, window_hash
+
+HEADER = "hadm_id,admittime\n"
+ROWS = [f"{index},2180-01-{index:02d}\n" for index in range(1, 11)]
+
+
+class ExtractDeltaTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+        self.csv = self.dir / "admissions.csv"
+        self.write(ROWS)
+        self.mark = initial_watermark(self.csv, ",")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, rows):
+        self.csv.write_text(HEADER + "".join(rows))
+
+    def extract(self):
+        return extract_delta(self.csv, self.dir / "delta.csv", self.mark, "d1", ",")
+
+    def delta_rows(self):
+        with (self.dir / "delta.csv").open(newline="") as data:
+            return list(csv.reader(data))[1:]
+
+    def test_initial(self):
+        self.assertEqual(self.mark.offset, self.csv.stat().st_size)
+        self.assertEqual(self.mark.rows, 10)
+        self.assertEqual(self.mark.max_date, "2180-01-10")
+
+    def test_unchanged(self):
+        delta = self.extract()
+        self.assertEqual(delta.rows, 0)
+        self.assertEqual(delta.watermark.window_hash, self.mark.window_hash)
+        self.assertEqual(delta.watermark.tags, [])
+
+    def test_append(self):
+        with self.csv.open("a") as data:
+            data.write("11,2180-02-01\n12,2180-02-02\n13,2180-02-0")
+
+        delta = self.extract()
+
+        # The unterminated last line may still be written
+        self.assertEqual(self.delta_rows(), [["11", "2180-02-01"], ["12", "2180-02-02"]])
+        self.assertEqual(delta.watermark.rows, 12)
+        self.assertEqual(delta.watermark.offset, self.csv.stat().st_size - len("13,2180-02-0"))
+        self.assertEqual(delta.watermark.max_date, "2180-02-02")
+        self.assertEqual(delta.watermark.tags, ["d1"])
+
+    def test_rewrite(self):
+        # Written again in another order, with one new row
+        self.write(["11,2180-02-01\n"] + ROWS[::-1])
+
+        delta = self.extract()
+
+        self.assertEqual(self.delta_rows(), [["11", "2180-02-01"]])
+        self.assertEqual(delta.watermark.rows, 11)
+        self.assertEqual(delta.watermark.offset, self.csv.stat().st_size)
+
+    def test_rewrite_with_changed_rows(self):
+        self.write(ROWS[1:] + ["11,2180-02-01\n"])
+
+        with self.assertRaises(ValueError):
+            self.extract()
+
+    def test_truncation(self):
+        self.write(ROWS[:5])
+
+        with self.assertRaises(ValueError):
+            self.extract()
+
+    def test_truncation_without_dates(self):
+        self.mark.date_column = None
+        self.write(ROWS[:5])
+
+        with self.assertRaises(ValueError):
+            self.extract()
+
+
+class WindowHashTest(unittest.TestCase):
+
+    def test_window(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "data"
+            path.write_bytes(b"a" * 100)
+            marked = window_hash(path, 100, window=10)
+
+            # Only the first and last 10 bytes count, and the offset
+            path.write_bytes(b"a" * 10 + b"b" * 80 + b"a" * 10)
+            self.assertEqual(window_hash(path, 100, window=10), marked)
+
+            path.write_bytes(b"a" * 90 + b"b" + b"a" * 9)
+            self.assertNotEqual(window_hash(path, 100, window=10), marked)
+            self.assertNotEqual(window_hash(path, 99, window=10), window_hash(path, 100, window=10))
+
+
+if __name__ == "__main__":
+    unittest.main()
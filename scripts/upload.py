@@ -0,0 +1,150 @@
+#!python3
+"""
+Ad-hoc (re-)upload of single tables, concepts or cqpps, e.g.
+`upload.py table --files json/adb/tables/*.table.json --datasets adb`.
+Files are matched to datasets by their folder and uploaded concurrently over pooled connections.
+"""
+import argparse
+import logging
+import sys
+
+from pathlib import Path
+from typing import Any, Dict, List, Set
+
+from common import configure_logger, get_authorized_session, get_configured_arg_parser, get_datasets, remove_suffix, \
+    Dataset
+from descriptors import csv_delimiter, load_config, load_import_descriptors
+from planner import ENTITIES_SUFFIX, ORDER_KEYS, EntityCounter, plan_uploads
+from uploader import DEFAULT_PARALLELISM, ResponseSnapshot, UploadJob, match_files, upload_jobs
+
+
+def table_jobs(arg_dict: Dict[str, Any], datasets: Set[Dataset], api_datasets: str) -> List[UploadJob]:
+    return [
+        UploadJob(
+            dataset=dataset,
+            url=f"{api_datasets}/{dataset.name}/tables",
+            file=table,
+            label=f"Upload table {dataset.name}.{remove_suffix(table.name, '.table.json')}",
+        )
+        for dataset, table in match_files(arg_dict["files"], datasets)
+    ]
+
+
+def concept_jobs(arg_dict: Dict[str, Any], datasets: Set[Dataset], api_datasets: str) -> List[UploadJob]:
+    method, verb = ("PUT", "Update") if arg_dict["update"] else ("POST", "Upload")
+
+    return [
+        UploadJob(
+            dataset=dataset,
+            url=f"{api_datasets}/{dataset.name}/concepts",
+            file=concept,
+            label=f"{verb} concept {dataset.name}.{remove_suffix(concept.name, '.concept.json')}",
+            method=method,
+        )
+        for dataset, concept in match_files(arg_dict["files"], datasets)
+    ]
+
+
+def cqpp_jobs(arg_dict: Dict[str, Any], datasets: Set[Dataset], api_datasets: str) -> List[UploadJob]:
+    method = "PUT" if arg_dict["update"] else "POST"
+
+    cqpps = []
+    for file in arg_dict["files"]:
+        match = file.name.split(".")
+
+        if match[-1] != "cqpp":
+            continue
+
+        if len(match) != 3:
+            logging.warning(f"{file} not matching `$table.$tag.cqpp`")
+            continue
+
+        cqpps.append(file)
+
+    count_entities = None
+    if arg_dict["order"] == "entities":
+        count_entities = EntityCounter(
+            load_import_descriptors(arg_dict["imports"]) if arg_dict["imports"] else [], arg_dict["csv"],
+            csv_delimiter(load_config(arg_dict["config"])),
+        )
+
+    # Import table with most distinct PIDs first for dictionary
+    cqpps = plan_uploads(cqpps, arg_dict["order"], size=lambda file: file.stat().st_size, entities=count_entities)
+
+    return [
+        UploadJob(
+            dataset=dataset,
+            url=f"{api_datasets}/{dataset.name}/cqpp",
+            file=cqpp,
+            label=f"Uploading `{cqpp}` to `{dataset}.{cqpp.name.split('.')[0]}.{cqpp.name.split('.')[1]}`",
+            method=method,
+            headers={"Content-Type": "application/octet-stream"},
+        )
+        for dataset, cqpp in match_files(cqpps, datasets)
+    ]
+
+
+def main_upload():
+    # The common arguments go to every subcommand, so they can follow it like in the other scripts
+    common = get_configured_arg_parser(add_help=False)
+    common.add_argument("--parallelism", type=int, default=DEFAULT_PARALLELISM,
+                        help=f"Concurrent uploads per dataset, default is {DEFAULT_PARALLELISM}, "
+                             f"0 uploads sequentially for all datasets.")
+
+    parser = argparse.ArgumentParser(description="Upload single tables, concepts or cqpps to the datasets.")
+    kinds = parser.add_subparsers(dest="kind", required=True)
+
+    table = kinds.add_parser("table", parents=[common], help="Upload tables (`*.table.json`).")
+    table.set_defaults(jobs=table_jobs)
+
+    concept = kinds.add_parser("concept", parents=[common], help="Upload concepts (`*.concept.json`).")
+    concept.add_argument("--update", action="store_true", help="Update existing concepts")
+    concept.set_defaults(jobs=concept_jobs)
+
+    cqpp = kinds.add_parser("cqpp", parents=[common], help="Upload preprocessed cqpps (`$table.$tag.cqpp`).")
+    cqpp.add_argument("--update", action="store_true", help="Update cqpps.")
+    cqpp.add_argument("--dry", action="store_true", help="Dry run.")
+    cqpp.add_argument("--order", help="Upload largest first by file size or entity count (`$table.$tag.cqpp.entities`), "
+                                      "by name, or in the given order (glob).", choices=ORDER_KEYS, default="size")
+    cqpp.add_argument("--imports", nargs="+", type=Path,
+                      help="Import descriptors or folders of them, to count entities for `--order entities`.")
+    cqpp.add_argument("--csv", type=Path,
+                      help="Folder of the csvs the cqpps were preprocessed from, to count entities for `--order entities`.")
+    cqpp.set_defaults(jobs=cqpp_jobs)
+
+    for sub in (table, concept, cqpp):
+        sub.add_argument("--files", nargs="+", type=Path, required=True, help=f"{sub.prog.split()[-1]} files to upload")
+
+    arg_dict = vars(parser.parse_args())
+
+    configure_logger(arg_dict)
+
+    if arg_dict.get("order") == "entities" and not (arg_dict["imports"] and arg_dict["csv"]):
+        missing = [file for file in arg_dict["files"]
+                   if file.suffix == ".cqpp" and not file.with_name(file.name + ENTITIES_SUFFIX).exists()]
+        if missing:
+            logging.error(f"`--order entities` needs --imports and --csv to count the entities of {missing}")
+            sys.exit(1)
+
+    datasets = get_datasets(arg_dict)
+
+    api_url, _ = get_authorized_session(arg_dict)
+
+    jobs = arg_dict["jobs"](arg_dict, datasets, api_url + "/datasets")
+
+    if arg_dict.get("dry"):
+        for job in jobs:
+            logging.info(f"{job.label} (dry run)")
+        return
+
+    failures: List[ResponseSnapshot] = upload_jobs(arg_dict, jobs, arg_dict["parallelism"])
+
+    if failures:
+        logging.error(f"Failed {len(failures)} of {len(jobs)} uploads")
+        sys.exit(1)
+
+    logging.info(f"Uploaded {len(jobs)} files")
+
+
+if __name__ == "__main__":
+    main_upload()
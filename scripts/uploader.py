@@ -0,0 +1,223 @@
+"""Shared async engine to upload files to the admin API with bounded concurrency per dataset."""
+import aiohttp
+import asyncio
+import logging
+import random
+import time
+
+from asyncio import Semaphore
+from attr import define, field
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from common import JSON_HEADER, Dataset, get_auth_headers, log_request
+from metrics import record_request
+from streaming import DEFAULT_CHUNK_SIZE, gunzip_chunks
+
+
+@define
+class ResponseSnapshot:
+    """
+    The parts of a response that outlive its connection.
+    Quacks like requests.Response where failures are logged and reported.
+    """
+    url: str
+    status_code: int
+    text: str = ""
+    # Seconds the last attempt took
+    elapsed: float = 0.0
+    retries: int = 0
+
+    @property
+    def ok(self) -> bool:
+        return 0 < self.status_code < 400
+
+    @property
+    def content(self) -> bytes:
+        return self.text.encode()
+
+
+# Responses worth another attempt, everything else >= 400 is a permanent failure
+RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+
+# Responses of a server that does not accept a Content-Encoding, worth sending the body decoded instead
+ENCODING_REFUSED_STATUS = {400, 415}
+
+# Concurrent uploads per dataset if --parallelism is not given, 0 uploads sequentially for all datasets
+DEFAULT_PARALLELISM = 4
+
+MAX_BACKOFF = 60.0
+
+
+def backoff_delay(attempt: int, backoff: float) -> float:
+    """Exponential backoff with full jitter, capped at MAX_BACKOFF seconds."""
+    return random.uniform(0, min(MAX_BACKOFF, backoff * 2 ** attempt))
+
+
+async def send_with_retries(
+        send: Callable[[], Awaitable[ResponseSnapshot]],
+        url: str,
+        label: str,
+        retries: int,
+        backoff: float,
+        on_attempt: Optional[Callable[[ResponseSnapshot], None]] = None,
+) -> ResponseSnapshot:
+    """
+    Awaits send until it succeeds, fails permanently or the retries are used up.
+    Connection errors and timeouts are turned into a ResponseSnapshot with status 0.
+    on_attempt sees the outcome of every attempt, e.g. to adapt the concurrency.
+    """
+    attempt = 0
+
+    while True:
+        started = time.monotonic()
+        try:
+            snapshot = await send()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            snapshot = ResponseSnapshot(url, 0, f"{label} failed: {err!r}")
+
+        snapshot.elapsed = time.monotonic() - started
+        snapshot.retries = attempt
+
+        if on_attempt:
+            on_attempt(snapshot)
+
+        retryable = snapshot.status_code == 0 or snapshot.status_code in RETRY_STATUS
+
+        if snapshot.ok or not retryable or attempt >= retries:
+            return snapshot
+
+        delay = backoff_delay(attempt, backoff)
+        attempt += 1
+
+        # Only info, a retry is not a failure (yet) and must not trip --fail-on-warning
+        logging.info(f"{label} failed with {snapshot.status_code}, retry {attempt}/{retries} in {delay:.1f}s")
+        await asyncio.sleep(delay)
+
+
+@define
+class UploadJob:
+    dataset: Dataset
+    url: str
+    file: Path
+    # Log message prefix, the response code is appended
+    label: str
+    method: str = "POST"
+    headers: Dict[str, str] = field(factory=lambda: dict(JSON_HEADER))
+    # Send a gzip file decompressed right away, instead of only after the server refused the gzip encoding
+    decompressed: bool = False
+    retries: int = 0
+    backoff: float = 0.0
+    chunk_size: int = DEFAULT_CHUNK_SIZE
+
+
+def match_files(files: Iterable[Path], datasets: Iterable[Dataset]) -> List[Tuple[Dataset, Path]]:
+    """
+    Pairs every file with the dataset of its folder (`$json/$dataset/tables/x.table.json`, `$data/$dataset/cqpp/x.cqpp`)
+    in a single pass, files outside the selected datasets are skipped.
+    """
+    by_id = {dataset.id: dataset for dataset in datasets}
+    matched = []
+
+    for file in files:
+        dataset = by_id.get(file.parent.parent.name)
+
+        if dataset is None:
+            logging.debug(f"Skipping {file}, not part of {set(by_id)}")
+            continue
+
+        matched.append((dataset, file))
+
+    return matched
+
+
+def dataset_semaphores(datasets: Iterable[Dataset], parallel: Optional[int]) -> Dict[Dataset, Semaphore]:
+    """
+    If parallelism is set, every dataset gets that many slots,
+    else (0) all datasets share a single slot, making the upload sequential.
+    """
+    if parallel:
+        return {dataset: Semaphore(int(parallel)) for dataset in datasets}
+
+    single_semaphore = Semaphore(1)
+    return {dataset: single_semaphore for dataset in datasets}
+
+
+async def upload_job(
+        job: UploadJob,
+        session: aiohttp.ClientSession,
+        semaphores: Dict[Dataset, Semaphore],
+) -> ResponseSnapshot:
+    """
+    Uploads the file, a gzip encoded one again decompressed if the server refuses the encoding.
+    Only a refused encoding is worth the second upload, e.g. auth or server errors are reported as they are.
+    """
+    async def send() -> ResponseSnapshot:
+        with job.file.open("rb") as data:
+            async with session.request(job.method, job.url, data=data, headers=job.headers) as resp:
+                return ResponseSnapshot(job.url, resp.status, await resp.text())
+
+    # Decompressed bytes of the last attempt
+    sent = 0
+
+    def count_sent(count: int):
+        nonlocal sent
+        sent += count
+
+    async def send_decompressed() -> ResponseSnapshot:
+        nonlocal sent
+        sent = 0
+
+        headers = {key: value for key, value in job.headers.items() if key != "Content-Encoding"}
+        body = gunzip_chunks(job.file, job.chunk_size, count_sent)
+
+        async with session.request(job.method, job.url, data=body, headers=headers) as resp:
+            return ResponseSnapshot(job.url, resp.status, await resp.text())
+
+    async with semaphores[job.dataset]:
+        snapshot = None
+
+        if not job.decompressed:
+            snapshot = await send_with_retries(send, job.url, job.label, job.retries, job.backoff)
+
+            record_request(
+                job.method, job.url, snapshot.status_code, snapshot.elapsed, bytes_sent=job.file.stat().st_size,
+                dataset=job.dataset.name, file=job.file, retries=snapshot.retries,
+            )
+
+            if job.headers.get("Content-Encoding") == "gzip" and snapshot.status_code in ENCODING_REFUSED_STATUS:
+                logging.info(f"{job.label}: gzip encoding refused with {snapshot.status_code}, sending it decompressed")
+                snapshot = None
+
+        if snapshot is None:
+            snapshot = await send_with_retries(send_decompressed, job.url, job.label, job.retries, job.backoff)
+
+            record_request(
+                job.method, job.url, snapshot.status_code, snapshot.elapsed, bytes_sent=sent,
+                dataset=job.dataset.name, file=job.file, retries=snapshot.retries,
+            )
+
+    log_request(msg=f"{job.label} with response {snapshot.status_code}", response=snapshot)
+    return snapshot
+
+
+async def upload_jobs_async(
+        arg_dict: Dict[str, Any],
+        jobs: List[UploadJob],
+        parallel: Optional[int],
+) -> List[ResponseSnapshot]:
+    semaphores = dataset_semaphores({job.dataset for job in jobs}, parallel)
+
+    async with aiohttp.ClientSession(headers=get_auth_headers(arg_dict)) as session:
+        responses = await asyncio.gather(*(upload_job(job, session, semaphores) for job in jobs))
+
+    return [response for response in responses if not response.ok]
+
+
+def upload_jobs(arg_dict: Dict[str, Any], jobs: Iterable[UploadJob], parallel: Optional[int]) -> List[ResponseSnapshot]:
+    """Uploads all jobs concurrently (bounded per dataset) and returns the failed responses."""
+    jobs = list(jobs)
+    if not jobs:
+        return []
+
+    return asyncio.run(upload_jobs_async(arg_dict, jobs, parallel))
@@ -0,0 +1,39 @@
+#!python3
+
+import sys
+
+# Argument Parser
+from pathlib import Path
+
+from common import get_configured_arg_parser, configure_logger
+from descriptors import csv_delimiter, faulty_line_threshold, load_config, load_import_descriptors
+from pipeline.validate import DEFAULT_DATE_FORMATS, validate_imports
+
+root = Path(__file__).parent.parent
+
+parser = get_configured_arg_parser(with_api=False, description='Check the sourceFiles against their import descriptors.')
+
+parser.add_argument('--imports', nargs='+', help='Import descriptors or folders of them.', type=Path,
+                    default=[root / 'datasets' / 'mimic' / 'imports'])
+parser.add_argument('--in', help='Folder of the sourceFiles.', type=Path, default=root / 'csv')
+parser.add_argument('--threshold', help='Maximum share of faulty lines, default is faultyLineThreshold of --config.',
+                    type=float)
+parser.add_argument('--date-formats', nargs='+', help='strptime formats accepted for dates.', default=DEFAULT_DATE_FORMATS)
+
+arg_dict = vars(parser.parse_args())
+
+configure_logger(arg_dict)
+
+config = load_config(arg_dict['config'])
+threshold = arg_dict['threshold'] if arg_dict['threshold'] is not None else faulty_line_threshold(config)
+
+reports = validate_imports(
+    descriptors=load_import_descriptors(arg_dict['imports']),
+    in_dir=arg_dict['in'],
+    delimiter=csv_delimiter(config),
+    threshold=threshold,
+    formats=arg_dict['date_formats'],
+)
+
+if not all(report.passes(threshold) for report in reports):
+    sys.exit(1)
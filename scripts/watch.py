@@ -0,0 +1,72 @@
+"""Picks up files while another process is still writing them, e.g. cqpps during preprocessing."""
+import asyncio
+import logging
+import os
+import time
+
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
+
+# Written to the output folder once preprocessing finished, no more files will appear after it
+DONE_MARKER = "preprocess.done"
+
+DEFAULT_WATCH_INTERVAL = 5.0
+# The marker is only written if preprocessing succeeds, without it a failed run would be watched forever
+DEFAULT_WATCH_TIMEOUT = 3600.0
+
+
+def stat_key(stat: os.stat_result) -> Tuple[int, int]:
+    return stat.st_size, stat.st_mtime_ns
+
+
+async def finalized_files(
+        directory: Path,
+        pattern: str = "*.cqpp",
+        marker: str = DONE_MARKER,
+        interval: float = DEFAULT_WATCH_INTERVAL,
+        timeout: Optional[float] = DEFAULT_WATCH_TIMEOUT,
+) -> AsyncIterator[List[Path]]:
+    """
+    Yields new files matching pattern as soon as they are complete: their size and modification time did not change
+    between two polls (files renamed into place atomically are unchanged from the start), or the marker exists.
+    Ends once the marker exists and all files were yielded.
+    Raises TimeoutError if no file appeared or changed for timeout seconds without the marker, 0 or None waits forever.
+    """
+    previous: Dict[Path, Tuple[int, int]] = {}
+    yielded: Set[Path] = set()
+    last_change = time.monotonic()
+
+    logging.info(f"Watching {directory} for {pattern} until {marker} appears")
+
+    while True:
+        # Look for the marker first, files listed after it are complete
+        done = (directory / marker).exists()
+
+        current: Dict[Path, Tuple[int, int]] = {}
+        for file in directory.glob(pattern):
+            try:
+                current[file] = stat_key(file.stat())
+            except FileNotFoundError:
+                # Renamed or removed since listing
+                continue
+
+        ready = sorted(
+            file for file, stat in current.items()
+            if file not in yielded and (done or previous.get(file) == stat)
+        )
+        if current != previous:
+            last_change = time.monotonic()
+        previous = current
+
+        if ready:
+            yielded.update(ready)
+            yield ready
+
+        if done:
+            logging.info(f"Found {marker} in {directory} after {len(yielded)} files")
+            return
+
+        if timeout and time.monotonic() - last_change > timeout:
+            raise TimeoutError(f"Nothing changed in {directory} for {timeout:.0f}s and {marker} did not appear")
+
+        await asyncio.sleep(interval)
@@ -0,0 +1,243 @@
+"""
+Randomized queries built from the concept definitions, for load tests of the query API.
+Every query is one of a few shapes, drawn with configurable weights, over random concepts, filters and selects.
+"""
+import csv
+import json
+import logging
+import random
+
+from attr import define, field
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from pipeline.searchindex import COUNT_COLUMN, SEARCH_FILTER_TYPES, VALUE_COLUMN, index_name
+
+# Query shapes and their default weights
+DEFAULT_MIX = {
+    # A concept without filters
+    "concept": 1.0,
+    # A concept with one or more filters set
+    "filtered": 4.0,
+    # A concept with selects, which makes the result wider
+    "selects": 2.0,
+    # AND/OR of several concepts, some negated
+    "combined": 2.0,
+    # A concept restricted to a date range
+    "dated": 1.0,
+}
+
+RANGE_TYPES = {"INTEGER": "INTEGER_RANGE", "DECIMAL": "REAL_RANGE", "REAL": "REAL_RANGE", "MONEY": "MONEY_RANGE"}
+
+DEFAULT_NUMBER_BOUNDS = (0, 100)
+# MIMIC's dates are shifted into this range
+DEFAULT_YEARS = (2110, 2210)
+
+
+@define
+class QueryFilter:
+    id: str
+    type: str
+    column: str
+    # Filter value type of the query, e.g. SELECT or INTEGER_RANGE
+    value_type: str
+
+
+@define
+class QueryConnector:
+    id: str
+    filters: List[QueryFilter] = field(factory=list)
+    selects: List[str] = field(factory=list)
+
+
+@define
+class QueryConcept:
+    # The concept and its children, every one can be queried
+    ids: List[str]
+    connectors: List[QueryConnector]
+
+
+def parse_mix(values: Iterable[str]) -> Dict[str, float]:
+    """Weights from `shape=weight` pairs, shapes not named keep their default weight."""
+    mix = dict(DEFAULT_MIX)
+
+    for value in values:
+        shape, _, weight = value.partition("=")
+        if shape not in DEFAULT_MIX:
+            raise ValueError(f"Unknown query shape {shape}, expected one of {list(DEFAULT_MIX)}")
+        mix[shape] = float(weight)
+
+    if not any(mix.values()):
+        raise ValueError("The query mix has no positive weight")
+
+    return mix
+
+
+def column_types(tables: Iterable[Path]) -> Dict[str, str]:
+    """Type of every `$table.$column` in the table files."""
+    types = {}
+    for table_file in tables:
+        table = json.loads(table_file.read_text())
+        for column in table["columns"]:
+            types[f"{table['name']}.{column['name']}"] = column["type"]
+    return types
+
+
+def load_concepts(concepts: Iterable[Path], dataset: str, types: Dict[str, str]) -> List[QueryConcept]:
+    loaded = []
+
+    def child_ids(element: Dict[str, Any], prefix: str) -> Iterator[str]:
+        for child in element.get("children", []):
+            yield f"{prefix}.{child['name']}"
+            yield from child_ids(child, f"{prefix}.{child['name']}")
+
+    for concept_file in concepts:
+        raw = json.loads(concept_file.read_text())
+        concept_id = f"{dataset}.{raw['name']}"
+
+        connectors = []
+        for connector in raw.get("connectors", []):
+            connector_id = f"{concept_id}.{connector['name']}"
+            filters = []
+
+            for raw_filter in connector.get("filters", []):
+                filter_type, column = raw_filter.get("type"), raw_filter.get("column")
+
+                if filter_type in SEARCH_FILTER_TYPES:
+                    value_type = filter_type
+                elif filter_type == "NUMBER" and types.get(column) in RANGE_TYPES:
+                    value_type = RANGE_TYPES[types[column]]
+                else:
+                    logging.info(f"Not generating values for {filter_type} filter {raw_filter['name']}")
+                    continue
+
+                filters.append(QueryFilter(f"{connector_id}.{raw_filter['name']}", filter_type, column, value_type))
+
+            selects = [f"{connector_id}.{select['name']}" for select in connector.get("selects", [])]
+            connectors.append(QueryConnector(connector_id, filters, selects))
+
+        loaded.append(QueryConcept([concept_id, *child_ids(raw, concept_id)], connectors))
+
+    return loaded
+
+
+def load_filter_values(
+        search_index: Optional[Path],
+        columns: Iterable[str],
+        delimiter: str,
+) -> Dict[str, Tuple[List[str], List[int]]]:
+    """Values of the `$table.$column`s with their frequencies, from the search index csvs of generateSearchIndex.py."""
+    values = {}
+
+    for column in columns:
+        index = search_index / f"{index_name(column)}.csv" if search_index else None
+        if not index or not index.exists():
+            continue
+
+        with index.open(newline="") as data:
+            rows = [(row[VALUE_COLUMN], int(row[COUNT_COLUMN])) for row in csv.DictReader(data, delimiter=delimiter)]
+
+        if rows:
+            values[column] = ([value for value, _ in rows], [count for _, count in rows])
+
+    return values
+
+
+@define
+class QueryGenerator:
+    """Draws queries, the same ones for the same seed."""
+    concepts: List[QueryConcept]
+    # Values with weights per `$table.$column` of the SELECT filters
+    filter_values: Dict[str, Tuple[List[str], List[int]]]
+    mix: Dict[str, float] = field(factory=lambda: dict(DEFAULT_MIX))
+    number_bounds: Tuple[float, float] = DEFAULT_NUMBER_BOUNDS
+    years: Tuple[int, int] = DEFAULT_YEARS
+    rng: random.Random = field(factory=random.Random)
+
+    def __attrs_post_init__(self) -> None:
+        for concept in self.concepts:
+            for connector in concept.connectors:
+                for query_filter in connector.filters:
+                    if not self.has_values(query_filter):
+                        logging.warning(f"No values for {query_filter.id}, it is left out of the queries")
+
+    def has_values(self, query_filter: QueryFilter) -> bool:
+        return query_filter.value_type in RANGE_TYPES.values() or query_filter.column in self.filter_values
+
+    def queries(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Endless (shape, query) pairs."""
+        shapes, weights = list(self.mix), list(self.mix.values())
+        while True:
+            shape = self.rng.choices(shapes, weights)[0]
+            yield shape, getattr(self, shape)()
+
+    def concept(self) -> Dict[str, Any]:
+        return self.query(self.node())
+
+    def filtered(self) -> Dict[str, Any]:
+        return self.query(self.node(filters=True))
+
+    def selects(self) -> Dict[str, Any]:
+        return self.query(self.node(selects=True))
+
+    def combined(self) -> Dict[str, Any]:
+        children = []
+        for _ in range(self.rng.randint(2, 4)):
+            child = self.node(filters=self.rng.random() < 0.5)
+            if self.rng.random() < 0.2:
+                child = {"type": "NEGATION", "child": child}
+            children.append(child)
+
+        return self.query({"type": self.rng.choice(["AND", "OR"]), "children": children})
+
+    def dated(self) -> Dict[str, Any]:
+        start = self.rng.randint(*self.years)
+        end = self.rng.randint(start, self.years[1])
+        return self.query({
+            "type": "DATE_RESTRICTION",
+            "dateRange": {"min": f"{start}-01-01", "max": f"{end}-12-31"},
+            "child": self.node(filters=self.rng.random() < 0.5),
+        })
+
+    def query(self, node: Dict[str, Any]) -> Dict[str, Any]:
+        if node["type"] != "AND":
+            node = {"type": "AND", "children": [node]}
+        return {"type": "CONCEPT_QUERY", "root": node}
+
+    def node(self, filters: bool = False, selects: bool = False) -> Dict[str, Any]:
+        concept = self.rng.choice(self.concepts)
+        tables = []
+
+        for connector in concept.connectors:
+            table: Dict[str, Any] = {"id": connector.id, "filters": [], "selects": []}
+
+            if filters:
+                usable = [value for value in map(self.filter_value, connector.filters) if value]
+                if usable:
+                    table["filters"] = self.rng.sample(usable, self.rng.randint(1, len(usable)))
+
+            if selects and connector.selects:
+                table["selects"] = self.rng.sample(connector.selects, self.rng.randint(1, len(connector.selects)))
+
+            tables.append(table)
+
+        return {"type": "CONCEPT", "ids": [self.rng.choice(concept.ids)], "tables": tables}
+
+    def filter_value(self, query_filter: QueryFilter) -> Optional[Dict[str, Any]]:
+        value: Any
+
+        if query_filter.value_type in RANGE_TYPES.values():
+            low, high = sorted(self.rng.uniform(*self.number_bounds) for _ in range(2))
+            if query_filter.value_type == "INTEGER_RANGE":
+                low, high = int(low), int(high)
+            value = {"min": low, "max": high}
+        elif query_filter.column in self.filter_values:
+            values, weights = self.filter_values[query_filter.column]
+            if query_filter.value_type in ("SELECT", "SINGLE_SELECT"):
+                value = self.rng.choices(values, weights)[0]
+            else:
+                value = list(dict.fromkeys(self.rng.choices(values, weights, k=self.rng.randint(1, 3))))
+        else:
+            return None
+
+        return {"filter": query_filter.id, "type": query_filter.value_type, "value": value}